@@ -190,6 +190,73 @@ REST_FRAMEWORK = {
 NEBULA_USERNAME = os.getenv('NEBULA_USERNAME')
 # NEBULA_PASSWORD = os.getenv('NEBULA_PASSWORD')
 NEBULA_URL = os.getenv('NEBULA_URL')
+NEBULA_WS_URL = os.getenv('NEBULA_WS_URL')
+
+# Pooled HTTP session shared by the Nebula calls of a worker process
+NEBULA_HTTP_POOL_CONNECTIONS = int(os.getenv('NEBULA_HTTP_POOL_CONNECTIONS', 10))
+NEBULA_HTTP_POOL_MAXSIZE = int(os.getenv('NEBULA_HTTP_POOL_MAXSIZE', 20))
+NEBULA_HTTP_POOL_BLOCK = strtobool(os.getenv('NEBULA_HTTP_POOL_BLOCK', 'false'))
+NEBULA_HTTP_KEEPALIVE = strtobool(os.getenv('NEBULA_HTTP_KEEPALIVE', 'true'))
+# In-flight Nebula calls of one event loop (async views served under ASGI)
+NEBULA_ASYNC_MAX_CONNECTIONS = int(os.getenv('NEBULA_ASYNC_MAX_CONNECTIONS', 500))
+# Seconds a Nebula call may take including all of its retries
+NEBULA_REQUEST_DEADLINE = float(os.getenv('NEBULA_REQUEST_DEADLINE', 15))
+# Circuit breaker of each Nebula endpoint family (orders, accounts, assets, instruments, ...)
+NEBULA_BREAKER_FAILURE_THRESHOLD = int(os.getenv('NEBULA_BREAKER_FAILURE_THRESHOLD', 5))
+NEBULA_BREAKER_RESET_TIMEOUT = float(os.getenv('NEBULA_BREAKER_RESET_TIMEOUT', 30))
+NEBULA_BREAKER_HALF_OPEN_CALLS = int(os.getenv('NEBULA_BREAKER_HALF_OPEN_CALLS', 1))
+
+# Django cache of the idempotency keys and of the reference data, e.g.
+# CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache CACHE_LOCATION=127.0.0.1:11211 to share it
+# between workers; the default local memory cache is per process
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'authentium'),
+    }
+}
+# Seconds assets, instruments, calendars, permissions and trading fees stay in the cache without being saved
+REFERENCE_CACHE_TTL = int(os.getenv('REFERENCE_CACHE_TTL', 300))
+
+# Seconds a response to a request carrying an Idempotency-Key header is replayed to duplicates
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+# Seconds after which an unfinished first submission no longer blocks its duplicates
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', 120))
+
+# broker.oms WebSocket sessions: seconds between pings, seconds a request waits for its response and longest wait
+# between reconnection attempts
+OMS_HEARTBEAT_INTERVAL = float(os.getenv('OMS_HEARTBEAT_INTERVAL', 10))
+OMS_REQUEST_TIMEOUT = float(os.getenv('OMS_REQUEST_TIMEOUT', 10))
+OMS_RECONNECT_BACKOFF_MAX = float(os.getenv('OMS_RECONNECT_BACKOFF_MAX', 30))
+# "websocket" places the orders of the API over the broker.oms session of a trader of the account, "rest" over HTTP
+ORDER_ENTRY = os.getenv('ORDER_ENTRY', 'rest')
+
+# consume_executions: seconds execution reports are coalesced and largest batch applied at once
+EXECUTION_BATCH_WINDOW = float(os.getenv('EXECUTION_BATCH_WINDOW', 0.2))
+EXECUTION_BATCH_SIZE = int(os.getenv('EXECUTION_BATCH_SIZE', 500))
+
+# Orders accepted by one POST /api/place_order/batch and Nebula calls it keeps in flight
+PLACE_ORDER_BATCH_MAX_SIZE = int(os.getenv('PLACE_ORDER_BATCH_MAX_SIZE', 100))
+PLACE_ORDER_BATCH_CONCURRENCY = int(os.getenv('PLACE_ORDER_BATCH_CONCURRENCY', 8))
+# Nebula cancellations POST /api/place_order/cancel keeps in flight
+CANCEL_ORDERS_CONCURRENCY = int(os.getenv('CANCEL_ORDERS_CONCURRENCY', 16))
+
+# Queue orders (202 Accepted) instead of waiting for Nebula, and threads of a worker sending queued orders
+PLACE_ORDER_ASYNC = strtobool(os.getenv('PLACE_ORDER_ASYNC', 'false'))
+ORDER_QUEUE_WORKERS = int(os.getenv('ORDER_QUEUE_WORKERS', 8))
+
+# Seconds instrument descriptors stay in the reference data cache
+INSTRUMENT_CACHE_TTL = int(os.getenv('INSTRUMENT_CACHE_TTL', 60))
+
+# Seconds a worker trusts its compiled trading calendars when another worker changed the calendar
+CALENDAR_CACHE_TTL = int(os.getenv('CALENDAR_CACHE_TTL', 60))
+
+# Reject orders locally while the calendar of their instrument has no session running
+CHECK_MARKET_HOURS = strtobool(os.getenv('CHECK_MARKET_HOURS', 'true'))
+
+# JSON backend of the Nebula client and the API responses: auto (orjson when installed), orjson or json
+JSON_CODEC = os.getenv('JSON_CODEC', 'auto')
 
 RANDOM_AES_KEY = ['D', 'v', '4', '4', 'f', 'G', 'w', '1', 'I', 'r', 'E', 'Q', 'N', 'X', 'w', '5', 'C', 'b',
                   'S', 'x', 'w', '4', 'b', 'm', 'K', 'K', 'K', 'b', 'R', 's', 'g', 'w', 'L', 'w', 'v', '/',
@@ -14,10 +14,30 @@ from authentium_market.models import (
 admin.site.register(User)
 admin.site.register(Account)
 admin.site.register(Trader)
-admin.site.register(Order)
-admin.site.register(Balance)
 admin.site.register(Permission)
 admin.site.register(Asset)
 admin.site.register(Calendar)
-admin.site.register(TradingFee)
-admin.site.register(Instrument)
+
+
+# The changelists render __str__, which reads the related rows below
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order_id', 'account', 'instrument', 'side', 'quantity', 'price', 'status')
+    list_select_related = ('account', 'instrument')
+
+
+@admin.register(Balance)
+class BalanceAdmin(admin.ModelAdmin):
+    list_display = ('account', 'asset', 'free', 'locked', 'total')
+    list_select_related = ('account', 'asset')
+
+
+@admin.register(TradingFee)
+class TradingFeeAdmin(admin.ModelAdmin):
+    list_select_related = ('instrument',)
+
+
+@admin.register(Instrument)
+class InstrumentAdmin(admin.ModelAdmin):
+    list_display = ('symbol', 'status', 'base_asset', 'quote_asset', 'calendar_ins')
+    list_select_related = ('base_asset', 'quote_asset', 'calendar_ins')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AuthentiumMarketConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentium_market'
+
+    def ready(self):
+        from authentium_market import signals  # noqa: F401
@@ -0,0 +1,168 @@
+"""
+Async variants of the views that wait on Nebula.
+Served under ASGI a worker keeps many Nebula calls in flight instead of blocking on each one; the ORM is
+still synchronous on Django 3.2, so every database access goes through sync_to_async.
+"""
+from asgiref.sync import sync_to_async
+from django.db.models import F
+from django.shortcuts import get_object_or_404
+from rest_framework.status import HTTP_201_CREATED, HTTP_202_ACCEPTED
+
+from authentium_market.common import json_codec
+from authentium_market.conf.exceptions import APIException, NebulaNotSentException, NebulaUnavailableException
+from authentium_market.conf.handlers import json_response, async_api_view
+from authentium_market.form.place_order_form import (
+    PlaceOrderSerializer,
+    TradingFeeSerializer,
+    CancelPlaceOrderSerializer,
+    OptInSerializer,
+)
+from authentium_market.models import Account, Balance, TradingFee
+from authentium_market.services import orders
+from authentium_market.services.auth import Auth
+from authentium_market.services.idempotency import IdempotentRequest
+from authentium_market.services.nebula_service import AsyncNebulaService
+from authentium_market.services.order_queue import OrderQueue, queue_requested
+from authentium_market.services.instruments import instrument_cache
+from authentium_market.services.reference_cache import asset_cache
+
+
+async def nebula_service():
+    # The token is served from memory, the database is only read when the process has no token yet
+    token = await sync_to_async(Auth().login)()
+    return AsyncNebulaService(token)
+
+
+async def validated_data(request, serializer_class):
+    try:
+        data = json_codec.loads(request.body or b"{}")
+    except ValueError as e:
+        # orjson.JSONDecodeError and json.JSONDecodeError are both ValueError
+        raise APIException(detail=f"JSON parse error - {e}")
+    form = serializer_class(data=data)
+    # Related fields are looked up in the database while validating
+    if not await sync_to_async(form.is_valid)():
+        raise APIException(params=form.errors)
+    return form.data
+
+
+@async_api_view(["POST", "DELETE"])
+async def place_order(request):
+    idempotent = IdempotentRequest(request)
+    if request.method == "DELETE":
+        return await idempotent.arun(lambda: cancel_place_order(request, idempotent.key))
+    return await idempotent.arun(lambda: submit_place_order(request, idempotent.key))
+
+
+async def submit_place_order(request, idempotency_key):
+    data = await validated_data(request, PlaceOrderSerializer)
+    service = await nebula_service()
+
+    ticket = await sync_to_async(orders.load_order)(data)
+    for asset, asset_id in await sync_to_async(orders.missing_balances)(ticket):
+        await service.opt_in_asset(ticket.account.account_id, asset_id)
+        await sync_to_async(orders.open_balance)(ticket, asset)
+
+    await sync_to_async(orders.lock_balance)(ticket)
+
+    if queue_requested(request):
+        order = await sync_to_async(OrderQueue().enqueue)(ticket)
+        return json_response(data={"id": order.pk, "status": order.status}, status_code=HTTP_202_ACCEPTED)
+
+    placement_key = orders.placement_key(idempotency_key)
+    session = await sync_to_async(orders.oms_session)(ticket)
+    try:
+        if session is not None:
+            # Blocks on the answer over the socket, off the event loop and the database thread
+            result = await sync_to_async(session.place_order, thread_sensitive=False)(*orders.place_order_args(ticket))
+        else:
+            result = await service.place_order(*orders.place_order_args(ticket), idempotency_key=placement_key)
+    except NebulaNotSentException:
+        # Nebula never saw the order
+        await sync_to_async(orders.release_balance)(ticket)
+        raise
+    except NebulaUnavailableException:
+        # Nebula may have taken the order, the funds stay reserved
+        order = await sync_to_async(orders.save_unknown_order)(ticket, placement_key, session)
+        return json_response(data={"id": order.pk, "status": order.status}, status_code=HTTP_202_ACCEPTED)
+    except APIException:
+        await sync_to_async(orders.release_balance)(ticket)
+        raise
+    await sync_to_async(orders.save_order)(ticket, result)
+    return json_response(data="The place order is added")
+
+
+async def cancel_place_order(request, idempotency_key):
+    data = await validated_data(request, CancelPlaceOrderSerializer)
+    order_id = data.get('order_id')
+    if not await sync_to_async(orders.is_cancelable)(order_id):
+        return json_response(data='Unsuccessful')
+
+    service = await nebula_service()
+    await service.cancel_place_order(
+        data.get('account_id'), order_id, data.get('instrument'), idempotency_key=idempotency_key
+    )
+    await sync_to_async(orders.mark_canceled)(order_id)
+    return json_response(data='the place order is canceled')
+
+
+@async_api_view(["POST"])
+async def trade_fee(request):
+    data = await validated_data(request, TradingFeeSerializer)
+    taker_fee = data.get("taker_fee", 0)
+    maker_fee = data.get("maker_fee", 0)
+
+    instrument_id = (await sync_to_async(instrument_cache.get)(data.get("instrument"))).instrument_id_broker
+    account_id = (await sync_to_async(Account.objects.get)(pk=data.get("account"))).account_id
+
+    service = await nebula_service()
+    await service.set_trading_fees(account_id, instrument_id, taker_fee, maker_fee)
+
+    await sync_to_async(TradingFee.objects.update_or_create)(
+        account_id=data.get("account"),
+        instrument_id=data.get("instrument"),
+        defaults={
+            "taker_fee": taker_fee,
+            "maker_fee": maker_fee
+        }
+    )
+    return json_response(status_code=HTTP_201_CREATED)
+
+
+@async_api_view(["POST"])
+async def opt_in(request):
+    data = await validated_data(request, OptInSerializer)
+    account = data.get('account')
+    asset = data.get('asset')
+    account_id = (await sync_to_async(Account.objects.get)(pk=account)).account_id
+    asset_id = (await sync_to_async(asset_cache.get)(asset)).asset_id
+
+    service = await nebula_service()
+    await service.opt_in_asset(account_id, asset_id)
+    await sync_to_async(Balance.objects.get_or_create)(account_id=account, asset_id=asset)
+    return json_response(data="The asset is opted in.")
+
+
+@async_api_view(["POST"])
+async def deposit(request):
+    idempotent = IdempotentRequest(request)
+    return await idempotent.arun(lambda: submit_deposit(request, idempotent.key))
+
+
+async def submit_deposit(request, idempotency_key):
+    data = await validated_data(request, OptInSerializer)
+    account = data.get('account')
+    asset = data.get('asset')
+    total = data.get('total') or 0
+    account_id = (await sync_to_async(Account.objects.get)(pk=account)).account_id
+    asset = await sync_to_async(asset_cache.get)(asset)
+    units = orders.deposit_units(asset, total)
+    await sync_to_async(get_object_or_404)(Balance, account_id=account, asset_id=asset.pk)
+
+    service = await nebula_service()
+    await service.send_asset(account_id, asset.asset_id, float(total), idempotency_key=idempotency_key)
+
+    await sync_to_async(Balance.objects.filter(account_id=account, asset_id=asset.pk).update)(
+        free=F('free') + units, total=F('total') + units
+    )
+    return json_response(data=f"The asset is sent {total} asset ")
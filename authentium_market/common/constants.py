@@ -11,8 +11,8 @@ ASSET_DESCRIPTION_MAX_LENGTH = 32
 QUANTITY_PRECISION_MIN = 0
 QUANTITY_PRECISION_MAX = 6
 TOTAL_SUPPLY_MIN = 1
-PAGE_DEFAULT = 1
 DATA_PER_PAGE_DEFAULT = 10
+DATA_PER_PAGE_MAX = 100
 NEBULA_TRADER_EXISTS = 80000
 NEBULA_ACCOUNT_EXISTS = 102
 
@@ -20,3 +20,6 @@ INSTRUMENT_DESCRIPTION_MAX_LENGTH = 1000
 INSTRUMENT_SYMBOL_MAX_LENGTH = 16
 ORDER_FLOW_DEFAULT = "Fully Collateralized Internally"
 TRADE_FLOW_DEFAULT = "External & Internal"
+
+# Seconds before expiry at which the cached Nebula admin token is refreshed in the background
+NEBULA_TOKEN_REFRESH_MARGIN = 60
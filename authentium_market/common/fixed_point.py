@@ -0,0 +1,41 @@
+"""
+Balances and order prices are stored as integers scaled by the precision of their asset or instrument:
+an amount of 12.34 of an asset with quantity_precision 2 is stored as 1234 units.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from rest_framework import serializers
+
+
+def to_units(amount, precision, rounding=ROUND_HALF_EVEN):
+    """
+    :param amount: int, float, str or Decimal in whole units
+    :return: int, amount * 10 ** precision rounded to an integer
+    """
+    return int((Decimal(str(amount)) * 10 ** precision).to_integral_value(rounding))
+
+
+def from_units(units, precision):
+    """
+    :return: Decimal with `precision` decimal places, the inverse of to_units
+    """
+    return Decimal(units).scaleb(-precision)
+
+
+def decimal_places(value):
+    return max(-Decimal(str(value)).normalize().as_tuple().exponent, 0)
+
+
+class AmountField(serializers.DecimalField):
+    """
+    Amount in whole units for the fixed-point fields: validated as a Decimal, converted with to_units by the
+    code that knows the precision
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("max_digits", 30)
+        # Not rounded here, the precision of the asset or instrument decides how many places are allowed
+        kwargs.setdefault("decimal_places", None)
+        # Read back from serializer.data by the views, a Decimal compares and multiplies without a conversion
+        kwargs.setdefault("coerce_to_string", False)
+        super().__init__(**kwargs)
@@ -0,0 +1,64 @@
+"""
+JSON codec shared by the Nebula client and json_response.
+settings.JSON_CODEC picks the backend: "orjson", "json" (standard library) or "auto", which uses orjson when it is
+installed and falls back to the standard library otherwise.
+"""
+import functools
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class StdlibCodec:
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=DjangoJSONEncoder).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    name = "orjson"
+    # Datetimes go through DjangoJSONEncoder so both codecs render them the same way
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson is not None else 0
+
+    def __init__(self):
+        self.encoder = DjangoJSONEncoder()
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=self.encoder.default, option=self.options)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+@functools.lru_cache(maxsize=None)
+def get_codec():
+    backend = getattr(settings, "JSON_CODEC", "auto")
+    if backend == "orjson" or (backend == "auto" and orjson is not None):
+        if orjson is None:
+            raise ImportError("JSON_CODEC is 'orjson' but orjson is not installed")
+        return OrjsonCodec()
+    return StdlibCodec()
+
+
+def dumps(obj):
+    """
+    :return: JSON document as UTF-8 bytes
+    """
+    return get_codec().dumps(obj)
+
+
+def loads(data):
+    """
+    :param data: JSON document as bytes or str
+    """
+    return get_codec().loads(data)
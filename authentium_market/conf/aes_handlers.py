@@ -63,6 +63,9 @@ class AESHandlers:
         :param seed: the array stores the positions of the key's characters
         :return: the AES key
         """
-        key_list = [random_string_list[seed.index(i)] for i in range(len(seed))]
+        # seed[position] is where the character at `position` belongs in the key
+        key_list = [None] * len(seed)
+        for position, index in enumerate(seed):
+            key_list[index] = random_string_list[position]
         key = "".join(key_list)
         return key
@@ -0,0 +1,63 @@
+"""
+ETag and Last-Modified of the reference data GET endpoints, so polling clients get 304 Not Modified instead of the
+payload. Validators come from one aggregate query per request: updated_at of the row for a detail endpoint,
+max(updated_at) and the row count for a list endpoint; the view itself only runs when the client copy is stale.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+
+def memoized(request, key, compute):
+    # etag_func and last_modified_func of a request share the result of one query
+    state = request.__dict__.setdefault("_conditional_state", {})
+    if key not in state:
+        state[key] = compute()
+    return state[key]
+
+
+def digest(*parts):
+    return hashlib.blake2b(":".join(str(part) for part in parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def conditional_list(model):
+    """
+    Decorator of the get method of a list view of `model`. The ETag also covers the query string, which selects
+    the page and the fields.
+    """
+    def state(request):
+        return memoized(request, model, lambda: model.objects.aggregate(last=Max("updated_at"), count=Count("pk")))
+
+    def etag(request, *args, **kwargs):
+        values = state(request)
+        return digest(model._meta.label, values["count"], values["last"], request.GET.urlencode())
+
+    def last_modified(request, *args, **kwargs):
+        return state(request)["last"]
+
+    return method_decorator(condition(etag_func=etag, last_modified_func=last_modified))
+
+
+def conditional_detail(model):
+    """
+    Decorator of the get method of a detail view of `model` taking the primary key as `pk`
+    """
+    def updated_at(request, pk):
+        def compute():
+            try:
+                return model.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+            except (ValueError, TypeError):
+                # Not a primary key, the view answers as it always did
+                return None
+        return memoized(request, (model, pk), compute)
+
+    def etag(request, pk, *args, **kwargs):
+        value = updated_at(request, pk)
+        return None if value is None else digest(model._meta.label, pk, value)
+
+    def last_modified(request, pk, *args, **kwargs):
+        return updated_at(request, pk)
+
+    return method_decorator(condition(etag_func=etag, last_modified_func=last_modified))
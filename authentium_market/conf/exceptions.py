@@ -15,3 +15,27 @@ class APIException(Exception):
             self.detail = '|'.join(errors)
         elif detail is not None:
             self.detail = str(detail)
+
+
+class NebulaUnavailableException(APIException):
+    code = 503
+    title = 'Service unavailable'
+    detail = 'Nebula is unavailable, please retry later'
+
+
+class NebulaNotSentException(NebulaUnavailableException):
+    """
+    Nebula is unavailable and the request was not sent, e.g. the circuit is open: it certainly had no effect
+    """
+
+
+class ConflictException(APIException):
+    code = 409
+    title = 'Conflict'
+    detail = 'Conflict'
+
+
+class UnprocessableEntityException(APIException):
+    code = 422
+    title = 'Unprocessable entity'
+    detail = 'Unprocessable entity'
@@ -1,7 +1,10 @@
-from django.http import JsonResponse
+import functools
+
+from django.http import HttpResponse, HttpResponseNotAllowed
 from rest_framework.views import exception_handler
 from .exceptions import APIException
-from django.core.paginator import Page
+from .pagination import CursorPage
+from authentium_market.common import json_codec
 
 
 def json_response(data=None, status_code=200, pagination=None):
@@ -10,15 +13,10 @@ def json_response(data=None, status_code=200, pagination=None):
     if data is not None:
         response_data['data'] = data
 
-    if pagination is not None and isinstance(pagination, Page):
-        response_data['pagination'] = {
-            'page': pagination.number,
-            'per_page': pagination.paginator.per_page,
-            'num_pages': pagination.paginator.num_pages,
-            'total': pagination.paginator.count
-        }
+    if pagination is not None and isinstance(pagination, CursorPage):
+        response_data['pagination'] = pagination.pagination()
 
-    return JsonResponse(data=response_data, status=status_code)
+    return HttpResponse(json_codec.dumps(response_data), status=status_code, content_type='application/json')
 
 
 def api_exception_handler(exc, context):
@@ -27,13 +25,38 @@ def api_exception_handler(exc, context):
     response = exception_handler(exc, context)
 
     if isinstance(exc, APIException):
-        err_data = {
-          'code': exc.code,
-          'title': exc.title,
-          'detail': exc.detail
-        }
-        response_data = {'errors': err_data}
-
-        return JsonResponse(data=response_data, safe=False, status=exc.code)
-
-    return response
\ No newline at end of file
+        return error_response(exc)
+
+    return response
+
+
+def error_response(exc):
+    err_data = {
+      'code': exc.code,
+      'title': exc.title,
+      'detail': exc.detail
+    }
+    response_data = {'errors': err_data}
+
+    return HttpResponse(json_codec.dumps(response_data), status=exc.code, content_type='application/json')
+
+
+def async_api_view(methods):
+    """
+    Decorator for the async function views: restricts the HTTP methods, exempts the view from CSRF like
+    APIView does and renders APIException the same way as api_exception_handler
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            try:
+                return await view(request, *args, **kwargs)
+            except APIException as exc:
+                return error_response(exc)
+
+        # django.views.decorators.csrf.csrf_exempt wraps coroutines in a sync function on Django 3.2
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
@@ -0,0 +1,100 @@
+"""
+Keyset pagination of the list endpoints.
+Pages are read by primary key: `WHERE id > <last id of the previous page> ORDER BY id LIMIT per_page + 1` walks the
+index, so page 1000 costs the same as page 1, unlike COUNT(*) plus a growing OFFSET. The cursors are opaque to the
+clients; the total is only counted when asked for with ?count=true.
+"""
+import base64
+import binascii
+
+from authentium_market.common import json_codec
+from authentium_market.common.constants import DATA_PER_PAGE_DEFAULT, DATA_PER_PAGE_MAX
+from authentium_market.conf.exceptions import APIException
+from authentium_market.form import BaseSerializer
+
+NEXT = "n"
+PREVIOUS = "p"
+
+
+def encode_cursor(pk, direction):
+    return base64.urlsafe_b64encode(json_codec.dumps([direction, pk])).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    :return: (direction, pk)
+    :raise APIException: when the cursor was not made by encode_cursor
+    """
+    try:
+        direction, pk = json_codec.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if direction in (NEXT, PREVIOUS) and isinstance(pk, int):
+            return direction, pk
+    except (binascii.Error, ValueError, TypeError):
+        pass
+    raise APIException(params={"cursor": ["Invalid cursor."]})
+
+
+def row_pk(row):
+    # Model instance, or dict row of a values() query
+    return row["pk"] if isinstance(row, dict) else row.pk
+
+
+class CursorPage:
+    """
+    One page of a queryset, rendered by json_response as
+        {"per_page": 10, "next": "WyJuIiwxMF0", "prev": null, "total": 25}
+    "next" and "prev" are null on the last and first page, "total" is only there when counted
+    """
+
+    def __init__(self, items, per_page, next_cursor, prev_cursor, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def pagination(self):
+        data = {"per_page": self.per_page, "next": self.next_cursor, "prev": self.prev_cursor}
+        if self.total is not None:
+            data["total"] = self.total
+        return data
+
+
+def paginate(request, query_set):
+    """
+    :param request: request with the ?cursor=, ?per_page= and ?count= parameters of BaseSerializer
+    :param query_set: unordered QuerySet of model instances or of values() rows holding "pk", the page is ordered
+    by primary key
+    :return: CursorPage
+    """
+    form = BaseSerializer(data=request.GET)
+    if not form.is_valid():
+        raise APIException(params=form.errors)
+    per_page = form.validated_data.get("per_page") or DATA_PER_PAGE_DEFAULT
+    cursor = form.validated_data.get("cursor")
+
+    direction, pk = decode_cursor(cursor) if cursor else (NEXT, None)
+    page = query_set.order_by("pk" if direction == NEXT else "-pk")
+    if pk is not None:
+        page = page.filter(pk__gt=pk) if direction == NEXT else page.filter(pk__lt=pk)
+    # One row more than the page tells whether there is another page in that direction
+    items = list(page[:per_page + 1])
+    more = len(items) > per_page
+    items = items[:per_page]
+    if direction == PREVIOUS:
+        items.reverse()
+
+    next_cursor = prev_cursor = None
+    if items:
+        if direction == PREVIOUS or more:
+            next_cursor = encode_cursor(row_pk(items[-1]), NEXT)
+        if (direction == NEXT and pk is not None) or (direction == PREVIOUS and more):
+            prev_cursor = encode_cursor(row_pk(items[0]), PREVIOUS)
+    total = query_set.count() if form.validated_data.get("count") else None
+    return CursorPage(items, per_page, next_cursor, prev_cursor, total)
@@ -13,3 +13,18 @@ class PlaceOrderStatus(Enum):
     INSUFFICIENT_BALANCE = 105
     SUCCESS = 200
     MARKET_CLOSE = 99
+
+
+class OrderStatus(Enum):
+    # Stored locally until Nebula answers, Nebula's own status replaces it afterwards
+    PENDING = 'Pending'
+    REJECTED = 'Rejected'
+    EXECUTED = 'Executed'
+    CANCELED = 'Canceled'
+    # Sent over a broker.oms session that did not answer: Nebula may hold it under an id we do not know, so it is
+    # never sent again and keeps its reservation until reconciled with Nebula
+    UNCONFIRMED = 'Unconfirmed'
+
+
+# Statuses, local or Nebula's, of orders that can no longer trade
+CLOSED_ORDER_STATUSES = ('Executed', 'Canceled', 'Cancelled', 'Rejected', 'Expired')
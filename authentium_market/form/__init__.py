@@ -1,6 +1,152 @@
-from rest_framework import serializers
+import functools
+
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
+
+from ..common.constants import DATA_PER_PAGE_MAX
+from ..conf.exceptions import APIException
+
+# Serializer fields whose representation is the value of the column itself
+PLAIN_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.FloatField,
+    serializers.IntegerField,
+    serializers.JSONField,
+    serializers.PrimaryKeyRelatedField,
+    serializers.ReadOnlyField,
+)
+
+
+def iso_datetime(value, tz=None):
+    """
+    What DateTimeField renders with the default ISO 8601 format
+    :param tz: current time zone, looked up when None
+    """
+    if timezone.is_aware(value):
+        value = value.astimezone(tz or timezone.get_current_timezone())
+    text = value.isoformat()
+    return text[:-6] + "Z" if text.endswith("+00:00") else text
+
+
+def default_converter(field):
+    """
+    :return: converter of the column value of a serializer field, None when the value is the representation
+    """
+    if isinstance(field, PLAIN_FIELDS):
+        return None
+    if isinstance(field, serializers.DateTimeField) and getattr(field, "format", empty) is empty \
+            and api_settings.DATETIME_FORMAT == ISO_8601:
+        return iso_datetime
+    return field.to_representation
 
 
 class BaseSerializer(serializers.Serializer):
-    page = serializers.IntegerField(required=False)
-    per_page = serializers.IntegerField(required=False)
+    # Query parameters of the list endpoints, see conf.pagination
+    cursor = serializers.CharField(required=False)
+    per_page = serializers.IntegerField(required=False, min_value=1, max_value=DATA_PER_PAGE_MAX)
+    count = serializers.BooleanField(required=False)
+
+
+class QueryPlanSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer declaring the relations it renders, so the views load them with the rows: a page of any size
+    costs the same number of queries.
+    The list endpoints take a fast path instead of serializer instances: values() reads only the columns of the
+    fields asked for with ?fields=, and represent() turns the rows into the same output as the serializer.
+    """
+    select_related = ()
+    prefetch_related = ()
+    # Field name -> callable turning the column value into its representation, when default_converter does not
+    # fit the field
+    converters = {}
+
+    @classmethod
+    def query_set(cls):
+        query_set = cls.Meta.model.objects.all()
+        if cls.select_related:
+            query_set = query_set.select_related(*cls.select_related)
+        if cls.prefetch_related:
+            query_set = query_set.prefetch_related(*cls.prefetch_related)
+        return query_set
+
+    @classmethod
+    def values_plan(cls):
+        """
+        :return: dict of field name -> (column, converter or None, whether it is a many-to-many field)
+        """
+        plan = cls.__dict__.get("_values_plan")
+        if plan is None:
+            plan = {}
+            for name, field in cls().fields.items():
+                many = isinstance(field, serializers.ManyRelatedField)
+                converter = None if many else cls.converters.get(name) or default_converter(field)
+                plan[name] = (field.source, converter, many)
+            cls._values_plan = plan
+        return plan
+
+    @classmethod
+    def field_names(cls, request):
+        """
+        :return: fields asked for with ?fields=id,name, every field of the serializer without it
+        :raise APIException: for a field the serializer does not have
+        """
+        plan = cls.values_plan()
+        names = [name.strip() for name in request.GET.get("fields", "").split(",") if name.strip()]
+        unknown = [name for name in names if name not in plan]
+        if unknown:
+            raise APIException(params={"fields": [f"Unknown field {name}." for name in unknown]})
+        return names or list(plan)
+
+    @classmethod
+    def values(cls, names):
+        """
+        :return: QuerySet of dict rows holding "pk" and the columns of the fields in `names`
+        """
+        plan = cls.values_plan()
+        columns = {plan[name][0] for name in names if not plan[name][2]}
+        return cls.Meta.model.objects.values("pk", *columns)
+
+    @classmethod
+    def represent(cls, rows, names):
+        """
+        Representation of rows of values(names), one query per many-to-many field
+        :return: list of dict
+        """
+        plan = cls.values_plan()
+        pks = [row["pk"] for row in rows]
+        related = {name: cls.related_pks(plan[name][0], pks) for name in names if plan[name][2] and pks}
+        # The current time zone is looked up once per page rather than once per value
+        tz = timezone.get_current_timezone()
+        fields = [
+            (name, column, functools.partial(converter, tz=tz) if converter is iso_datetime else converter, many)
+            for name, (column, converter, many) in ((name, plan[name]) for name in names)
+        ]
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, converter, many in fields:
+                if many:
+                    item[name] = related[name].get(row["pk"], [])
+                else:
+                    value = row[column]
+                    item[name] = value if converter is None or value is None else converter(value)
+            data.append(item)
+        return data
+
+    @classmethod
+    def related_pks(cls, name, pks):
+        """
+        :return: dict of pk -> pks of the rows a many-to-many field of these rows points to, in the order they were
+        added
+        """
+        field = cls.Meta.model._meta.get_field(name)
+        source, target = f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"
+        related = {}
+        links = field.remote_field.through.objects.filter(**{f"{source}__in": pks}).order_by("pk")
+        for pk, related_pk in links.values_list(source, target):
+            related.setdefault(pk, []).append(related_pk)
+        return related
@@ -1,9 +1,12 @@
 from rest_framework import serializers
 
+from authentium_market.form import QueryPlanSerializer
 from authentium_market.models import Permission, Account
 
 
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(QueryPlanSerializer):
+    prefetch_related = ('assets',)
+
     class Meta:
         model = Account
         fields = '__all__'
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from authentium_market.form import QueryPlanSerializer
 from authentium_market.models import Asset
 
 
@@ -24,7 +25,7 @@ class AssetUpdateSerializer(serializers.ModelSerializer):
         fields = ['status']
 
 
-class AssetSerializer(serializers.ModelSerializer):
+class AssetSerializer(QueryPlanSerializer):
     class Meta:
         model = Asset
         fields = '__all__'
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from authentium_market.form import QueryPlanSerializer
 from authentium_market.models import Calendar
 
 
@@ -8,7 +9,7 @@ class CalendarSerializer(serializers.ModelSerializer):
         fields = ['name', 'time_zone', 'market_open', 'market_close', 'trading_days', 'holidays']
 
 
-class CalendarViewSerializer(serializers.ModelSerializer):
+class CalendarViewSerializer(QueryPlanSerializer):
     class Meta:
         model = Calendar
         exclude = ('created_at', 'updated_at',)
@@ -1,8 +1,10 @@
 from rest_framework import serializers
+from . import QueryPlanSerializer
 from ..models import Instrument
 
 
-class InstrumentSerializer(serializers.ModelSerializer):
+class InstrumentSerializer(QueryPlanSerializer):
+    # base_asset, quote_asset and calendar_ins are rendered as their pk, read from the row itself
     class Meta:
         model = Instrument
         exclude = (
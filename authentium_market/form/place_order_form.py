@@ -1,8 +1,15 @@
 from rest_framework import serializers
+from ..common.fixed_point import AmountField
 from ..models import TradingFee, Order, Balance
 
 
 class PlaceOrderSerializer(serializers.ModelSerializer):
+    # Looked up by services.orders.load_order together with the balances instead of one query each
+    account = serializers.IntegerField()
+    instrument = serializers.IntegerField()
+    # Order.price is stored in ticks of the instrument, the API speaks whole units
+    price = AmountField()
+
     class Meta:
         model = Order
         exclude = ('created_at', 'updated_at', 'order_id', 'status',)
@@ -20,7 +27,18 @@ class CancelPlaceOrderSerializer(serializers.Serializer):
     instrument = serializers.CharField(max_length=10)
 
 
+class CancelOrdersSerializer(serializers.Serializer):
+    account = serializers.IntegerField()
+    instrument = serializers.IntegerField(required=False)
+    side = serializers.ChoiceField(choices=Order.SideChoices.choices, required=False)
+
+
 class OptInSerializer(serializers.ModelSerializer):
+    # Balance amounts are stored in units of the asset, the API speaks whole units
+    free = AmountField(required=False)
+    locked = AmountField(required=False)
+    total = AmountField(required=False)
+
     def get_unique_together_validators(self):
         """Overriding method to disable unique together checks"""
         return []
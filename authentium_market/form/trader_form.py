@@ -1,8 +1,11 @@
 from rest_framework import serializers
+from authentium_market.form import QueryPlanSerializer
 from authentium_market.models import Trader
 
 
-class TraderSerializer(serializers.ModelSerializer):
+class TraderSerializer(QueryPlanSerializer):
+    prefetch_related = ('permissions',)
+
     class Meta:
         model = Trader
         fields = '__all__'
@@ -0,0 +1,37 @@
+import json
+import timeit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from authentium_market.conf.aes_handlers import AESHandlers
+from authentium_market.services.auth import Auth, NebulaCredentials
+
+
+class Command(BaseCommand):
+    help = "Measure the per-request cost of building Auth and reading the Nebula admin password"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        number = options["number"]
+        random_aes_key = settings.RANDOM_AES_KEY
+        random_seed = json.loads(settings.RANDOM_SEED)
+        cypher_key = settings.CYPHER_NEBULA_PASSWORD
+
+        # What every view construction paid before the password was memoized
+        self.report("derive password per request", number, lambda: NebulaCredentials.get_password(
+            random_aes_key, json.loads(settings.RANDOM_SEED), cypher_key
+        ))
+        self.report("quadratic key conversion", number, lambda: "".join(
+            random_aes_key[random_seed.index(i)] for i in range(len(random_seed))
+        ))
+        self.report("linear key conversion", number, lambda: AESHandlers().convert_key(random_aes_key, random_seed))
+
+        NebulaCredentials.password()
+        self.report("Auth() + password, memoized", number, lambda: Auth().password)
+
+    def report(self, name, number, func):
+        seconds = timeit.timeit(func, number=number)
+        self.stdout.write(f"{name:<32} {seconds / number * 1e6:>9.2f} us/call")
@@ -0,0 +1,67 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+
+from authentium_market.common.json_codec import StdlibCodec, OrjsonCodec, orjson
+
+
+class Command(BaseCommand):
+    help = "Compare the JSON codecs on a large list response and on Nebula order payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000, help="Items of the list response")
+        parser.add_argument("--number", type=int, default=20, help="Runs of the list response benchmark")
+        parser.add_argument("--orders", type=int, default=20000, help="Runs of the order payload benchmark")
+
+    def handle(self, *args, **options):
+        codecs = [StdlibCodec()]
+        if orjson is not None:
+            codecs.append(OrjsonCodec())
+        else:
+            self.stdout.write("orjson is not installed, only the standard library codec is measured")
+
+        listing = {"data": [self.instrument(i) for i in range(options["rows"])]}
+        order = {
+            "orderType": "Limit",
+            "side": "Buy",
+            "instrument": "PINE-USD",
+            "quantity": 12.5,
+            "price": 101.25,
+            "timeInForce": "GTC",
+        }
+        order_result = {"orderId": 123456, "status": "Pending", "message": None}
+
+        number = options["number"]
+        self.report("list response JsonResponse", number, lambda: JsonResponse(listing).content)
+        for codec in codecs:
+            self.report(f"list response dumps {codec.name}", number, lambda: codec.dumps(listing))
+            encoded = codec.dumps(listing)
+            self.report(f"list response loads {codec.name}", number, lambda: codec.loads(encoded))
+
+        number = options["orders"]
+        for codec in codecs:
+            self.report(f"order payload dumps {codec.name}", number, lambda: codec.dumps(order))
+            encoded = codec.dumps(order_result)
+            self.report(f"order result loads {codec.name}", number, lambda: codec.loads(encoded))
+
+    @staticmethod
+    def instrument(i):
+        # Shape of InstrumentSerializer output
+        return {
+            "id": i,
+            "symbol": f"SYM{i}-USD",
+            "description": f"Instrument {i}",
+            "base_asset": i,
+            "quote_asset": 1,
+            "price_precision": 2,
+            "quantity_precision": 4,
+            "min_quantity": 0.0001,
+            "max_quantity": 1000000.0,
+            "status": "Active",
+            "calendar": 1,
+        }
+
+    def report(self, name, number, func):
+        seconds = timeit.timeit(func, number=number)
+        self.stdout.write(f"{name:<36} {seconds / number * 1e6:>12.2f} us/call")
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from authentium_market.services.nebula_service import NebulaService, AsyncNebulaService
+
+PLACE_ORDER_ARGS = (1, "Limit", "Buy", "PINE-USD", 1, 10.5, "GTC")
+
+
+RESPONSE_BODY = json.dumps({"orderId": 1, "status": "Accepted"}).encode()
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(RESPONSE_BODY)
+) + RESPONSE_BODY
+
+
+def serve_stub(latency, ports):
+    """
+    Minimal keep-alive HTTP server answering every request like Nebula's place order after `latency` seconds.
+    Runs in its own process so it does not compete with the measured client for the GIL.
+    """
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                await reader.readexactly(length)
+                await asyncio.sleep(latency)
+                writer.write(RESPONSE)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=4096)
+        ports.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+class Command(BaseCommand):
+    help = "Compare blocking and asyncio Nebula clients placing orders against a local stub server"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--latency", type=float, default=0.2, help="Stub response time in seconds")
+        parser.add_argument("--workers", type=int, default=8, help="Sync workers, as gunicorn --workers")
+        parser.add_argument("--concurrency", type=int, default=100, help="In-flight calls of the async client")
+
+    def handle(self, *args, **options):
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve_stub, args=(options["latency"], ports), daemon=True)
+        server.start()
+        try:
+            with override_settings(NEBULA_URL=f"http://127.0.0.1:{ports.get(timeout=10)}/"):
+                self.report("sync (WSGI workers)", *self.run_sync(options["requests"], options["workers"]))
+                self.report("asyncio (one ASGI worker)", *self.run_async(options["requests"], options["concurrency"]))
+        finally:
+            server.terminate()
+
+    @staticmethod
+    def run_sync(requests, workers):
+        service = NebulaService("token")
+
+        def call(_):
+            started = time.perf_counter()
+            service.place_order(*PLACE_ORDER_ARGS)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            latencies = list(executor.map(call, range(requests)))
+        return time.perf_counter() - started, latencies
+
+    @staticmethod
+    def run_async(requests, concurrency):
+        async def run():
+            service = AsyncNebulaService("token")
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def call():
+                async with semaphore:
+                    started = time.perf_counter()
+                    await service.place_order(*PLACE_ORDER_ARGS)
+                    return time.perf_counter() - started
+
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*(call() for _ in range(requests)))
+            return time.perf_counter() - started, latencies
+
+        return asyncio.run(run())
+
+    def report(self, name, elapsed, latencies):
+        latencies = sorted(latencies)
+        self.stdout.write(
+            f"{name:<28} {len(latencies) / elapsed:>9.1f} req/s  "
+            f"p50 {statistics.median(latencies) * 1000:>7.1f} ms  "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:>7.1f} ms"
+        )
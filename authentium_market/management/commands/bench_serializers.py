@@ -0,0 +1,87 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from authentium_market.form.account_form import AccountSerializer
+from authentium_market.form.asset import AssetSerializer
+from authentium_market.form.calendar import CalendarViewSerializer
+from authentium_market.form.instrument_form import InstrumentSerializer
+from authentium_market.form.trader_form import TraderSerializer
+from authentium_market.models import Asset, Calendar, Instrument
+
+
+class Command(BaseCommand):
+    help = "Compare the per-row cost of the list serializers with their values() fast path"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000, help="Rows serialized per run")
+        parser.add_argument("--number", type=int, default=20, help="Runs of each benchmark")
+        parser.add_argument(
+            "--database", action="store_true",
+            help="Also read up to --rows rows of every list endpoint from the database, queries included",
+        )
+
+    def handle(self, *args, **options):
+        rows, number = options["rows"], options["number"]
+        now = timezone.now()
+        samples = [
+            (AssetSerializer, lambda i: Asset(
+                id=i, asset_id=i, name=f"A{i}", description=f"Asset {i}", ledger_system="Algorand",
+                ledger_asset_id=i, quantity_precision=2, total_supply=1000000, status="Active", url="",
+                created_at=now, updated_at=now,
+            )),
+            (CalendarViewSerializer, lambda i: Calendar(
+                id=i, name=f"Calendar{i}", calendar_id=str(i), time_zone="+00:00", market_open="08:00",
+                market_close="16:30", trading_days=["Monday", "Tuesday"], holidays=[],
+                created_at=now, updated_at=now,
+            )),
+            (InstrumentSerializer, lambda i: Instrument(
+                id=i, instrument_id_broker=i, instrument_id_exchange=i, symbol=f"SYM{i}-USD", status="Active",
+                description=f"Instrument {i}", base_asset_id=i, quote_asset_id=1, quote_currency="USD",
+                image_urls=[], calendar_ins_id=1, price_precision=2, quantity_precision=4, min_quantity=0.0001,
+                max_quantity=1000000.0, created_at=now, updated_at=now,
+            )),
+        ]
+        self.stdout.write(f"In memory, {rows} rows")
+        for serializer_class, build in samples:
+            instances = [build(i) for i in range(1, rows + 1)]
+            names = list(serializer_class.values_plan())
+            values = [self.row(serializer_class, instance, names) for instance in instances]
+            self.compare(
+                serializer_class, rows, number,
+                lambda: serializer_class(instances, many=True).data,
+                lambda: serializer_class.represent(values, names),
+            )
+
+        if options["database"]:
+            self.stdout.write(f"From the database, up to {rows} rows")
+            for serializer_class in (
+                    AssetSerializer, AccountSerializer, TraderSerializer, CalendarViewSerializer, InstrumentSerializer):
+                names = list(serializer_class.values_plan())
+                count = min(rows, serializer_class.Meta.model.objects.count())
+                if not count:
+                    continue
+                self.compare(
+                    serializer_class, count, number,
+                    lambda: serializer_class(serializer_class.query_set().order_by("pk")[:rows], many=True).data,
+                    lambda: serializer_class.represent(
+                        list(serializer_class.values(names).order_by("pk")[:rows]), names
+                    ),
+                )
+
+    @staticmethod
+    def row(serializer_class, instance, names):
+        # What values() reads for the instance
+        plan = serializer_class.values_plan()
+        row = {"pk": instance.pk}
+        for name in names:
+            column = plan[name][0]
+            row[column] = getattr(instance, instance._meta.get_field(column).attname)
+        return row
+
+    def compare(self, serializer_class, rows, number, serializer, fast_path):
+        name = serializer_class.__name__
+        for label, func in (("serializer", serializer), ("values()", fast_path)):
+            seconds = timeit.timeit(func, number=number)
+            self.stdout.write(f"{name:<24} {label:<12} {seconds / number / rows * 1e6:>10.2f} us/row")
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from authentium_market.services.auth import Auth
+from authentium_market.services.executions import SUBSCRIBE_EXECUTIONS, ExecutionConsumer
+from authentium_market.services.websocket import OmsSession
+
+
+class Command(BaseCommand):
+    help = "Apply the execution reports streamed by Nebula to Order and Balance, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window", type=float, default=settings.EXECUTION_BATCH_WINDOW,
+                            help="Seconds executions are collected before being applied together")
+        parser.add_argument("--batch-size", type=int, default=settings.EXECUTION_BATCH_SIZE,
+                            help="Executions applied at once at most")
+
+    def handle(self, *args, **options):
+        consumer = ExecutionConsumer(options["window"], options["batch_size"])
+        # The admin session receives the executions of every account
+        session = OmsSession(settings.NEBULA_WS_URL, Auth().login, on_event=consumer.on_event)
+        session.subscribe(SUBSCRIBE_EXECUTIONS, {})
+        self.stdout.write(f"Consuming executions from {settings.NEBULA_WS_URL}")
+        try:
+            consumer.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            consumer.stop()
+            session.close()
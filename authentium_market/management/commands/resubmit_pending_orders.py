@@ -0,0 +1,49 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from authentium_market.constants import OrderStatus
+from authentium_market.models import Order
+from authentium_market.services.order_queue import OrderQueue
+
+logger = logging.getLogger('Log')
+
+
+class Command(BaseCommand):
+    help = "Send again the orders left Pending without a Nebula id by a stopped worker or an unreachable Nebula"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=300, help="Seconds since the order was queued")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Seconds between two passes, keeps running when set; one pass otherwise")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                if not options["interval"]:
+                    self.stdout.write(f"Resubmitted {self.resubmit(options['older_than'])} orders")
+                    break
+                try:
+                    logger.info("Resubmitted %s orders", self.resubmit(options["older_than"]))
+                except Exception:
+                    # Tried again on the next pass, the orders keep their reservation meanwhile
+                    logger.exception("Cannot resubmit pending orders")
+                close_old_connections()
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+    @staticmethod
+    def resubmit(older_than):
+        created_before = timezone.now() - timedelta(seconds=older_than)
+        order_pks = list(Order.objects.filter(
+            status=OrderStatus.PENDING.value, order_id__isnull=True, created_at__lt=created_before
+        ).values_list("pk", flat=True))
+        for order_pk in order_pks:
+            # Sent with the same idempotency key as the first attempt
+            OrderQueue.process(order_pk)
+        return len(order_pks)
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.12 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+def remove_duplicate_tokens(apps, schema_editor):
+    # Keep the most recent token of each type so token_type can become unique
+    Token = apps.get_model('authentium_market', 'Token')
+    for token_type in Token.objects.values_list('token_type', flat=True).distinct():
+        latest = Token.objects.filter(token_type=token_type).order_by('-created_at', '-id').first()
+        Token.objects.filter(token_type=token_type).exclude(id=latest.id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentium_market', '0008_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='token',
+            name='token_type',
+            field=models.CharField(choices=[('Admin', 'Admin'), ('Trader', 'Trader')], max_length=10, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentium_market', '0009_token_token_type_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
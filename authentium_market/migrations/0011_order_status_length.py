@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-18 15:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentium_market', '0010_order_order_id_nullable'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(max_length=32),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+
+def scale(apps, factor):
+    """
+    Multiply balances by 10 ** quantity_precision of their asset and prices by 10 ** price_precision of their
+    instrument (divide when factor is -1), one UPDATE per precision
+    """
+    Asset = apps.get_model('authentium_market', 'Asset')
+    Balance = apps.get_model('authentium_market', 'Balance')
+    Instrument = apps.get_model('authentium_market', 'Instrument')
+    Order = apps.get_model('authentium_market', 'Order')
+
+    def scaled(field, precision):
+        expression = F(field) * 10 ** (precision * factor)
+        # Rounded before the column becomes an integer, float amounts like 0.29 * 100 are not exact
+        return Round(expression) if factor > 0 else expression
+
+    for precision in Asset.objects.values_list('quantity_precision', flat=True).distinct():
+        Balance.objects.filter(asset__quantity_precision=precision).update(
+            free=scaled('free', precision), locked=scaled('locked', precision), total=scaled('total', precision)
+        )
+    for precision in Instrument.objects.values_list('price_precision', flat=True).distinct():
+        Order.objects.filter(instrument__price_precision=precision).update(price=scaled('price', precision))
+
+
+def to_units(apps, schema_editor):
+    scale(apps, 1)
+
+
+def from_units(apps, schema_editor):
+    scale(apps, -1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentium_market', '0011_order_status_length'),
+    ]
+
+    operations = [
+        # Scaled while the columns are still floating point, then converted to integers
+        migrations.RunPython(to_units, from_units),
+        migrations.AlterField(
+            model_name='balance',
+            name='free',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='balance',
+            name='locked',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='balance',
+            name='total',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='price',
+            field=models.BigIntegerField(),
+        ),
+    ]
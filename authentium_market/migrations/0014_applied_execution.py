@@ -0,0 +1,25 @@
+# Generated by Django 3.2.12 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentium_market', '0013_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppliedExecution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tracking_number', models.BigIntegerField(unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'applied execution',
+                'db_table': 'applied_execution',
+            },
+        ),
+    ]
@@ -49,7 +49,7 @@ class Calendar(models.Model):
     trading_days = models.JSONField()
     holidays = models.JSONField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         db_table = 'calendar'
@@ -78,7 +78,7 @@ class Asset(models.Model):
     status = models.CharField(max_length=255, choices=StatusChoices.choices)
     url = models.URLField(max_length=255, default="", blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         db_table = 'asset'
@@ -121,7 +121,7 @@ class Instrument(models.Model):
     min_quantity = models.FloatField()
     max_quantity = models.FloatField()
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         db_table = 'instrument'
@@ -150,7 +150,7 @@ class Account(models.Model):
     assets = models.ManyToManyField(Asset)
     comp_id = models.CharField(max_length=200)
     created_at = models.DateTimeField(editable=False, auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -194,15 +194,20 @@ class Order(models.Model):
         FOK = 'FOK'
         IOC = 'IOC'
 
-    order_id = models.IntegerField()
+    # Nebula id, unknown while an order submitted asynchronously is still queued
+    order_id = models.IntegerField(null=True, blank=True)
     account = models.ForeignKey(Account, models.CASCADE)
     order_type = models.CharField(max_length=10, choices=OrderTypeChoices.choices)
     side = models.CharField(max_length=10, choices=SideChoices.choices)
     instrument = models.ForeignKey(Instrument, models.CASCADE)
     quantity = models.IntegerField()
-    price = models.FloatField()
+    # Ticks of the instrument: price * 10 ** instrument.price_precision, see common.fixed_point
+    price = models.BigIntegerField()
     time_in_force = models.CharField(max_length=10, choices=TimeInForceChoices.choices)
-    status = models.CharField(max_length=10)
+    # Nebula order status, e.g. PartiallyFilled
+    status = models.CharField(max_length=32)
+    # Idempotency key of a placement whose outcome Nebula did not report, resubmit_pending_orders sends it again
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -216,9 +221,10 @@ class Balance(models.Model):
 
     account = models.ForeignKey(Account, models.CASCADE)
     asset = models.ForeignKey(Asset, models.CASCADE)
-    free = models.FloatField(default=0)
-    locked = models.FloatField(default=0)
-    total = models.FloatField(default=0)
+    # Units of the asset: amount * 10 ** asset.quantity_precision, see common.fixed_point
+    free = models.BigIntegerField(default=0)
+    locked = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -252,7 +258,7 @@ class Trader(models.Model):
     email = models.EmailField(unique=True)
     permissions = models.ManyToManyField(Permission)
     created_at = models.DateTimeField(editable=False, auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -269,5 +275,15 @@ class Token(models.Model):
 
     token = models.TextField()
     expires_in = models.IntegerField()
-    token_type = models.CharField(max_length=10, choices=TokenTypeChoices.choices)
+    token_type = models.CharField(max_length=10, choices=TokenTypeChoices.choices, unique=True)
+    created_at = models.DateTimeField(editable=False, auto_now_add=True)
+
+
+class AppliedExecution(models.Model):
+    class Meta:
+        db_table = 'applied_execution'
+        verbose_name = "applied execution"
+
+    # trackingNumber of an execution report already applied to Order and Balance, a resent report is skipped
+    tracking_number = models.BigIntegerField(unique=True)
     created_at = models.DateTimeField(editable=False, auto_now_add=True)
@@ -1,65 +1,195 @@
 import contextlib
 import json
+import logging
+import threading
 import time
 from requests.compat import urljoin
-from authentium_market.services.http_client import HttpClient
+from authentium_market.services.http_client import HttpClient, request_deadline
 from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
 from authentium_market.conf.aes_handlers import AESHandlers
+from authentium_market.common import json_codec
+from authentium_market.common.constants import NEBULA_TOKEN_REFRESH_MARGIN
 from authentium_market.models import Token
 
+logger = logging.getLogger('Log')
+
+
+class TokenCache:
+    """
+    Process-wide, thread-safe holder of the Nebula admin token.
+    The stored Token row is only read on the first call of the process, afterwards the token is served
+    from memory and refreshed in a background thread shortly before it expires. Auth.refresh_token makes sure
+    only one worker asks Nebula for the new token.
+    """
+
+    def __init__(self, refresh_margin=NEBULA_TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded = False
+        # (token, expires_at) is swapped as a whole so readers never see a torn pair
+        self._entry = (None, 0.0)
+
+    def get(self, auth):
+        token, expires_at = self._entry
+        now = time.time()
+        if token is not None and now < expires_at:
+            if now >= expires_at - self.refresh_margin:
+                self._refresh_in_background(auth)
+            return token
+
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._entry = auth.load_token()
+            token, expires_at = self._entry
+            if token is None or time.time() >= expires_at:
+                self._entry = auth.refresh_token()
+            return self._entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._loaded = False
+            self._entry = (None, 0.0)
+
+    def _refresh_in_background(self, auth):
+        # Only one refresh per process at a time, the others keep serving the still valid token
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._background_refresh, args=(auth,), daemon=True).start()
+
+    def _background_refresh(self, auth):
+        try:
+            entry = auth.refresh_token(wait=False)
+            # None: another worker is refreshing, a later call picks its token up from the row
+            if entry is not None:
+                with self._lock:
+                    self._entry = entry
+        except Exception:
+            logger.exception("Cannot refresh Nebula admin token")
+        finally:
+            self._refresh_lock.release()
+            connection.close()
+
+
+class NebulaCredentials:
+    """
+    Nebula admin password, decrypted once per process the first time it is needed
+    """
+    _password = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def password(cls):
+        if cls._password is None:
+            with cls._lock:
+                if cls._password is None:
+                    cls._password = cls.get_password(
+                        settings.RANDOM_AES_KEY,
+                        json.loads(settings.RANDOM_SEED),
+                        settings.CYPHER_NEBULA_PASSWORD,
+                    )
+        return cls._password
+
+    @staticmethod
+    def get_password(random_aes_key, random_seed, cypher_key):
+        aes_handler = AESHandlers()
+        key = aes_handler.convert_key(random_aes_key, random_seed)
+        clean_text = aes_handler.decrypt_data(cypher_key, key)
+        return clean_text
+
 
 class Auth:
     NEBULA_TOKEN = 'NEBULA_TOKEN'
+    token_cache = TokenCache()
 
     def __init__(self):
-        self.aes_handler = AESHandlers()
-        self.random_aes_key = settings.RANDOM_AES_KEY
-        self.random_seed = json.loads(settings.RANDOM_SEED)
-        self.cypher_nebula_password = settings.CYPHER_NEBULA_PASSWORD
-
         self.username = settings.NEBULA_USERNAME
-        self.password = self.get_password(self.random_aes_key, self.random_seed, self.cypher_nebula_password)
 
-    def get_password(self, random_aes_key, random_seed, cypher_key):
-        key = self.aes_handler.convert_key(random_aes_key, random_seed)
-        clean_text = self.aes_handler.decrypt_data(cypher_key, key)
-        return clean_text
+    @property
+    def password(self):
+        # Only needed when Nebula is actually asked for a token
+        return NebulaCredentials.password()
 
     def login(self):
         # TODO Base Authen for Trader
+        return self.token_cache.get(self)
+
+    def load_token(self):
+        """
+        Read the stored admin token
+        :return: (token, expires_at) or (None, 0) if there is no stored token
+        """
         with contextlib.suppress(Token.DoesNotExist):
-            token = Token.objects.get(token_type="Admin")
-            if time.time() - token.created_at.timestamp() < token.expires_in:
-                return token.token
-        result_json = self.__call_nebula_api(
-            'auth/token',
-            "Cannot login",
-        )
-        Token.objects.update_or_create(
-            token_type="Admin",
-            defaults={
-                "token": result_json['token'],
-                "expires_in": result_json['expiresIn']
-            }
+            token = Token.objects.get(token_type=Token.TokenTypeChoices.ADMIN)
+            return token.token, token.created_at.timestamp() + token.expires_in
+        return None, 0.0
+
+    def refresh_token(self, wait=True):
+        """
+        Renew the admin token once across all workers: the Token row stays locked while Nebula is asked for a
+        new token, and callers that waited on the lock reuse the token stored by the worker that held it.
+        :param wait: False for a proactive refresh, which gives up when another worker is already refreshing
+        :return: (token, expires_at), or None when wait is False and the row is locked by another worker
+        """
+        # The row must exist to be locked; token_type is unique so concurrent creation cannot duplicate it
+        Token.objects.get_or_create(
+            token_type=Token.TokenTypeChoices.ADMIN,
+            defaults={"token": "", "expires_in": 0}
         )
-        return result_json['token']
+        skip_locked = not wait and connection.features.has_select_for_update_skip_locked
+        with transaction.atomic():
+            token = Token.objects.select_for_update(skip_locked=skip_locked).filter(
+                token_type=Token.TokenTypeChoices.ADMIN
+            ).first()
+            if token is None:
+                return None
+
+            expires_at = token.created_at.timestamp() + token.expires_in
+            if token.token and time.time() < expires_at - self.token_cache.refresh_margin:
+                # Another worker renewed it while this one was waiting for the lock
+                return token.token, expires_at
+
+            issued_at = time.time()
+            result_json = self.__call_nebula_api(
+                'auth/token',
+                "Cannot login",
+                self.username,
+                self.password,
+            )
+            token.token = result_json['token']
+            token.expires_in = result_json['expiresIn']
+            # created_at is only set automatically on insert
+            token.created_at = timezone.now()
+            token.save(update_fields=["token", "expires_in", "created_at"])
+        return result_json['token'], issued_at + result_json['expiresIn']
+
+    def trader_token(self, email, password):
+        """
+        Log a trader in, for the broker.oms sessions opened on their behalf
+        :return: token
+        """
+        return self.__call_nebula_api('auth/token', "Cannot login trader", email, password)['token']
 
-    def __call_nebula_api(self, url_path, error_message):
+    def __call_nebula_api(self, url_path, error_message, email, password):
         url = urljoin(settings.NEBULA_URL, url_path)
 
         payload = {
-            "email": self.username,
-            "password": self.password
+            "email": email,
+            "password": password
         }
         headers = {'Content-Type': 'application/json'}
 
         http = HttpClient().retry_http()
-        result = http.post(url, headers=headers, data=json.dumps(payload))
+        with request_deadline(settings.NEBULA_REQUEST_DEADLINE):
+            result = http.post(url, headers=headers, data=json_codec.dumps(payload))
 
         if result.status_code != 200:
             raise AuthError(result.status_code, error_message, result.reason)
 
-        return result.json()
+        return json_codec.loads(result.content)
 
 
 class AuthError(Exception):
@@ -0,0 +1,155 @@
+"""
+Trading calendars compiled into sorted session intervals, so whether a market is open is a binary search instead of
+a Nebula round trip.
+"""
+import bisect
+import datetime
+import re
+import threading
+import time
+
+import pytz
+from django.conf import settings
+
+from authentium_market.models import Calendar
+from authentium_market.services.instruments import instrument_cache
+
+UTC_OFFSET = re.compile(r'^([+-])(\d{1,2}):?(\d{2})$')
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def calendar_timezone(name):
+    """
+    :param name: UTC offset such as "+07:00", or a tz database name
+    """
+    match = UTC_OFFSET.match(name or "")
+    if match:
+        sign, hours, minutes = match.groups()
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        return datetime.timezone(-offset if sign == "-" else offset)
+    return pytz.timezone(name)
+
+
+def localize(tz, day, clock):
+    naive = datetime.datetime.combine(day, clock)
+    if hasattr(tz, "localize"):
+        return tz.localize(naive)
+    return naive.replace(tzinfo=tz)
+
+
+def parse_clock(value):
+    return datetime.datetime.strptime(value, "%H:%M").time()
+
+
+class CompiledCalendar:
+    """
+    Sessions of a calendar from `start` for `days` days, as sorted UTC timestamps. A close time not after the open
+    time closes on the next day; a holiday closes the whole day, or early at its closeTime.
+    """
+
+    def __init__(self, calendar, start, days):
+        tz = calendar_timezone(calendar.time_zone)
+        market_open = parse_clock(calendar.market_open)
+        market_close = parse_clock(calendar.market_close)
+        trading_days = {WEEKDAYS.index(day) for day in calendar.trading_days or [] if day in WEEKDAYS}
+        holidays = {}
+        for holiday in calendar.holidays or []:
+            close_time = holiday.get("closeTime") or holiday.get("close_time")
+            holidays[holiday.get("date")] = parse_clock(close_time) if close_time else None
+
+        self.opens = []
+        self.closes = []
+        for offset in range(days):
+            day = start + datetime.timedelta(days=offset)
+            if day.weekday() not in trading_days:
+                continue
+            opens_at = localize(tz, day, market_open)
+            close_day = day if market_close > market_open else day + datetime.timedelta(days=1)
+            closes_at = localize(tz, close_day, market_close)
+            if day.isoformat() in holidays:
+                early_close = holidays[day.isoformat()]
+                if early_close is None:
+                    continue
+                closes_at = min(closes_at, localize(tz, day, early_close))
+                if closes_at <= opens_at:
+                    continue
+            self.opens.append(opens_at.timestamp())
+            self.closes.append(closes_at.timestamp())
+        self.start = localize(tz, start, datetime.time()).timestamp()
+        self.end = localize(tz, start + datetime.timedelta(days=days), datetime.time()).timestamp()
+
+    def covers(self, ts, lookahead):
+        return self.start <= ts and ts + lookahead < self.end
+
+    def session(self, ts):
+        """
+        :return: (open, close) of the session running at ts, None when the market is closed
+        """
+        index = bisect.bisect_right(self.opens, ts) - 1
+        if index >= 0 and ts < self.closes[index]:
+            return self.opens[index], self.closes[index]
+        return None
+
+    def next_open(self, ts):
+        """
+        :return: first session opening after ts, None when there is none within the compiled days
+        """
+        index = bisect.bisect_right(self.opens, ts)
+        return self.opens[index] if index < len(self.opens) else None
+
+
+class CalendarIndex:
+    """
+    Process-wide CompiledCalendar by calendar pk, compiled around the first timestamp asked for and again once
+    lookups move past it. Saving or deleting a calendar invalidates it in the saving process (see signals.py); other
+    worker processes recompile after CALENDAR_CACHE_TTL seconds.
+    """
+    # Compiled days before and after the timestamp of the lookup, the latter bounds how far next_open looks
+    DAYS_BEFORE = 1
+    DAYS_AFTER = 31
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calendars = {}
+
+    def get(self, pk, ts):
+        lookahead = 7 * 24 * 60 * 60
+        entry = self._calendars.get(pk)
+        if entry is not None and time.monotonic() < entry[1] and entry[0].covers(ts, lookahead):
+            return entry[0]
+
+        calendar = Calendar.objects.get(pk=pk)
+        start = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).date()
+        compiled = CompiledCalendar(
+            calendar, start - datetime.timedelta(days=self.DAYS_BEFORE), self.DAYS_BEFORE + self.DAYS_AFTER
+        )
+        with self._lock:
+            self._calendars[pk] = (compiled, time.monotonic() + settings.CALENDAR_CACHE_TTL)
+        return compiled
+
+    def invalidate(self, pk=None):
+        with self._lock:
+            if pk is None:
+                self._calendars = {}
+            else:
+                self._calendars.pop(pk, None)
+
+    def market(self, instrument_pk, ts=None):
+        """
+        :return: dict with is_open, and the close of the running session or the next opening, as UTC timestamps
+        """
+        ts = time.time() if ts is None else ts
+        compiled = self.get(instrument_cache.get(instrument_pk).calendar, ts)
+        session = compiled.session(ts)
+        if session is not None:
+            return {"is_open": True, "closes_at": session[1], "next_open": None}
+        return {"is_open": False, "closes_at": None, "next_open": compiled.next_open(ts)}
+
+    def is_open(self, instrument_pk, ts=None):
+        return self.market(instrument_pk, ts)["is_open"]
+
+    def next_open(self, instrument_pk, ts=None):
+        return self.market(instrument_pk, ts)["next_open"]
+
+
+calendar_index = CalendarIndex()
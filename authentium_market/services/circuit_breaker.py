@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from authentium_market.conf.exceptions import NebulaNotSentException
+
+logger = logging.getLogger('Log')
+
+# Nebula answers these when it is degraded rather than when the request is wrong
+UNAVAILABLE_STATUS_CODES = (502, 503, 504)
+
+
+def endpoint_family(url_path):
+    """
+    Group a Nebula URL path into the family whose health it shares
+    :param url_path: path relative to NEBULA_URL, e.g. "broker/accounts/40/orders"
+    :return: family name
+    """
+    if "/orders" in url_path:
+        return "orders"
+    if url_path.startswith("broker/accounts"):
+        return "accounts"
+    if url_path.startswith("broker/assets"):
+        return "assets"
+    if url_path.startswith(("broker/instruments", "instruments")):
+        return "instruments"
+    if url_path.startswith("broker/traders"):
+        return "traders"
+    if url_path.startswith("calendars"):
+        return "calendars"
+    return url_path.split("/", 1)[0]
+
+
+class CircuitBreaker:
+    """
+    Per worker circuit breaker of one Nebula endpoint family.
+    After `failure_threshold` consecutive failures calls fail fast for `reset_timeout` seconds, then up to
+    `half_open_calls` probes are let through: a successful probe closes the circuit, a failed one opens it again.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, name, failure_threshold, reset_timeout, half_open_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+
+    @classmethod
+    def for_family(cls, family):
+        breaker = cls._breakers.get(family)
+        if breaker is None:
+            with cls._breakers_lock:
+                breaker = cls._breakers.get(family)
+                if breaker is None:
+                    breaker = cls(
+                        family,
+                        failure_threshold=settings.NEBULA_BREAKER_FAILURE_THRESHOLD,
+                        reset_timeout=settings.NEBULA_BREAKER_RESET_TIMEOUT,
+                        half_open_calls=settings.NEBULA_BREAKER_HALF_OPEN_CALLS,
+                    )
+                    cls._breakers[family] = breaker
+        return breaker
+
+    @classmethod
+    def reset_all(cls):
+        with cls._breakers_lock:
+            cls._breakers = {}
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """
+        :raise NebulaNotSentException: when the circuit is open
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise NebulaNotSentException()
+                self._state = self.HALF_OPEN
+                self._probes = 0
+            if self._state == self.HALF_OPEN:
+                now = time.monotonic()
+                if self._probes >= self.half_open_calls:
+                    # A probe that never reported back (e.g. a cancelled task) must not hold the circuit forever
+                    if now - self._probe_started < self.reset_timeout:
+                        raise NebulaNotSentException()
+                    self._probes = 0
+                self._probes += 1
+                self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Nebula %s circuit closed", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("Nebula %s circuit opened after %s failures", self.name, self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probes = 0
+
+    def record_response(self, status_code):
+        if status_code in UNAVAILABLE_STATUS_CODES:
+            self.record_failure()
+        else:
+            self.record_success()
@@ -0,0 +1,222 @@
+"""
+Execution reports streamed by the broker.oms session, applied to Order and Balance in batches.
+"""
+import collections
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from decimal import ROUND_HALF_EVEN, ROUND_UP, Decimal
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from authentium_market.common.fixed_point import from_units, to_units
+from authentium_market.constants import CLOSED_ORDER_STATUSES, Side
+from authentium_market.models import AppliedExecution, Balance, Order
+from authentium_market.services.instruments import instrument_cache
+
+logger = logging.getLogger('Log')
+
+SUBSCRIBE_EXECUTIONS = "v1/broker.oms/executionReports"
+
+# One fill or closing of an order: quantity and price of the fill in whole units, remaining is what is left unfilled
+Execution = namedtuple("Execution", ["execution_id", "order_id", "status", "quantity", "price", "remaining"])
+
+
+def parse_execution(message):
+    """
+    :param message: event of the broker.oms session, e.g.
+        {"q": "v1/broker.oms/executionReports", "sid": 3, "d": {"trackingNumber": 88, "orderId": 5,
+         "orderStatus": "PartiallyFilled", "executedQuantity": 2, "executedPrice": 9.5, "leavesQuantity": 3}}
+    :return: Execution, or None for other events
+    """
+    data = message.get("d")
+    if message.get("q") != SUBSCRIBE_EXECUTIONS or not isinstance(data, dict) or "orderId" not in data:
+        return None
+    return Execution(
+        execution_id=data.get("trackingNumber"),
+        order_id=data["orderId"],
+        status=data.get("orderStatus"),
+        quantity=data.get("executedQuantity") or 0,
+        price=data.get("executedPrice") or 0,
+        remaining=data.get("leavesQuantity") or 0,
+    )
+
+
+def apply_executions(executions):
+    """
+    Apply a batch of executions in one transaction: one query for the orders, one bulk_update of their statuses and
+    one F-expression UPDATE per balance they touch. Executions whose trackingNumber was already applied are skipped,
+    so a batch can be applied again after a failure or a reconnection.
+    Executions of an order not stored yet, e.g. filled before its placement was saved, are neither applied nor
+    recorded: they are returned to be applied once the order shows up.
+    :return: (number of orders updated, list of the executions without an order)
+    """
+    with transaction.atomic():
+        orders = {
+            order.order_id: order
+            for order in Order.objects.filter(order_id__in={execution.order_id for execution in executions})
+        }
+        unmatched = [execution for execution in executions if execution.order_id not in orders]
+        executions = unapplied([execution for execution in executions if execution.order_id in orders])
+        # (account pk, asset pk) -> [free, locked, total] in units of the asset
+        deltas = collections.defaultdict(lambda: [0, 0, 0])
+        changed = {}
+        for execution in executions:
+            order = orders[execution.order_id]
+            instrument = instrument_cache.get(order.instrument_id)
+            base = deltas[order.account_id, instrument.base_asset]
+            quote = deltas[order.account_id, instrument.quote_asset]
+            filled, released = execution.quantity, 0
+            leaves = execution.remaining
+            if execution.status in CLOSED_ORDER_STATUSES:
+                released, leaves = execution.remaining, 0
+            order_price = from_units(order.price, instrument.price_precision)
+            fill_price = Decimal(str(execution.price))
+
+            def base_units(quantity):
+                return to_units(quantity, instrument.base_precision)
+
+            def quote_units(amount, rounding=ROUND_HALF_EVEN):
+                return to_units(amount, instrument.quote_precision, rounding)
+
+            if order.side == Side.BUY.value:
+                # The quote currency was locked at the limit price, rounded up once for the whole quantity: what
+                # is unlocked is the lock of the quantity left before minus the one after, so the rounding of
+                # the fills adds up to the lock. A better fill price frees the difference.
+                locked = (quote_units((execution.remaining + filled) * order_price, ROUND_UP)
+                          - quote_units(leaves * order_price, ROUND_UP))
+                paid = quote_units(filled * fill_price)
+                quote[1] -= locked
+                quote[0] += locked - paid
+                quote[2] -= paid
+                base[0] += base_units(filled)
+                base[2] += base_units(filled)
+            else:
+                base[1] -= base_units(filled + released)
+                base[0] += base_units(released)
+                base[2] -= base_units(filled)
+                quote[0] += quote_units(filled * fill_price)
+                quote[2] += quote_units(filled * fill_price)
+
+            if execution.status:
+                order.status = execution.status
+                changed[order.pk] = order
+
+        Order.objects.bulk_update(changed.values(), ["status"])
+        for (account, asset), (free, locked, total) in deltas.items():
+            if free or locked or total:
+                Balance.objects.filter(account_id=account, asset_id=asset).update(
+                    free=F('free') + free, locked=F('locked') + locked, total=F('total') + total
+                )
+    return len(changed), unmatched
+
+
+def unapplied(executions):
+    """
+    Executions not applied yet, recorded as applied in the current transaction
+    :return: list of Execution, each trackingNumber once
+    """
+    applied = set(AppliedExecution.objects.filter(
+        tracking_number__in={execution.execution_id for execution in executions}
+    ).values_list("tracking_number", flat=True))
+    result, new = [], []
+    for execution in executions:
+        if execution.execution_id is not None:
+            if execution.execution_id in applied:
+                continue
+            applied.add(execution.execution_id)
+            new.append(AppliedExecution(tracking_number=execution.execution_id))
+        result.append(execution)
+    AppliedExecution.objects.bulk_create(new)
+    return result
+
+
+class ExecutionConsumer:
+    """
+    Collect the executions of the session events and apply them every `window` seconds, or as soon as
+    `batch_size` of them are waiting. A batch that cannot be applied is tried again after a window, and an execution
+    whose order is not stored yet goes with the next batches for up to `unmatched_ttl` seconds.
+    """
+
+    def __init__(self, window, batch_size, seen_size=100000, unmatched_ttl=300):
+        self.window = window
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        # Reports resent after a reconnection are dropped here without a query, AppliedExecution catches the others
+        self._seen = collections.OrderedDict()
+        self._seen_size = seen_size
+        self._failed = []
+        self._unmatched_ttl = unmatched_ttl
+        # Execution -> monotonic time it is given up at
+        self._unmatched = {}
+
+    def on_event(self, message):
+        execution = parse_execution(message)
+        if execution is not None:
+            self._queue.put(execution)
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            batch, self._failed = self._failed or self.collect(), []
+            if batch:
+                self.apply(batch)
+
+    def apply(self, batch):
+        """
+        :return: whether the batch was applied; its executions count as seen only then
+        """
+        try:
+            count, unmatched = apply_executions(batch)
+        except Exception:
+            logger.exception("Cannot apply %s executions", len(batch))
+            connection.close()
+            self._failed = batch
+            self._stopped.wait(self.window)
+            return False
+        logger.info("Applied %s executions to %s orders", len(batch) - len(unmatched), count)
+        waiting = set(unmatched)
+        for execution in batch:
+            if execution in waiting:
+                self._unmatched.setdefault(execution, time.monotonic() + self._unmatched_ttl)
+            else:
+                self._unmatched.pop(execution, None)
+                if execution.execution_id is not None:
+                    self._seen[execution.execution_id] = True
+        while len(self._seen) > self._seen_size:
+            self._seen.popitem(last=False)
+        return True
+
+    def collect(self):
+        """
+        :return: executions still waiting for their order and the ones received during one window, duplicates
+            removed
+        """
+        now = time.monotonic()
+        for execution, expires in list(self._unmatched.items()):
+            if expires <= now:
+                logger.warning("Dropped execution %s of unknown order %s", execution.execution_id, execution.order_id)
+                del self._unmatched[execution]
+        batch = list(self._unmatched)
+        ids = {execution.execution_id for execution in batch}
+        deadline = now + self.window
+        while len(batch) < self.batch_size + len(self._unmatched):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                execution = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if execution.execution_id is not None:
+                if execution.execution_id in self._seen or execution.execution_id in ids:
+                    continue
+                ids.add(execution.execution_id)
+            batch.append(execution)
+        return batch
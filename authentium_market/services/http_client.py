@@ -1,10 +1,99 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import socket
+import threading
+import time
+import weakref
+
+import httpx
 import requests
+from django.conf import settings
 from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
+from requests.packages.urllib3.exceptions import MaxRetryError, ResponseError
 from requests.packages.urllib3.util.retry import Retry
 
+from authentium_market.services.metrics import NEBULA_RETRIES
+
 RETRIES = 5
 TIMEOUT = 60
 
+_deadline = contextvars.ContextVar("nebula_deadline", default=None)
+_retry_safe = contextvars.ContextVar("nebula_retry_safe", default=True)
+
+
+@contextlib.contextmanager
+def request_deadline(seconds):
+    """
+    Cap the time the Nebula calls made inside the block may take, retries and backoff included.
+    An earlier deadline set by an enclosing block is kept.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None and current < deadline:
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """
+    :return: seconds left before the current deadline, None outside of request_deadline()
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextlib.contextmanager
+def unsafe_to_retry():
+    """
+    Requests sent inside the block have a side effect at Nebula: they are only retried when they cannot have
+    reached it (failed connection), never after a read error or timeout.
+    """
+    token = _retry_safe.set(False)
+    try:
+        yield
+    finally:
+        _retry_safe.reset(token)
+
+
+class NebulaRetry(Retry):
+    """
+    Retry that gives up once the deadline of request_deadline() has passed, never backs off beyond it, and
+    does not resend requests made inside unsafe_to_retry()
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise MaxRetryError(_pool, url, error or ResponseError("Nebula request deadline exceeded"))
+        retry = super().increment(
+            method=method, url=url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace
+        )
+        # Reached only when the request is going to be resent
+        cause = f"status_{response.status}" if response is not None else type(error).__name__
+        NEBULA_RETRIES.labels(cause).inc()
+        return retry
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        remaining = remaining_time()
+        if remaining is not None:
+            return max(min(backoff, remaining), 0)
+        return backoff
+
+    def _is_method_retryable(self, method):
+        if not _retry_safe.get():
+            return False
+        return super()._is_method_retryable(method)
+
 
 class TimeoutHTTPAdapter(HTTPAdapter):
     def __init__(self, *args, **kwargs):
@@ -12,20 +101,130 @@ class TimeoutHTTPAdapter(HTTPAdapter):
         if "timeout" in kwargs:
             self.timeout = kwargs["timeout"]
             del kwargs["timeout"]
+        # Must be set before HTTPAdapter.__init__, which builds the pool manager
+        self.keep_alive = kwargs.pop("keep_alive", False)
         super().__init__(*args, **kwargs)
 
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keep_alive:
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(*args, **kwargs)
+
     def send(self, request, **kwargs):
         timeout = kwargs.get("timeout")
         if timeout is None:
-            kwargs["timeout"] = self.timeout
+            kwargs["timeout"] = timeout = self.timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            # No single attempt may outlive the deadline
+            remaining = max(remaining, 0.001)
+            if isinstance(timeout, tuple):
+                kwargs["timeout"] = tuple(min(t, remaining) if t is not None else remaining for t in timeout)
+            else:
+                kwargs["timeout"] = min(timeout, remaining)
         return super().send(request, **kwargs)
 
+    def pool_stats(self):
+        """
+        Connection reuse of every host pool opened by this adapter
+        :return: dict keyed by "scheme://host:port"
+        """
+        stats = {}
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "reused": max(pool.num_requests - pool.num_connections, 0),
+            }
+        return stats
+
 
 class HttpClient():
+    """
+    Give out the pooled session shared by every Nebula call of the worker process.
+    The session is built on first use; a forked worker drops the one inherited from its parent and builds
+    its own, so sockets are never shared between processes.
+    """
+    _session = None
+    _adapter = None
+    _lock = threading.Lock()
+
     def retry_http(self) -> requests.Session:
-        retry_strategy = Retry(total=RETRIES, backoff_factor=1)
-        adapter = TimeoutHTTPAdapter(max_retries=retry_strategy)
+        if HttpClient._session is None:
+            with HttpClient._lock:
+                if HttpClient._session is None:
+                    HttpClient._adapter, HttpClient._session = self.__new_session()
+        return HttpClient._session
+
+    @classmethod
+    def pool_stats(cls):
+        if cls._adapter is None:
+            return {}
+        return cls._adapter.pool_stats()
+
+    @classmethod
+    def reset(cls):
+        if cls._session is not None:
+            cls._session.close()
+        cls._session = None
+        cls._adapter = None
+
+    @classmethod
+    def _after_fork(cls):
+        cls._lock = threading.Lock()
+        # The parent's sockets must not be closed from the child, just forget them
+        cls._session = None
+        cls._adapter = None
+
+    @staticmethod
+    def __new_session():
+        retry_strategy = NebulaRetry(total=RETRIES, backoff_factor=1)
+        adapter = TimeoutHTTPAdapter(
+            max_retries=retry_strategy,
+            pool_connections=settings.NEBULA_HTTP_POOL_CONNECTIONS,
+            pool_maxsize=settings.NEBULA_HTTP_POOL_MAXSIZE,
+            pool_block=settings.NEBULA_HTTP_POOL_BLOCK,
+            keep_alive=settings.NEBULA_HTTP_KEEPALIVE,
+        )
         http = requests.Session()
         http.mount("https://", adapter)
         http.mount("http://", adapter)
-        return http
+        return adapter, http
+
+
+class AsyncHttpClient():
+    """
+    Give out the httpx AsyncClient of the running event loop.
+    An AsyncClient is bound to the loop it was created in, so every loop gets its own connection pool.
+    """
+    _clients = weakref.WeakKeyDictionary()
+
+    def retry_http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = AsyncHttpClient._clients.get(loop)
+        if client is None:
+            # httpx only retries failed connection attempts, which matches what Retry does for POST
+            transport = httpx.AsyncHTTPTransport(
+                retries=RETRIES,
+                limits=httpx.Limits(
+                    max_connections=settings.NEBULA_ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.NEBULA_HTTP_POOL_MAXSIZE,
+                ),
+            )
+            client = httpx.AsyncClient(transport=transport, timeout=TIMEOUT)
+            AsyncHttpClient._clients[loop] = client
+        return client
+
+    @classmethod
+    def _after_fork(cls):
+        cls._clients = weakref.WeakKeyDictionary()
+
+
+os.register_at_fork(after_in_child=HttpClient._after_fork)
+os.register_at_fork(after_in_child=AsyncHttpClient._after_fork)
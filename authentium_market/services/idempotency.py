@@ -0,0 +1,96 @@
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from authentium_market.conf.exceptions import APIException, ConflictException, UnprocessableEntityException
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# Stored with the orders Nebula did not answer for (Order.idempotency_key), with room for the batch suffixes
+IDEMPOTENCY_KEY_MAX_LENGTH = 200
+
+
+class IdempotentRequest:
+    """
+    Collapse client submissions carrying the same Idempotency-Key header.
+    The first submission runs and its successful response is stored for IDEMPOTENCY_KEY_TTL seconds and replayed
+    to every later duplicate; a duplicate arriving while the first one is still running is refused with 409 and a
+    key reused with another request body or query string with 422.
+    State lives in Django's cache, so duplicates are only collapsed across workers with a shared cache backend.
+    """
+
+    def __init__(self, request):
+        self.key = request.headers.get(IDEMPOTENCY_HEADER)
+        if self.key and len(self.key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise APIException(detail=f"{IDEMPOTENCY_HEADER} must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+        # Identifies the request the stored response answers, ?async=true included
+        self.fingerprint = None
+        if self.key:
+            query = request.META.get("QUERY_STRING", "").encode("utf-8")
+            self.fingerprint = hashlib.sha256(query + b"\n" + request.body).hexdigest()
+        scope = f"idempotency:{request.method}:{request.path}:{self.key}"
+        self.result_key = f"{scope}:result"
+        self.lock_key = f"{scope}:lock"
+
+    def run(self, view):
+        """
+        :param view: callable producing the response of the first submission
+        """
+        if not self.key:
+            return view()
+        response = self.replay()
+        if response is not None:
+            return response
+        self.acquire()
+        try:
+            # The first submission may have finished between replay() and acquire()
+            response = self.replay()
+            if response is None:
+                response = view()
+                self.store(response)
+        finally:
+            self.release()
+        return response
+
+    async def arun(self, view):
+        """
+        :param view: coroutine function producing the response of the first submission
+        """
+        if not self.key:
+            return await view()
+        response = await sync_to_async(self.replay)()
+        if response is not None:
+            return response
+        await sync_to_async(self.acquire)()
+        try:
+            response = await sync_to_async(self.replay)()
+            if response is None:
+                response = await view()
+                await sync_to_async(self.store)(response)
+        finally:
+            await sync_to_async(self.release)()
+        return response
+
+    def replay(self):
+        stored = cache.get(self.result_key)
+        if stored is None:
+            return None
+        fingerprint, status_code, content = stored
+        if fingerprint != self.fingerprint:
+            raise UnprocessableEntityException(detail="This Idempotency-Key was already used with another request body")
+        return HttpResponse(content, status=status_code, content_type="application/json")
+
+    def acquire(self):
+        if not cache.add(self.lock_key, True, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            raise ConflictException(detail="A request with this Idempotency-Key is already in progress")
+
+    def store(self, response):
+        # Failed submissions are not stored so the client can retry them with the same key
+        if 200 <= response.status_code < 300:
+            result = (self.fingerprint, response.status_code, response.content)
+            cache.set(self.result_key, result, settings.IDEMPOTENCY_KEY_TTL)
+
+    def release(self):
+        cache.delete(self.lock_key)
@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+from django.conf import settings
+
+from authentium_market.models import Instrument
+from authentium_market.services.reference_cache import ReferenceCache
+
+
+class InstrumentDescriptor(namedtuple("InstrumentDescriptor", [
+    "id",
+    "symbol",
+    "status",
+    "instrument_id_broker",
+    "base_asset",
+    "quote_asset",
+    "base_asset_id",
+    "quote_asset_id",
+    # quantity_precision of the assets, the scale of their Balance units
+    "base_precision",
+    "quote_precision",
+    "price_precision",
+    "quantity_precision",
+    "min_quantity",
+    "max_quantity",
+    "calendar",
+])):
+    """
+    What the order path needs to know about an instrument, without touching the database
+    """
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+
+class InstrumentCache(ReferenceCache):
+    """
+    Cache of InstrumentDescriptor by instrument pk or symbol, the one copy of the instruments the requests read.
+    Saving or deleting an instrument or one of its assets invalidates it (see signals.py); entries expire after
+    INSTRUMENT_CACHE_TTL seconds.
+    """
+
+    def __init__(self):
+        super().__init__(Instrument, ["symbol"])
+
+    def query(self, **lookup):
+        instrument = Instrument.objects.select_related("base_asset", "quote_asset").get(**lookup)
+        return InstrumentDescriptor(
+            id=instrument.id,
+            symbol=instrument.symbol,
+            status=instrument.status,
+            instrument_id_broker=instrument.instrument_id_broker,
+            base_asset=instrument.base_asset_id,
+            quote_asset=instrument.quote_asset_id,
+            base_asset_id=instrument.base_asset.asset_id,
+            quote_asset_id=instrument.quote_asset.asset_id,
+            base_precision=instrument.base_asset.quantity_precision,
+            quote_precision=instrument.quote_asset.quantity_precision,
+            price_precision=instrument.price_precision,
+            quantity_precision=instrument.quantity_precision,
+            min_quantity=instrument.min_quantity,
+            max_quantity=instrument.max_quantity,
+            calendar=instrument.calendar_ins_id,
+        )
+
+    def ttl(self):
+        return settings.INSTRUMENT_CACHE_TTL
+
+
+instrument_cache = InstrumentCache()
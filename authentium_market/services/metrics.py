@@ -0,0 +1,130 @@
+"""
+Prometheus metrics of the Nebula calls and of the reference data cache.
+With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the workers: every
+worker then writes its samples there and /metrics aggregates them, whichever worker serves the scrape.
+"""
+import contextlib
+import os
+import time
+
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from authentium_market.common import json_codec
+
+# Upper buckets cover retries up to NEBULA_REQUEST_DEADLINE
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+NEBULA_LATENCY = Histogram(
+    "nebula_request_duration_seconds",
+    "Duration of the Nebula calls, retries included",
+    ["method"],
+    buckets=LATENCY_BUCKETS,
+)
+NEBULA_IN_FLIGHT = Gauge(
+    "nebula_requests_in_flight",
+    "Nebula calls waiting for an answer",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+NEBULA_ERRORS = Counter(
+    "nebula_errors_total",
+    "Failed Nebula calls by Nebula error code, HTTP status (http_<status>) or unavailable",
+    ["method", "code"],
+)
+NEBULA_RETRIES = Counter(
+    "nebula_retries_total",
+    "Nebula requests resent by the retry policy, by cause",
+    ["cause"],
+)
+# Connection reuse of the pooled session of each worker: reused / requests close to 1 means keep-alive works
+NEBULA_POOL_CONNECTIONS = Gauge(
+    "nebula_http_pool_connections",
+    "Connections the pooled Nebula session opened, by host",
+    ["host"],
+    multiprocess_mode="livesum",
+)
+NEBULA_POOL_REQUESTS = Gauge(
+    "nebula_http_pool_requests",
+    "Requests the pooled Nebula session sent, by host",
+    ["host"],
+    multiprocess_mode="livesum",
+)
+NEBULA_POOL_REUSED = Gauge(
+    "nebula_http_pool_reused_requests",
+    "Requests the pooled Nebula session sent on an already open connection, by host",
+    ["host"],
+    multiprocess_mode="livesum",
+)
+# Hit rate: rate(reference_cache_lookups_total{result="hit"}[5m]) / rate(reference_cache_lookups_total[5m])
+REFERENCE_CACHE_LOOKUPS = Counter(
+    "reference_cache_lookups_total",
+    "Lookups of the reference data cache by model, and whether they were a hit or a miss",
+    ["model", "result"],
+)
+
+
+def error_code(response):
+    """
+    :return: the "code" of a Nebula error body, http_<status> when the body carries none
+    """
+    try:
+        code = json_codec.loads(response.content).get("code")
+    except (ValueError, AttributeError):
+        code = None
+    return str(code) if code is not None else f"http_{response.status_code}"
+
+
+@contextlib.contextmanager
+def track_call(method):
+    """
+    Measure one Nebula call: in flight while the block runs, its latency once it ends and an "unavailable"
+    error when the block raises
+    :param method: NebulaService method name
+    """
+    in_flight = NEBULA_IN_FLIGHT.labels(method)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        NEBULA_ERRORS.labels(method, "unavailable").inc()
+        raise
+    finally:
+        in_flight.dec()
+        NEBULA_LATENCY.labels(method).observe(time.perf_counter() - start)
+
+
+def observe_response(method, response):
+    if response.status_code >= 400:
+        NEBULA_ERRORS.labels(method, error_code(response)).inc()
+
+
+def observe_pools(stats):
+    """
+    :param stats: HttpClient.pool_stats()
+    """
+    for host, pool in stats.items():
+        NEBULA_POOL_CONNECTIONS.labels(host).set(pool["connections"])
+        NEBULA_POOL_REQUESTS.labels(host).set(pool["requests"])
+        NEBULA_POOL_REUSED.labels(host).set(pool["reused"])
+
+
+def metrics_view(request):
+    """
+    Text exposition of the metrics of this worker, or of all workers in multiprocess mode
+    """
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
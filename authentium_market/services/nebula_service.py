@@ -1,15 +1,23 @@
-import requests
-import json
+import asyncio
+import contextlib
+import inspect
 import logging
+import uuid
+
+import httpx
+import requests
 from requests.compat import urljoin
-from rest_framework.exceptions import APIException
-from .auth import Auth
+from authentium_market.common import json_codec
 from authentium_market.common.constants import NEBULA_TRADER_EXISTS, NEBULA_ACCOUNT_EXISTS
-from authentium_market.services.http_client import HttpClient
+from authentium_market.services.circuit_breaker import UNAVAILABLE_STATUS_CODES, CircuitBreaker, endpoint_family
+from authentium_market.services.http_client import (
+    HttpClient, AsyncHttpClient, request_deadline, remaining_time, unsafe_to_retry
+)
+from authentium_market.services.idempotency import IDEMPOTENCY_HEADER
+from authentium_market.services import metrics
 from django.conf import settings
-from rest_framework.status import HTTP_200_OK
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR
-from authentium_market.conf.exceptions import APIException
+from authentium_market.conf.exceptions import APIException, NebulaNotSentException, NebulaUnavailableException
 from ..constants import PlaceOrderStatus
 
 from authentium_market.common.constants import ORDER_FLOW_DEFAULT, TRADE_FLOW_DEFAULT
@@ -17,131 +25,181 @@ from authentium_market.common.constants import ORDER_FLOW_DEFAULT, TRADE_FLOW_DE
 logger = logging.getLogger('Log')
 
 
+def circuit_check(breaker, method):
+    try:
+        breaker.before_call()
+    except NebulaNotSentException:
+        metrics.NEBULA_ERRORS.labels(method, "circuit_open").inc()
+        raise
+
+
+def raise_if_unavailable(response, method, url_path):
+    """
+    :raise NebulaUnavailableException: on a gateway error, whose body is usually a proxy page rather than Nebula's
+    JSON and which says nothing of whether the request was processed
+    """
+    if response.status_code in UNAVAILABLE_STATUS_CODES:
+        logger.warning("Nebula %s %s answered %s", method, url_path, response.status_code)
+        raise NebulaUnavailableException()
+
+
+def message_or_raise(error_message):
+    """
+    Build a response handler returning the JSON body on 200 and raising with Nebula's message otherwise
+    """
+    def handle(response):
+        if response.status_code == HTTP_200_OK:
+            return json_codec.loads(response.content)
+        message = json_codec.loads(response.content)["message"]
+        raise APIException(detail=f"{error_message}. Message: {message}")
+    return handle
+
+
 class NebulaService:
+    """
+    Client of the Nebula broker and exchange APIs.
+    Every method describes its request and how to read the response, and hands both to _send(); the
+    blocking transport lives in _send() so AsyncNebulaService can reuse all of the methods as coroutines.
+    """
+
     def __init__(self, token):
         self.token = token
 
     def get_headers(self):
         return {'Authorization': f'Bearer {self.token}', 'Content-Type': 'application/json'}
 
-    def create_account(self, data):
-        url = urljoin(settings.NEBULA_URL, 'broker/accounts')
+    def get_send_headers(self, retry_safe, idempotency_key):
+        headers = self.get_headers()
+        if not retry_safe:
+            # Lets Nebula recognise a request it has already processed
+            headers[IDEMPOTENCY_HEADER] = idempotency_key or str(uuid.uuid4())
+        return headers
+
+    def _send(self, operation, method, url_path, payload, handler, retry_safe=True, idempotency_key=None):
+        """
+        :param operation: name of the calling method, the label of its metrics
+        :param retry_safe: False for calls with a side effect at Nebula (creating, depositing, placing and
+        cancelling orders): they carry an idempotency key and are only retried when the connection failed
+        :param idempotency_key: key sent with an unsafe call, a random one is generated when missing
+        """
+        breaker = CircuitBreaker.for_family(endpoint_family(url_path))
+        circuit_check(breaker, operation)
+        url = urljoin(settings.NEBULA_URL, url_path)
+        data = json_codec.dumps(payload) if payload is not None else None
+        headers = self.get_send_headers(retry_safe, idempotency_key)
 
-        payload = json.dumps({
+        http = HttpClient().retry_http()
+        try:
+            with metrics.track_call(operation), request_deadline(settings.NEBULA_REQUEST_DEADLINE), \
+                    (contextlib.nullcontext() if retry_safe else unsafe_to_retry()):
+                response = http.request(method, url, headers=headers, data=data)
+        except requests.RequestException as e:
+            breaker.record_failure()
+            logger.warning("Nebula %s %s failed: %s", method, url_path, e)
+            raise NebulaUnavailableException() from e
+        breaker.record_response(response.status_code)
+        metrics.observe_response(operation, response)
+        metrics.observe_pools(HttpClient.pool_stats())
+        raise_if_unavailable(response, method, url_path)
+        return handler(response)
+
+    def create_account(self, data):
+        payload = {
             "name": data.get("name"),
             "status": data.get("status")
-        })
-
-        headers = self.get_headers()
+        }
 
-        # Create account in Exberry
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
+        def handle(response):
+            # If account already exists, return
+            if (response.status_code == HTTP_500_INTERNAL_SERVER_ERROR) and \
+                    (json_codec.loads(response.content)["code"] == NEBULA_ACCOUNT_EXISTS):
+                raise APIException(detail="Account name already exists")
+            # If response code is 200, save account to Authentium database
+            elif response.status_code == HTTP_200_OK:
+                return json_codec.loads(response.content)
 
-        # If account already exists, return
-        if (response.status_code == HTTP_500_INTERNAL_SERVER_ERROR) and \
-                (response.json()["code"] == NEBULA_ACCOUNT_EXISTS):
-            raise APIException(detail="Account name already exists")
-        # If response code is 200, save account to Authentium database
-        elif response.status_code == HTTP_200_OK:
-            return response.json()
+            # If response code is not 200 or 500
+            else:
+                raise APIException(detail="Unable to process the request")
 
-        # If response code is not 200 or 500
-        else:
-            raise APIException(detail="Unable to process the request")
+        # Create account in Exberry
+        return self._send('create_account', 'POST', 'broker/accounts', payload, handle, retry_safe=False)
 
     def update_account(self, data, pk):
-        url = urljoin(settings.NEBULA_URL, f"broker/accounts/{pk}")
-
-        payload = json.dumps({
+        payload = {
             "name": data.get("name"),
             "status": data.get("status")
-        })
-
-        headers = self.get_headers()
+        }
 
-        # Update account in Exberry
-        http = HttpClient().retry_http()
-        response = http.patch(url, headers=headers, data=payload)
+        def handle(response):
+            # If update account success, save it to Authentium database
+            if response.status_code == HTTP_200_OK:
+                return
 
-        # If update account success, save it to Authentium database
-        if response.status_code == HTTP_200_OK:
-            return
+            # If response code is not 200
+            else:
+                raise APIException(detail="Unable to process the request")
 
-        # If response code is not 200
-        else:
-            raise APIException(detail="Unable to process the request")
+        # Update account in Exberry
+        return self._send('update_account', 'PATCH', f"broker/accounts/{pk}", payload, handle)
 
     def get_permission(self):
-        url = urljoin(settings.NEBULA_URL, 'broker/traders/permissions')
-
-        headers = self.get_headers()
-
-        http = HttpClient().retry_http()
-        response = http.get(url, headers=headers)
+        def handle(response):
+            if response.status_code == HTTP_200_OK:
+                return json_codec.loads(response.content)
 
-        if response.status_code == HTTP_200_OK:
-            return response.json()
+            else:
+                raise APIException(detail="Unable to process the request")
 
-        else:
-            raise APIException(detail="Unable to process the request")
+        return self._send('get_permission', 'GET', 'broker/traders/permissions', None, handle)
 
     def create_trader(self, data, permission_list):
-        url = urljoin(settings.NEBULA_URL, 'broker/traders')
-
-        payload = json.dumps({
+        payload = {
             "name": data.get("name"),
             "email": data.get("email"),
             "password": data.get("password"),
             "accountId": data.get("account"),
             "permissions": list(permission_list)
-        })
-
-        headers = self.get_headers()
+        }
 
-        # Create trader in Exberry
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
+        def handle(response):
+            # If trader already exists, return
+            if (response.status_code == HTTP_400_BAD_REQUEST) and (json_codec.loads(response.content)["code"] == NEBULA_TRADER_EXISTS):
+                raise APIException(detail=f'{json_codec.loads(response.content)["message"]}')
 
-        # If trader already exists, return
-        if (response.status_code == HTTP_400_BAD_REQUEST) and (response.json()["code"] == NEBULA_TRADER_EXISTS):
-            raise APIException(detail=f'{response.json()["message"]}')
+            # If response code is 200, save trader to Authentium database
+            elif response.status_code == HTTP_200_OK:
+                return json_codec.loads(response.content)
 
-        # If response code is 200, save trader to Authentium database
-        elif response.status_code == HTTP_200_OK:
-            return response.json()
+            # If response code is not 200 or 400
+            else:
+                raise APIException(detail="Unable to process the request")
 
-        # If response code is not 200 or 400
-        else:
-            raise APIException(detail="Unable to process the request")
+        # Create trader in Exberry
+        return self._send('create_trader', 'POST', 'broker/traders', payload, handle, retry_safe=False)
 
     def update_trader(self, data, permission_list, pk):
-        url = urljoin(settings.NEBULA_URL, f"broker/traders/{pk}")
-
-        payload = json.dumps({
+        payload = {
             "name": data.get("name"),
             "email": data.get("email"),
             "accountId": data.get("accountId"),
             "permissions": list(permission_list)
-        })
-
-        headers = self.get_headers()
+        }
 
-        # Update trader in Exberry
-        http = HttpClient().retry_http()
-        response = http.put(url, headers=headers, data=payload)
+        def handle(response):
+            # If update account success, save it to Authentium database
+            if response.status_code == HTTP_200_OK:
+                return
 
-        # If update account success, save it to Authentium database
-        if response.status_code == HTTP_200_OK:
-            return
+            # If response code is not 200
+            else:
+                raise APIException(detail="Unable to process the request")
 
-        # If response code is not 200
-        else:
-            raise APIException(detail="Unable to process the request")
+        # Update trader in Exberry
+        return self._send('update_trader', 'PUT', f"broker/traders/{pk}", payload, handle)
 
     def create_asset(self, data):
-        url = urljoin(settings.NEBULA_URL, 'broker/assets')
-        payload = json.dumps({
+        payload = {
             "name": data.get("name"),
             "description": data.get("description"),
             "status": data.get("status"),
@@ -149,68 +207,55 @@ class NebulaService:
             "totalSupply": data.get("total_supply"),
             "url": data.get("url", ""),
 
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-
-        if response.status_code == HTTP_200_OK:
-            return response.json()
-        message = json.loads(response.text)["message"]
-        raise APIException(detail=f"Unable to process the request. Message: {message}")
+        }
+        return self._send(
+            'create_asset', 'POST', 'broker/assets', payload,
+            message_or_raise("Unable to process the request"), retry_safe=False,
+        )
 
     def update_asset(self, data, asset_id):
-        url = urljoin(settings.NEBULA_URL, f"broker/assets/{asset_id}")
-        payload = json.dumps({
+        payload = {
             "status": data.get("status")
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.patch(url, headers=headers, data=payload)
-        if response.status_code == HTTP_200_OK:
-            return
-        message = json.loads(response.text)["message"]
-        raise APIException(detail=f"Unable to process the request. Message: {message}")
+        }
+
+        def handle(response):
+            if response.status_code == HTTP_200_OK:
+                return
+            message = json_codec.loads(response.content)["message"]
+            raise APIException(detail=f"Unable to process the request. Message: {message}")
+
+        return self._send('update_asset', 'PATCH', f"broker/assets/{asset_id}", payload, handle)
 
     def create_calendar(self, data):
-        url = urljoin(settings.NEBULA_URL, 'calendars')
-        payload = json.dumps({
+        payload = {
             "name": data.get("name"),
             "timeZone": data.get("time_zone"),
             "marketOpen": data.get("market_open"),
             "marketClose": data.get("market_close"),
             "tradingDays": data.get("trading_days"),
             "holidays": data.get("holidays", [])
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-        if response.status_code == HTTP_200_OK:
-            return response.json()
-        message = json.loads(response.text)["message"]
-        raise APIException(detail=f"Unable to process the request. Message: {message}")
+        }
+        return self._send(
+            'create_calendar', 'POST', 'calendars', payload,
+            message_or_raise("Unable to process the request"), retry_safe=False,
+        )
 
     def update_calendar(self, data, calendar_id):
-        url = urljoin(settings.NEBULA_URL, f"calendars/{calendar_id}")
-        payload = json.dumps({
+        payload = {
             "name": data.get("name"),
             "timeZone": data.get("time_zone"),
             "marketOpen": data.get("market_open"),
             "marketClose": data.get("market_close"),
             "tradingDays": data.get("trading_days"),
             "holidays": data.get("holidays", [])
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.put(url, headers=headers, data=payload)
-        if response.status_code == HTTP_200_OK:
-            return response.json()
-        message = json.loads(response.text)["message"]
-        raise APIException(detail=f"Unable to process the request. Message: {message}")
+        }
+        return self._send(
+            'update_calendar', 'PUT', f"calendars/{calendar_id}", payload,
+            message_or_raise("Unable to process the request"),
+        )
 
     def create_instrument_broker(self, data):
-        url = urljoin(settings.NEBULA_URL, "broker/instruments")
-        payload = json.dumps({
+        payload = {
             "exchangeInstrumentSymbol": data.get("symbol"),
             "status": data.get("status"),
             "baseAssetId": data.get("base_asset"),
@@ -219,19 +264,20 @@ class NebulaService:
             "tradeFlow": data.get("trade_flow", TRADE_FLOW_DEFAULT),
             "description": data.get("description"),
             "imageUrls": data.get("image_urls"),
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-        if response.status_code == HTTP_200_OK:
-            return self.create_instrument_exchange(data, response.json())
-        message = json.loads(response.text)["message"]
-        raise APIException(detail=f"Unable to process the create instrument in broker request. Message: {message}")
+        }
 
-    def create_instrument_exchange(self, data, resp):
-        url = urljoin(settings.NEBULA_URL, "instruments")
+        def handle(response):
+            if response.status_code == HTTP_200_OK:
+                return self.create_instrument_exchange(data, json_codec.loads(response.content))
+            message = json_codec.loads(response.content)["message"]
+            raise APIException(
+                detail=f"Unable to process the create instrument in broker request. Message: {message}"
+            )
+
+        return self._send('create_instrument_broker', 'POST', "broker/instruments", payload, handle, retry_safe=False)
 
-        payload = json.dumps({
+    def create_instrument_exchange(self, data, resp):
+        payload = {
             "symbol": data.get("symbol"),
             "quoteCurrency": resp["quoteAsset"],
             "calendarId": str(data.get("calendar_ins")),
@@ -241,34 +287,31 @@ class NebulaService:
             "maxQuantity": str(data.get("max_quantity")),
             "status": data.get("status"),
             "description": data.get("description"),
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-        if response.status_code == HTTP_200_OK:
-            return resp, response.json()
-        message = json.loads(response.text)["message"]
-        raise APIException(detail=f"Unable to process the create instrument in exchange request. Message: {message}")
+        }
+
+        def handle(response):
+            if response.status_code == HTTP_200_OK:
+                return resp, json_codec.loads(response.content)
+            message = json_codec.loads(response.content)["message"]
+            raise APIException(
+                detail=f"Unable to process the create instrument in exchange request. Message: {message}"
+            )
+
+        return self._send('create_instrument_exchange', 'POST', "instruments", payload, handle, retry_safe=False)
 
     def update_instrument_broker(self, instrument_id, data):
-        url = urljoin(settings.NEBULA_URL, f"broker/instruments/{instrument_id}")
-        payload = json.dumps({
+        payload = {
             "exchangeInstrumentSymbol": data["symbol"],
             "status": data["status"],
             "description": data["description"]
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.patch(url, headers=headers, data=payload)
-        if response.status_code == HTTP_200_OK:
-            return response.json()
-        message = json.loads(response.text)["message"]
-        raise APIException(detail=f"Unable to process the update instrument in broker request. Message: {message}")
+        }
+        return self._send(
+            'update_instrument_broker', 'PATCH', f"broker/instruments/{instrument_id}", payload,
+            message_or_raise("Unable to process the update instrument in broker request")
+        )
 
     def update_instrument_exchange(self, instrument_id, data, resp):
-
-        url = urljoin(settings.NEBULA_URL, f"instruments/{instrument_id}")
-        payload = json.dumps({
+        payload = {
             "symbol": data.get("symbol"),
             "quoteCurrency": resp["quoteAsset"],
             "calendarId": str(data.get("calendar_ins")),
@@ -278,14 +321,11 @@ class NebulaService:
             "maxQuantity": str(data.get("max_quantity")),
             "status": data.get("status"),
             "description": data.get("description"),
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.put(url, headers=headers, data=payload)
-        if response.status_code == HTTP_200_OK:
-            return response.json()
-        message = json.loads(response.text)["message"]
-        raise APIException(detail=f"Unable to process the update instrument in exchange request. Message: {message}")
+        }
+        return self._send(
+            'update_instrument_exchange', 'PUT', f"instruments/{instrument_id}", payload,
+            message_or_raise("Unable to process the update instrument in exchange request")
+        )
 
     def opt_in_asset(self, account_id, asset_id):
         """
@@ -293,67 +333,69 @@ class NebulaService:
         :param asset_id: str
         :return: dict
         """
-        url = urljoin(settings.NEBULA_URL, f'broker/accounts/{account_id}/opt-in')
-
-        payload = json.dumps({
+        payload = {
             "assetId": asset_id
-        })
-        headers = self.get_headers()
+        }
 
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-        result = json.loads(response.content)
-        if response.status_code == HTTP_200_OK:
-            return
-        logger.debug("Opt in asset for user error:")
-        if result.get("code") == 100:
-            raise APIException(detail=f'{result.get("message")}')
+        def handle(response):
+            result = json_codec.loads(response.content)
+            if response.status_code == HTTP_200_OK:
+                return
+            logger.debug("Opt in asset for user error:")
+            if result.get("code") == 100:
+                raise APIException(detail=f'{result.get("message")}')
+
+        return self._send('opt_in_asset', 'POST', f'broker/accounts/{account_id}/opt-in', payload, handle)
 
-    def send_asset(self, account_id, asset_id, amount_asset):
+    def send_asset(self, account_id, asset_id, amount_asset, idempotency_key=None):
         """
         send asset/currency to seller/buyer
         :param asset_id: str
         :param amount_asset: int if asset is amount of products and float if currency
         :return:
         """
-        url = urljoin(settings.NEBULA_URL, f'broker/accounts/{account_id}/deposit')
-
-        payload = json.dumps({
+        payload = {
             "assetId": asset_id,
             "amount": amount_asset
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-        result = json.loads(response.content)
-        if response.status_code == HTTP_200_OK:
-            return result
-        logger.debug("Send asset for user error:")
-        if result.get("code") == 100:
-            raise APIException(f'{result.get("message")}')
+        }
+
+        def handle(response):
+            result = json_codec.loads(response.content)
+            if response.status_code == HTTP_200_OK:
+                return result
+            logger.debug("Send asset for user error:")
+            if result.get("code") == 100:
+                raise APIException(f'{result.get("message")}')
 
-    def lock_asset(self, account_id, asset_id, amount_asset):
+        return self._send(
+            'send_asset', 'POST', f'broker/accounts/{account_id}/deposit', payload, handle,
+            retry_safe=False, idempotency_key=idempotency_key
+        )
+
+    def lock_asset(self, account_id, asset_id, amount_asset, idempotency_key=None):
         """
         lock asset for seller or lock currency for buyer in nebula
         :param asset_id int
         :param amount_asset int
         :return results
         """
-        url = urljoin(settings.NEBULA_URL, f'broker/accounts/{account_id}/withdraw')
-
-        payload = json.dumps({
+        payload = {
             "assetId": asset_id,
             "amount": amount_asset
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-        result = json.loads(response.content)
-        if response.status_code == HTTP_200_OK:
-            return result
-        logger.debug("Lock asset for user error:")
-        if result.get("code") == 100:
-            raise APIException(f'{result.get("message")}')
+        }
+
+        def handle(response):
+            result = json_codec.loads(response.content)
+            if response.status_code == HTTP_200_OK:
+                return result
+            logger.debug("Lock asset for user error:")
+            if result.get("code") == 100:
+                raise APIException(f'{result.get("message")}')
+
+        return self._send(
+            'lock_asset', 'POST', f'broker/accounts/{account_id}/withdraw', payload, handle,
+            retry_safe=False, idempotency_key=idempotency_key
+        )
 
     def set_trading_fees(self, account_id, instrument_id, taker_fee, maker_fee):
         """
@@ -362,68 +404,108 @@ class NebulaService:
         :param maker_fee float
         :return
         """
-        url = urljoin(settings.NEBULA_URL, f'broker/accounts/{account_id}/fees')
-
-        payload = json.dumps({
+        payload = {
             "instrumentId": instrument_id,
             "takerFee": taker_fee,
             "makerFee": maker_fee
-        })
-        headers = self.get_headers()
+        }
 
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-        result = json.loads(response.content)
-        if response.status_code == HTTP_200_OK:
-            return result
-        logger.debug("Set trading fee for user error:")
-        if result.get("code") == 100:
-            raise APIException(f'{result.get("message")}')
+        def handle(response):
+            result = json_codec.loads(response.content)
+            if response.status_code == HTTP_200_OK:
+                return result
+            logger.debug("Set trading fee for user error:")
+            if result.get("code") == 100:
+                raise APIException(f'{result.get("message")}')
 
-    def place_order(self, account_id, order_type, side, instrument, quantity, price, time_in_force):
-        # TODO  handle error if status code !=200
-        url = urljoin(settings.NEBULA_URL, f'broker/accounts/{account_id}/orders')
+        return self._send('set_trading_fees', 'POST', f'broker/accounts/{account_id}/fees', payload, handle)
 
-        payload = json.dumps({
+    def place_order(self, account_id, order_type, side, instrument, quantity, price, time_in_force,
+                    idempotency_key=None):
+        payload = {
             "orderType": order_type,
             "side": side,
             "instrument": instrument,
             "quantity": quantity,
             "price": price,
             "timeInForce": time_in_force
-        })
-        headers = self.get_headers()
-        http = HttpClient().retry_http()
-        response = http.post(url, headers=headers, data=payload)
-        result = json.loads(response.content)
-        if response.status_code == HTTP_200_OK:
-            return result
-        if response.status_code == 500 and result.get("code") == PlaceOrderStatus.MISSING_INVALID_PARAM.value:
-            raise APIException(f'{result.get("message")}')
-        if response.status_code == 500 and result.get("code") == PlaceOrderStatus.MARKET_CLOSE.value:
-            raise APIException(f'{result.get("message")}')
-        logger.debug("Opt in asset for user error:")
-        if result.get("code") == PlaceOrderStatus.MISSING_INVALID_PARAM.value or \
-                result.get("code") == PlaceOrderStatus.INSTRUMENT_NOT_FOUND.value or \
-                result.get("code") == PlaceOrderStatus.ACCOUNT_NOT_OPT_IN.value or \
-                result.get("code") == PlaceOrderStatus.INSUFFICIENT_BALANCE.value:
-            raise APIException(f'{result.get("message")}')
-
-    def cancel_place_order(self, account_id, order_id, instrument):
-        url = urljoin(settings.NEBULA_URL, f'broker/accounts/{account_id}/orders/{order_id}')
-        payload = json.dumps({
+        }
+
+        def handle(response):
+            result = json_codec.loads(response.content)
+            if response.status_code == HTTP_200_OK:
+                return result
+            if response.status_code == 500 and result.get("code") == PlaceOrderStatus.MISSING_INVALID_PARAM.value:
+                raise APIException(f'{result.get("message")}')
+            if response.status_code == 500 and result.get("code") == PlaceOrderStatus.MARKET_CLOSE.value:
+                raise APIException(f'{result.get("message")}')
+            logger.debug("Opt in asset for user error:")
+            if result.get("code") == PlaceOrderStatus.MISSING_INVALID_PARAM.value or \
+                    result.get("code") == PlaceOrderStatus.INSTRUMENT_NOT_FOUND.value or \
+                    result.get("code") == PlaceOrderStatus.ACCOUNT_NOT_OPT_IN.value or \
+                    result.get("code") == PlaceOrderStatus.INSUFFICIENT_BALANCE.value:
+                raise APIException(f'{result.get("message")}')
+            # Nebula answered and did not take the order, the caller must not wait for it
+            raise APIException(detail=result.get("message") or "Unable to process the request")
+
+        return self._send(
+            'place_order', 'POST', f'broker/accounts/{account_id}/orders', payload, handle,
+            retry_safe=False, idempotency_key=idempotency_key
+        )
+
+    def cancel_place_order(self, account_id, order_id, instrument, idempotency_key=None):
+        payload = {
             "instrument": instrument,
-        })
-        headers = {
-            'Authorization': f'Bearer {self.token}',
-            'Content-Type': 'application/json'
         }
-        http = HttpClient().retry_http()
-        response = http.delete(url, headers=headers, data=payload)
-        result = json.loads(response.content)
-        if response.status_code == HTTP_200_OK:
-            return result
-        logger.debug("Opt in asset for user error:")
-        if result.get("code") == PlaceOrderStatus.MISSING_INVALID_PARAM.value or result.get(
-                "code") == PlaceOrderStatus.INSTRUMENT_NOT_FOUND.value:
-            raise APIException(f'{result.get("message")}')
+
+        def handle(response):
+            result = json_codec.loads(response.content)
+            if response.status_code == HTTP_200_OK:
+                return result
+            logger.debug("Opt in asset for user error:")
+            if result.get("code") == PlaceOrderStatus.MISSING_INVALID_PARAM.value or result.get(
+                    "code") == PlaceOrderStatus.INSTRUMENT_NOT_FOUND.value:
+                raise APIException(f'{result.get("message")}')
+
+        return self._send(
+            'cancel_place_order', 'DELETE', f'broker/accounts/{account_id}/orders/{order_id}', payload, handle,
+            retry_safe=False, idempotency_key=idempotency_key
+        )
+
+
+class AsyncNebulaService(NebulaService):
+    """
+    asyncio counterpart of NebulaService: every method returns a coroutine and the request is sent on the
+    AsyncClient of the running event loop, so a worker is not blocked while Nebula answers.
+    """
+
+    def _send(self, operation, method, url_path, payload, handler, retry_safe=True, idempotency_key=None):
+        return self._send_async(operation, method, url_path, payload, handler, retry_safe, idempotency_key)
+
+    async def _send_async(self, operation, method, url_path, payload, handler, retry_safe, idempotency_key):
+        breaker = CircuitBreaker.for_family(endpoint_family(url_path))
+        circuit_check(breaker, operation)
+        url = urljoin(settings.NEBULA_URL, url_path)
+        content = json_codec.dumps(payload) if payload is not None else None
+        # httpx only retries failed connections, which is safe for every call
+        headers = self.get_send_headers(retry_safe, idempotency_key)
+
+        http = AsyncHttpClient().retry_http()
+        try:
+            with metrics.track_call(operation), request_deadline(settings.NEBULA_REQUEST_DEADLINE):
+                response = await asyncio.wait_for(
+                    http.request(method, url, headers=headers, content=content),
+                    timeout=max(remaining_time(), 0),
+                )
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            breaker.record_failure()
+            logger.warning("Nebula %s %s failed: %r", method, url_path, e)
+            raise NebulaUnavailableException() from e
+        breaker.record_response(response.status_code)
+        metrics.observe_response(operation, response)
+        raise_if_unavailable(response, method, url_path)
+        result = handler(response)
+        # create_instrument_broker chains a second call from its handler
+        if inspect.isawaitable(result):
+            result = await result
+        return result
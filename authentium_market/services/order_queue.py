@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from authentium_market.conf.exceptions import APIException, NebulaUnavailableException
+from authentium_market.constants import OrderStatus
+from authentium_market.models import Order
+from authentium_market.services import orders
+from authentium_market.services.auth import Auth
+from authentium_market.services.nebula_service import NebulaService
+
+logger = logging.getLogger('Log')
+
+
+def queue_requested(request):
+    """
+    :return: whether the order of the request is queued: ?async=true or false, PLACE_ORDER_ASYNC without it
+    """
+    value = request.GET.get("async")
+    if value is None:
+        return settings.PLACE_ORDER_ASYNC
+    return value.lower() in ("1", "true", "yes")
+
+
+def idempotency_key(order_pk):
+    # Stable per order, so resubmitting a queued order never places it twice at Nebula
+    return f"order-{order_pk}"
+
+
+class OrderQueue:
+    """
+    Worker pool of the process submitting queued orders to Nebula.
+    Orders wait in memory: the ones left Pending without a Nebula id by a worker that stopped are sent again by
+    the resubmit_pending_orders command.
+    """
+    _executor = None
+    _lock = threading.Lock()
+
+    def enqueue(self, ticket):
+        """
+        Store the order of a ticket whose balance is already reserved as Pending and submit it once the current
+        transaction commits
+        :return: Order
+        """
+        order = orders.save_pending_order(ticket)
+        transaction.on_commit(lambda: self.submit(order.pk))
+        return order
+
+    def submit(self, order_pk):
+        if OrderQueue._executor is None:
+            with OrderQueue._lock:
+                if OrderQueue._executor is None:
+                    OrderQueue._executor = ThreadPoolExecutor(
+                        max_workers=settings.ORDER_QUEUE_WORKERS, thread_name_prefix="order-queue"
+                    )
+        return OrderQueue._executor.submit(self.__run, order_pk)
+
+    def __run(self, order_pk):
+        try:
+            self.process(order_pk)
+        except Exception:
+            logger.exception("Cannot submit order %s", order_pk)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def process(order_pk):
+        """
+        Send a Pending order to Nebula and store the outcome: Nebula's id and status, or Rejected with the
+        reservation released. An order Nebula could not be asked about stays Pending for resubmit_pending_orders.
+        """
+        order = Order.objects.select_related('account').filter(
+            pk=order_pk, status=OrderStatus.PENDING.value, order_id__isnull=True
+        ).first()
+        if order is None:
+            return
+        key = order.idempotency_key
+        if key is None:
+            key = idempotency_key(order_pk)
+            # From here on Nebula may hold the order: a mass cancel no longer dequeues it
+            if not Order.objects.filter(pk=order_pk, status=OrderStatus.PENDING.value, idempotency_key__isnull=True) \
+                    .update(idempotency_key=key):
+                return
+        ticket = orders.order_ticket(order)
+        try:
+            result = NebulaService(Auth().login()).place_order(*orders.place_order_args(ticket), idempotency_key=key)
+        except NebulaUnavailableException as e:
+            # Nebula may have taken it, releasing the balance now could spend it twice
+            logger.warning("Order %s left pending: %s", order_pk, e.detail)
+            return
+        except APIException as e:
+            logger.warning("Order %s rejected: %s", order_pk, e.detail)
+            result = None
+        if result is None:
+            with transaction.atomic():
+                rejected = Order.objects.filter(pk=order_pk, status=OrderStatus.PENDING.value).update(
+                    status=OrderStatus.REJECTED.value
+                )
+                if rejected:
+                    orders.release_balance(ticket)
+            return
+        Order.objects.filter(pk=order_pk).update(order_id=result["orderId"], status=result["status"])
+
+    @classmethod
+    def _after_fork(cls):
+        # Threads do not survive fork, the child builds its own pool
+        cls._lock = threading.Lock()
+        cls._executor = None
+
+
+os.register_at_fork(after_in_child=OrderQueue._after_fork)
@@ -0,0 +1,484 @@
+import functools
+import logging
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import ROUND_UP
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Mod
+
+from authentium_market.common.fixed_point import decimal_places, from_units, to_units
+from authentium_market.conf.exceptions import APIException, NebulaNotSentException, NebulaUnavailableException
+from authentium_market.constants import CLOSED_ORDER_STATUSES, OrderStatus, Side
+from authentium_market.models import Account, Balance, Instrument, Order, Trader
+from authentium_market.services.calendars import calendar_index
+from authentium_market.services.instruments import instrument_cache
+from authentium_market.services.websocket import OmsSessionManager
+
+logger = logging.getLogger('Log')
+
+# Everything PlaceOrderView needs to know about an order between validation and saving it.
+# instrument is an InstrumentDescriptor and balances maps asset pk to the Balance of the account.
+# quantity and price are in whole units, as Nebula takes them.
+OrderTicket = namedtuple("OrderTicket", [
+    "account",
+    "instrument",
+    "base_asset",
+    "quote_asset",
+    "base_asset_id",
+    "quote_asset_id",
+    "balances",
+    "order_type",
+    "side",
+    "quantity",
+    "price",
+    "time_in_force",
+])
+
+
+def does_not_exist(field, pk):
+    # Same message as the PrimaryKeyRelatedField the serializer used to validate with
+    return APIException(params={field: [f'Invalid pk "{pk}" - object does not exist.']})
+
+
+def load_order(data):
+    """
+    Read the account, its balances of the instrument assets and the instrument of a validated
+    PlaceOrderSerializer: one query while the instrument descriptor is cached
+    :param data: PlaceOrderSerializer.data
+    :return: OrderTicket
+    """
+    ticket = load_orders([data])[0]
+    if isinstance(ticket, APIException):
+        raise ticket
+    return ticket
+
+
+def load_orders(data_list):
+    """
+    load_order for several orders with one query for all of their accounts and balances. Orders breaking the
+    constraints of their instrument, or sent while its market is closed, are rejected before any query.
+    :param data_list: PlaceOrderSerializer(many=True).data
+    :return: list holding an OrderTicket, or the APIException of an unknown account or instrument or of an
+    invalid order, per order
+    """
+    instruments = {}
+    for data in data_list:
+        pk = data.get('instrument')
+        if pk not in instruments:
+            try:
+                instruments[pk] = instrument_cache.get(pk)
+            except Instrument.DoesNotExist:
+                instruments[pk] = None
+
+    errors = {}
+    for index, data in enumerate(data_list):
+        instrument = instruments[data.get('instrument')]
+        if instrument is None:
+            errors[index] = does_not_exist('instrument', data.get('instrument'))
+        else:
+            errors[index] = invalid_order(instrument, data)
+            if errors[index] is None and settings.CHECK_MARKET_HOURS:
+                errors[index] = market_closed(instrument)
+    valid = [data for index, data in enumerate(data_list) if errors[index] is None]
+
+    account_pks = {data.get('account') for data in valid}
+    asset_pks = set()
+    for data in valid:
+        instrument = instruments[data.get('instrument')]
+        asset_pks.update((instrument.base_asset, instrument.quote_asset))
+
+    accounts = {}
+    # Shared by the tickets of an account, so a balance opened for one order is seen by the others
+    balances = {pk: {} for pk in account_pks}
+    if valid:
+        for balance in Balance.objects.select_related('account').filter(
+                account_id__in=account_pks, asset_id__in=asset_pks):
+            accounts[balance.account_id] = balance.account
+            balances[balance.account_id][balance.asset_id] = balance
+    if not account_pks.issubset(accounts):
+        # Accounts not opted in to any of the assets yet, the opt-in calls to Nebula dwarf this query
+        accounts.update(Account.objects.in_bulk(account_pks - set(accounts)))
+
+    tickets = []
+    for index, data in enumerate(data_list):
+        instrument = instruments[data.get('instrument')]
+        account = accounts.get(data.get('account'))
+        if errors[index] is not None:
+            tickets.append(errors[index])
+        elif account is None:
+            tickets.append(does_not_exist('account', data.get('account')))
+        else:
+            tickets.append(OrderTicket(
+                account=account,
+                instrument=instrument,
+                base_asset=instrument.base_asset,
+                quote_asset=instrument.quote_asset,
+                base_asset_id=instrument.base_asset_id,
+                quote_asset_id=instrument.quote_asset_id,
+                balances=balances[account.id],
+                order_type=data.get('order_type'),
+                side=data.get('side'),
+                quantity=data.get('quantity', 0),
+                price=data.get('price', 0),
+                time_in_force=data.get('time_in_force'),
+            ))
+    return tickets
+
+
+def invalid_order(instrument, data):
+    """
+    Check an order against the constraints Nebula enforces on its instrument
+    :param instrument: InstrumentDescriptor
+    :param data: PlaceOrderSerializer.data
+    :return: APIException describing the first broken constraint, None for a valid order
+    """
+    quantity = data.get('quantity', 0)
+    price = data.get('price', 0)
+    if instrument.status != Instrument.StatusChoices.ACTIVE:
+        return APIException(detail=f"Instrument {instrument.symbol} is {instrument.status}")
+    if quantity < instrument.min_quantity:
+        return APIException(detail=f"Quantity {quantity} is below the minimum {instrument.min_quantity}")
+    if quantity > instrument.max_quantity:
+        return APIException(detail=f"Quantity {quantity} is above the maximum {instrument.max_quantity}")
+    if decimal_places(quantity) > instrument.quantity_precision:
+        return APIException(
+            detail=f"Quantity {quantity} has more than {instrument.quantity_precision} decimal places"
+        )
+    if data.get('order_type') == Order.OrderTypeChoices.LIMIT and price <= 0:
+        return APIException(detail="A limit order needs a positive price")
+    if decimal_places(price) > instrument.price_precision:
+        return APIException(detail=f"Price {price} has more than {instrument.price_precision} decimal places")
+    return None
+
+
+def market_closed(instrument):
+    """
+    :param instrument: InstrumentDescriptor
+    :return: APIException when the calendar of the instrument has no session running now, None otherwise
+    """
+    market = calendar_index.market(instrument.id)
+    if market["is_open"]:
+        return None
+    if market["next_open"] is None:
+        return APIException(detail=f"Market of {instrument.symbol} is closed")
+    next_open = datetime.fromtimestamp(market["next_open"], timezone.utc).isoformat()
+    return APIException(detail=f"Market of {instrument.symbol} is closed until {next_open}")
+
+
+def order_ticket(order):
+    """
+    Ticket of a stored order, enough to send it to Nebula and to release its reservation
+    :param order: Order with its account selected
+    :return: OrderTicket
+    """
+    instrument = instrument_cache.get(order.instrument_id)
+    return OrderTicket(
+        account=order.account,
+        instrument=instrument,
+        base_asset=instrument.base_asset,
+        quote_asset=instrument.quote_asset,
+        base_asset_id=instrument.base_asset_id,
+        quote_asset_id=instrument.quote_asset_id,
+        balances={},
+        order_type=order.order_type,
+        side=order.side,
+        quantity=order.quantity,
+        price=from_units(order.price, instrument.price_precision),
+        time_in_force=order.time_in_force,
+    )
+
+
+def missing_balances(ticket):
+    """
+    Assets of the instrument the account has not opted in yet
+    :return: list of (asset pk, Nebula asset id)
+    """
+    return [
+        (asset, asset_id)
+        for asset, asset_id in ((ticket.quote_asset, ticket.quote_asset_id), (ticket.base_asset, ticket.base_asset_id))
+        if asset not in ticket.balances
+    ]
+
+
+def open_balance(ticket, asset):
+    ticket.balances[asset] = Balance.objects.create(account_id=ticket.account.id, asset_id=asset)
+
+
+def reservation(ticket):
+    """
+    :return: (asset pk, units of the asset) the order keeps locked while it is open
+    """
+    instrument = ticket.instrument
+    if ticket.side == Side.BUY.value:  # lock currency for buyer, a fraction of a unit more rather than less
+        return ticket.quote_asset, to_units(ticket.quantity * ticket.price, instrument.quote_precision, ROUND_UP)
+    return ticket.base_asset, to_units(ticket.quantity, instrument.base_precision)  # lock asset for seller
+
+
+def lock_balance(ticket):
+    """
+    Move the amount of the order from free to locked, in the database so concurrent orders of the account
+    cannot both spend the same funds
+    :raise APIException: when the free balance is not enough
+    """
+    asset, amount = reservation(ticket)
+    # A single statement, nothing to roll back to inside an enclosing transaction
+    with transaction.atomic(savepoint=False):
+        reserved = Balance.objects.filter(
+            account_id=ticket.account.id, asset_id=asset, free__gte=amount
+        ).update(free=F('free') - amount, locked=F('locked') + amount)
+    if not reserved:
+        raise APIException(detail="The balance asset is not enough")
+
+
+def lock_balances(tickets):
+    """
+    lock_balance for several orders in one transaction; an order without enough funds does not stop the others
+    :return: list holding None, or the APIException of an order that could not be reserved, per ticket
+    """
+    errors = []
+    with transaction.atomic():
+        for ticket in tickets:
+            try:
+                lock_balance(ticket)
+                errors.append(None)
+            except APIException as e:
+                errors.append(e)
+    return errors
+
+
+def release_balance(ticket):
+    """
+    Undo lock_balance when Nebula refused the order. Never when Nebula could not be reached, it may have taken the
+    order anyway.
+    """
+    asset, amount = reservation(ticket)
+    Balance.objects.filter(account_id=ticket.account.id, asset_id=asset).update(
+        free=F('free') + amount, locked=F('locked') - amount
+    )
+
+
+def release_balances(tickets):
+    with transaction.atomic():
+        for ticket in tickets:
+            release_balance(ticket)
+
+
+def deposit_units(asset, amount):
+    """
+    :param asset: Asset
+    :param amount: Decimal in whole units
+    :return: int, units of the asset
+    :raise APIException: when the amount is finer than the precision of the asset
+    """
+    if decimal_places(amount) > asset.quantity_precision:
+        raise APIException(detail=f"Amount {amount} has more than {asset.quantity_precision} decimal places")
+    return to_units(amount, asset.quantity_precision)
+
+
+def place_order_args(ticket):
+    """
+    Arguments of NebulaService.place_order for the ticket
+    """
+    return (
+        ticket.account.account_id,
+        ticket.order_type,
+        ticket.side,
+        ticket.instrument.symbol,
+        ticket.quantity,
+        float(ticket.price),
+        ticket.time_in_force,
+    )
+
+
+def new_order(ticket, place_order):
+    """
+    :param place_order: result of NebulaService.place_order
+    """
+    return Order(
+        account_id=ticket.account.id,
+        order_id=place_order["orderId"],
+        order_type=ticket.order_type,
+        side=ticket.side,
+        instrument_id=ticket.instrument.id,
+        quantity=ticket.quantity,
+        price=to_units(ticket.price, ticket.instrument.price_precision),
+        time_in_force=ticket.time_in_force,
+        status=place_order["status"]
+    )
+
+
+def save_pending_order(ticket, idempotency_key=None, status=OrderStatus.PENDING.value):
+    """
+    Store an order before it is sent to Nebula, or after Nebula could not say whether it took it
+    :param idempotency_key: key the order was already sent with, resubmit_pending_orders sends it again with it
+    :return: Order
+    """
+    return Order.objects.create(
+        account_id=ticket.account.id,
+        order_type=ticket.order_type,
+        side=ticket.side,
+        instrument_id=ticket.instrument.id,
+        quantity=ticket.quantity,
+        price=to_units(ticket.price, ticket.instrument.price_precision),
+        time_in_force=ticket.time_in_force,
+        status=status,
+        idempotency_key=idempotency_key,
+    )
+
+
+def save_unknown_order(ticket, idempotency_key, session=None):
+    """
+    Store an order Nebula may have taken without saying so, its balance stays reserved. Sent through REST it is
+    Pending and resubmit_pending_orders sends it again with its idempotency key; sent over a broker.oms session,
+    which takes no key, it is Unconfirmed and never sent again.
+    :param session: OmsSession the order was sent over, None for REST
+    :return: Order
+    """
+    if session is not None:
+        return save_pending_order(ticket, status=OrderStatus.UNCONFIRMED.value)
+    return save_pending_order(ticket, idempotency_key)
+
+
+def oms_session(ticket):
+    """
+    broker.oms session the order of a ticket is placed over when ORDER_ENTRY is websocket: the one of the first trader
+    of the account
+    :return: OmsSession, or None to place it through NebulaService
+    """
+    if settings.ORDER_ENTRY != "websocket":
+        return None
+    trader = Trader.objects.filter(account_id=ticket.account.id).order_by('pk').first()
+    return OmsSessionManager().session(trader) if trader is not None else None
+
+
+def order_sender(service, ticket, idempotency_key, session=None):
+    """
+    Callable placing the order of a ticket, which touches no database and runs on any thread
+    :param service: NebulaService used when the order does not go over a broker.oms session
+    :param session: OmsSession of the ticket, see oms_session
+    """
+    if session is not None:
+        # Nebula takes no idempotency key over the socket
+        return functools.partial(session.place_order, *place_order_args(ticket))
+    return functools.partial(service.place_order, *place_order_args(ticket), idempotency_key=idempotency_key)
+
+
+def outcome_unknown(result):
+    """
+    :param result: result of a Nebula call or the exception it raised
+    :return: whether Nebula may have carried the call out without saying so
+    """
+    return isinstance(result, NebulaUnavailableException) and not isinstance(result, NebulaNotSentException)
+
+
+def placement_key(idempotency_key):
+    """
+    Idempotency key of a placement, chosen before the call so an order whose outcome is unknown can be sent again
+    with it
+    """
+    return idempotency_key or str(uuid.uuid4())
+
+
+def save_order(ticket, place_order):
+    """
+    :param place_order: result of NebulaService.place_order
+    """
+    new_order(ticket, place_order).save()
+
+
+def call_concurrently(calls, max_workers):
+    """
+    Run Nebula calls on a bounded thread pool. The calls must not touch the database.
+    :param calls: dict of key to a callable taking no argument
+    :return: dict of key to the result of the call, or the APIException it raised. Any other exception becomes a
+        NebulaUnavailableException: the call may have reached Nebula, whether it took effect is unknown.
+    """
+    if not calls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as pool:
+        futures = {key: pool.submit(call) for key, call in calls.items()}
+    results = {}
+    for key, future in futures.items():
+        try:
+            results[key] = future.result()
+        except APIException as e:
+            results[key] = e
+        except Exception:
+            logger.exception("Nebula call %s failed", key)
+            results[key] = NebulaUnavailableException(detail="Unable to process the request")
+    return results
+
+
+def open_orders(account, instrument=None, side=None):
+    """
+    Orders of the account Nebula may still fill, with their account and instrument. Pending orders it has no id for
+    yet are included.
+    """
+    query_set = Order.objects.select_related('account', 'instrument').filter(
+        account_id=account
+    ).exclude(status__in=CLOSED_ORDER_STATUSES)
+    if instrument is not None:
+        query_set = query_set.filter(instrument_id=instrument)
+    if side is not None:
+        query_set = query_set.filter(side=side)
+    return list(query_set)
+
+
+def check_price_precision(instrument, price_precision):
+    """
+    :param instrument: Instrument about to change its price_precision
+    :raise APIException: when a stored order has a price finer than the new precision
+    """
+    if price_precision is None or price_precision >= instrument.price_precision:
+        return
+    step = 10 ** (instrument.price_precision - price_precision)
+    if Order.objects.filter(instrument_id=instrument.pk).annotate(ticks=Mod('price', step)).exclude(ticks=0).exists():
+        raise APIException(
+            detail=f"Orders of {instrument.symbol} have prices with more than {price_precision} decimal places"
+        )
+
+
+def rescale_prices(instrument, price_precision):
+    """
+    Convert the prices of the orders of an instrument from ticks of its price_precision to ticks of the new one
+    """
+    shift = price_precision - instrument.price_precision
+    if shift > 0:
+        Order.objects.filter(instrument_id=instrument.pk).update(price=F('price') * 10 ** shift)
+    elif shift < 0:
+        # Exact, check_price_precision refused prices the new precision cannot hold
+        Order.objects.filter(instrument_id=instrument.pk).update(price=F('price') / 10 ** -shift)
+
+
+def dequeue_orders(queued):
+    """
+    Cancel queued orders no worker has sent yet and release their reservations, in one transaction
+    :param queued: Pending orders without a Nebula id nor an idempotency key, with their account selected
+    :return: pks of the canceled orders, not the ones a worker started sending meanwhile
+    """
+    canceled = []
+    with transaction.atomic():
+        for order in queued:
+            if Order.objects.filter(
+                pk=order.pk, status=OrderStatus.PENDING.value, order_id__isnull=True, idempotency_key__isnull=True
+            ).update(status=OrderStatus.CANCELED.value):
+                release_balance(order_ticket(order))
+                canceled.append(order.pk)
+    return canceled
+
+
+def mark_orders_canceled(pks):
+    Order.objects.filter(pk__in=pks).update(status=OrderStatus.CANCELED.value)
+
+
+def is_cancelable(order_id):
+    return Order.objects.get(order_id=order_id).status != OrderStatus.EXECUTED.value
+
+
+def mark_canceled(order_id):
+    Order.objects.filter(order_id=order_id).update(status=OrderStatus.CANCELED.value)
@@ -0,0 +1,130 @@
+"""
+Read-through cache of the reference data the trading requests read, in Django's cache so workers share it when the
+backend is shared (memcached) and each worker keeps its own with the default locmem backend.
+Rows are cached by primary key; a natural key maps to the primary key. Saving or deleting a row invalidates it
+(see signals.py). Instruments are cached the same way, as descriptors, by services.instruments.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from authentium_market.models import Asset, Calendar, Permission
+from authentium_market.services.metrics import REFERENCE_CACHE_LOOKUPS
+
+
+class ReferenceCache:
+    """
+    :param natural_key: fields identifying a row besides its primary key
+    """
+    # Seconds a miss waits for the worker loading the same row before loading it too
+    LOAD_WAIT = 1.0
+    LOAD_POLL = 0.02
+
+    def __init__(self, model, natural_key):
+        self.model = model
+        self.natural_key = tuple(natural_key)
+        self.prefix = f"reference:{model._meta.label_lower}"
+
+    def get(self, pk):
+        """
+        :return: model instance
+        :raise DoesNotExist: when there is no such row
+        """
+        key = self.__pk_key(pk)
+        instance = cache.get(key)
+        if instance is not None:
+            REFERENCE_CACHE_LOOKUPS.labels(self.model.__name__, "hit").inc()
+            return instance
+        REFERENCE_CACHE_LOOKUPS.labels(self.model.__name__, "miss").inc()
+        return self.__load(key, lambda: self.query(pk=pk), lambda: cache.get(key))
+
+    def get_by(self, *values):
+        """
+        :param values: values of the natural key fields, in order
+        :return: model instance
+        :raise DoesNotExist: when there is no such row
+        """
+        key = self.__natural_key(values)
+        instance = self.__cached_by(key, values)
+        if instance is not None:
+            REFERENCE_CACHE_LOOKUPS.labels(self.model.__name__, "hit").inc()
+            return instance
+        REFERENCE_CACHE_LOOKUPS.labels(self.model.__name__, "miss").inc()
+        return self.__load(
+            key, lambda: self.query(**dict(zip(self.natural_key, values))),
+            lambda: self.__cached_by(key, values),
+        )
+
+    def query(self, **lookup):
+        """
+        :return: what is cached for the row matching the lookup, by default the model instance
+        :raise DoesNotExist: when there is no such row
+        """
+        return self.model.objects.get(**lookup)
+
+    def ttl(self):
+        return settings.REFERENCE_CACHE_TTL
+
+    def invalidate(self, instance):
+        keys = [self.__pk_key(instance.pk), self.__natural_key(self.__natural_values(instance))]
+        cache.delete_many(keys)
+        # A request reading the row before the write commits may have cached it again in between
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+    def __load(self, key, query, cached):
+        # Only one worker queries a missing row, the others wait for it: a popular row expiring does not send every
+        # worker to the database at once
+        lock_key = f"{key}:loading"
+        if not cache.add(lock_key, True, self.LOAD_WAIT * 5):
+            deadline = time.monotonic() + self.LOAD_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(self.LOAD_POLL)
+                instance = cached()
+                if instance is not None:
+                    return instance
+            return query()
+        try:
+            instance = query()
+            self.__store(instance)
+            return instance
+        finally:
+            cache.delete(lock_key)
+
+    def __cached_by(self, key, values):
+        pk = cache.get(key)
+        instance = None if pk is None else cache.get(self.__pk_key(pk))
+        # The row may have been saved with another natural key since
+        if instance is None or self.__natural_values(instance) != tuple(values):
+            return None
+        return instance
+
+    def __store(self, instance):
+        # Jittered so the rows cached together do not expire together
+        timeout = self.ttl() * random.uniform(0.9, 1.1)
+        cache.set_many({
+            self.__pk_key(instance.pk): instance,
+            self.__natural_key(self.__natural_values(instance)): instance.pk,
+        }, timeout)
+
+    def __natural_values(self, instance):
+        return tuple(getattr(instance, field) for field in self.natural_key)
+
+    def __pk_key(self, pk):
+        return f"{self.prefix}:pk:{pk}"
+
+    def __natural_key(self, values):
+        # Memcached keys cannot hold spaces or control characters
+        return f"{self.prefix}:key:" + ":".join(str(value).replace(" ", "%20") for value in values)
+
+
+asset_cache = ReferenceCache(Asset, ["asset_id"])
+calendar_cache = ReferenceCache(Calendar, ["calendar_id"])
+permission_cache = ReferenceCache(Permission, ["name"])
+
+reference_caches = {
+    reference.model: reference
+    for reference in (asset_cache, calendar_cache, permission_cache)
+}
@@ -1,34 +1,251 @@
-import json
-import time
+"""
+Persistent broker.oms WebSocket sessions.
+Every trader gets one authenticated connection per worker process. Requests from any thread are multiplexed over
+it and matched to their responses by sid; pings keep it alive and a dropped connection is re-established in the
+background with exponential backoff.
+"""
+import itertools
+import logging
+import os
+import random
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
-from websocket import create_connection
+from django.conf import settings
+from websocket import WebSocketException, create_connection
 
+from authentium_market.common import json_codec
+from authentium_market.conf.exceptions import APIException, NebulaNotSentException, NebulaUnavailableException
+from authentium_market.services.auth import Auth
 
-class WebSocket:
-    def __init__(self, url, payload):
+logger = logging.getLogger('Log')
+
+CREATE_SESSION = "v1/broker.oms/createSession"
+PLACE_ORDER = "v1/broker.oms/placeOrder"
+CANCEL_ORDER = "v1/broker.oms/cancelOrder"
+
+
+class OmsSession:
+    """
+    One authenticated broker.oms connection
+    :param token_provider: callable returning a fresh trader token, called on every (re)connection
+    :param on_event: optional callable receiving the messages that answer no request, e.g. execution reports
+    """
+
+    def __init__(self, url, token_provider, on_event=None, heartbeat_interval=None, request_timeout=None,
+                 backoff_max=None):
         self.url = url
-        self.payload = payload
-        self.websocket = None
-
-    def connect(self, token_trader):
-        self.websocket = create_connection(self.url)
-        self.__create_session(token_trader)
-        self.__action(self.payload)
-
-    def __create_session(self, token_trader):
-        # TODO GET auth token
-        payload = json.dumps({
-            "q": "v1/broker.oms/createSession",
-            "sid": 13,
-            "d": {
-                "token": token_trader
-            }
+        self.token_provider = token_provider
+        self.on_event = on_event
+        self.heartbeat_interval = heartbeat_interval or settings.OMS_HEARTBEAT_INTERVAL
+        self.request_timeout = request_timeout or settings.OMS_REQUEST_TIMEOUT
+        self.backoff_max = backoff_max or settings.OMS_RECONNECT_BACKOFF_MAX
+        self._sids = itertools.count(1)
+        self._pending = {}
+        self._send_lock = threading.Lock()
+        self._connected = threading.Event()
+        self._closed = threading.Event()
+        self._websocket = None
+        self._subscriptions = []
+        self._threads = [
+            threading.Thread(target=self.__run, name="oms-session", daemon=True),
+            threading.Thread(target=self.__heartbeat, name="oms-heartbeat", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def request(self, q, data, timeout=None):
+        """
+        Send one request and wait for the response carrying its sid
+        :return: "d" of the response
+        :raise NebulaNotSentException: when the session is not connected, the request was not sent
+        :raise NebulaUnavailableException: when the response does not come in time or the connection drops
+        :raise APIException: when Nebula answers with an error
+        """
+        timeout = timeout or self.request_timeout
+        if not self._connected.wait(timeout):
+            raise NebulaNotSentException()
+        future = Future()
+        with self._send_lock:
+            sid = next(self._sids)
+            self._pending[sid] = future
+            try:
+                self._websocket.send(json_codec.dumps({"q": q, "sid": sid, "d": data}).decode("utf-8"))
+            except (WebSocketException, OSError, AttributeError) as e:
+                self._pending.pop(sid, None)
+                raise NebulaUnavailableException() from e
+        try:
+            message = future.result(timeout)
+        except FutureTimeoutError:
+            self._pending.pop(sid, None)
+            raise NebulaUnavailableException()
+        return self.response_data(message)
+
+    def subscribe(self, q, data):
+        """
+        Subscribe to a stream, again after every reconnection; its messages go to on_event
+        """
+        self._subscriptions.append((q, data))
+        if self._connected.is_set():
+            self.__send_subscription(self._websocket, q, data)
+
+    def place_order(self, account_id, order_type, side, instrument, quantity, price, time_in_force):
+        """
+        Same arguments and result as NebulaService.place_order
+        """
+        return self.request(PLACE_ORDER, {
+            "accountId": account_id,
+            "orderType": order_type,
+            "side": side,
+            "instrument": instrument,
+            "quantity": quantity,
+            "price": price,
+            "timeInForce": time_in_force,
         })
-        self.websocket.send(payload)
 
-    def __action(self, payload):
-        time.sleep(1)
-        self.websocket.send(json.dumps(payload))
+    def cancel_order(self, account_id, order_id, instrument):
+        return self.request(CANCEL_ORDER, {
+            "accountId": account_id,
+            "orderId": order_id,
+            "instrument": instrument,
+        })
 
     def close(self):
-        self.websocket.close()
+        self._closed.set()
+        self._connected.clear()
+        self.__disconnect()
+        self.__fail_pending()
+
+    @staticmethod
+    def response_data(message):
+        data = message.get("d") or {}
+        if isinstance(data, dict) and ("errorCode" in data or "errorType" in data):
+            raise APIException(detail=data.get("errorMessage") or data.get("message") or data.get("errorType"))
+        return data
+
+    def __run(self):
+        attempt = 0
+        while not self._closed.is_set():
+            try:
+                websocket = self.__connect()
+                attempt = 0
+                self._connected.set()
+                self.__read(websocket)
+            except Exception as e:
+                if not self._closed.is_set():
+                    logger.warning("OMS session %s dropped: %r", self.url, e)
+            self._connected.clear()
+            self.__disconnect()
+            self.__fail_pending()
+            # Full jitter, so the sessions of every trader do not reconnect in lockstep
+            self._closed.wait(random.uniform(0, min(self.backoff_max, 2 ** attempt)))
+            attempt += 1
+
+    def __connect(self):
+        websocket = create_connection(self.url, timeout=self.request_timeout)
+        sid = next(self._sids)
+        websocket.send(json_codec.dumps({
+            "q": CREATE_SESSION,
+            "sid": sid,
+            "d": {"token": self.token_provider()},
+        }).decode("utf-8"))
+        while True:
+            message = json_codec.loads(websocket.recv())
+            if message.get("sid") == sid:
+                self.response_data(message)
+                break
+        # A connection that answers neither data nor pongs for three heartbeats is dead
+        websocket.settimeout(self.heartbeat_interval * 3)
+        self._websocket = websocket
+        for q, data in self._subscriptions:
+            self.__send_subscription(websocket, q, data)
+        return websocket
+
+    def __send_subscription(self, websocket, q, data):
+        # No caller waits for the answer, every message of the stream is an event
+        with self._send_lock:
+            websocket.send(json_codec.dumps({"q": q, "sid": next(self._sids), "d": data}).decode("utf-8"))
+
+    def __read(self, websocket):
+        while not self._closed.is_set():
+            message = json_codec.loads(websocket.recv())
+            future = self._pending.pop(message.get("sid"), None)
+            if future is not None:
+                future.set_result(message)
+            elif self.on_event is not None:
+                try:
+                    self.on_event(message)
+                except Exception:
+                    logger.exception("OMS event handler failed")
+
+    def __heartbeat(self):
+        while not self._closed.wait(self.heartbeat_interval):
+            if not self._connected.is_set():
+                continue
+            try:
+                with self._send_lock:
+                    self._websocket.ping()
+            except (WebSocketException, OSError, AttributeError) as e:
+                logger.warning("OMS heartbeat failed: %r", e)
+                # Wakes the reader up, which reconnects
+                self.__disconnect()
+
+    def __disconnect(self):
+        websocket, self._websocket = self._websocket, None
+        if websocket is not None:
+            try:
+                websocket.close()
+            except (WebSocketException, OSError):
+                pass
+
+    def __fail_pending(self):
+        with self._send_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(NebulaUnavailableException())
+
+
+class OmsSessionManager:
+    """
+    Process-wide OmsSession of each trader, opened the first time the trader sends an order
+    """
+    _sessions = {}
+    _lock = threading.Lock()
+
+    def session(self, trader, on_event=None):
+        """
+        :param trader: Trader whose credentials open the session
+        :return: OmsSession
+        """
+        session = OmsSessionManager._sessions.get(trader.pk)
+        if session is None:
+            with OmsSessionManager._lock:
+                session = OmsSessionManager._sessions.get(trader.pk)
+                if session is None:
+                    session = OmsSession(
+                        settings.NEBULA_WS_URL,
+                        lambda: Auth().trader_token(trader.email, trader.password),
+                        on_event=on_event,
+                    )
+                    OmsSessionManager._sessions[trader.pk] = session
+        return session
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            sessions, cls._sessions = cls._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    @classmethod
+    def _after_fork(cls):
+        # The session threads do not survive fork and the sockets belong to the parent
+        cls._lock = threading.Lock()
+        cls._sessions = {}
+
+
+os.register_at_fork(after_in_child=OmsSessionManager._after_fork)
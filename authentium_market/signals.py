@@ -0,0 +1,46 @@
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from authentium_market.models import Account, Asset, Calendar, Instrument, Permission, Trader
+from authentium_market.services.calendars import calendar_index
+from authentium_market.services.instruments import instrument_cache
+from authentium_market.services.reference_cache import reference_caches
+
+
+@receiver([post_save, post_delete], sender=Asset)
+@receiver([post_save, post_delete], sender=Calendar)
+@receiver([post_save, post_delete], sender=Permission)
+def invalidate_reference(sender, instance, **kwargs):
+    reference_caches[sender].invalidate(instance)
+
+
+@receiver([post_save, post_delete], sender=Instrument)
+def invalidate_instrument(sender, instance, **kwargs):
+    instrument_cache.invalidate(instance)
+
+
+@receiver([post_save, post_delete], sender=Asset)
+def invalidate_asset_instruments(sender, instance, **kwargs):
+    # Descriptors carry the Nebula ids and precisions of their assets
+    for instrument in Instrument.objects.filter(Q(base_asset=instance) | Q(quote_asset=instance)).only("symbol"):
+        instrument_cache.invalidate(instrument)
+
+
+@receiver([post_save, post_delete], sender=Calendar)
+def invalidate_calendar(sender, instance, **kwargs):
+    # CalendarView.put saves the calendar, so its new hours apply to the next order
+    calendar_index.invalidate(instance.pk)
+
+
+@receiver(m2m_changed, sender=Account.assets.through)
+@receiver(m2m_changed, sender=Trader.permissions.through)
+def touch_m2m_owner(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # The accounts and traders render these relations, their updated_at feeds the ETags of conf.conditional
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        type(instance).objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+    elif pk_set:
+        model.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
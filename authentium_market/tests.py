@@ -1,3 +1,1529 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import functools
+import io
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework.utils.serializer_helpers import ReturnDict
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError
+from urllib3.util.retry import RequestHistory
+from websocket import WebSocketConnectionClosedException, WebSocketTimeoutException
+
+from authentium_market.common import json_codec
+from authentium_market.conf.exceptions import APIException, NebulaNotSentException, NebulaUnavailableException
+from authentium_market.form.account_form import AccountSerializer
+from authentium_market.form.asset import AssetSerializer
+from authentium_market.form.calendar import CalendarViewSerializer
+from authentium_market.form.instrument_form import InstrumentSerializer
+from authentium_market.form.trader_form import TraderSerializer
+from authentium_market.models import (
+    AppliedExecution, Account, Asset, Balance, Calendar, Instrument, Order, Permission, Token, Trader,
+)
+from authentium_market.services.auth import Auth, NebulaCredentials, TokenCache
+from authentium_market.services.calendars import calendar_index
+from authentium_market.services.circuit_breaker import CircuitBreaker
+from authentium_market.services.executions import (
+    SUBSCRIBE_EXECUTIONS, Execution, ExecutionConsumer, apply_executions,
+)
+from authentium_market.services.http_client import (
+    AsyncHttpClient, HttpClient, NebulaRetry, TimeoutHTTPAdapter, remaining_time, request_deadline,
+)
+from authentium_market.services.instruments import instrument_cache
+from authentium_market.services.nebula_service import AsyncNebulaService, NebulaService
+from authentium_market.services.order_queue import OrderQueue
+from authentium_market.services.reference_cache import asset_cache, permission_cache
+from authentium_market.services.websocket import CREATE_SESSION, PLACE_ORDER, OmsSession, OmsSessionManager
+
+TOKEN_TABLE = re.compile(r'[`"]token[`"]')
+
+
+class MarketDataMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.calendar = Calendar.objects.create(
+            name="Calendar1",
+            calendar_id="1",
+            time_zone="+00:00",
+            # Open around the clock, so the order tests pass whenever they run
+            market_open="00:00",
+            market_close="00:00",
+            trading_days=["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+            holidays=[],
+        )
+        cls.base_asset = Asset.objects.create(
+            asset_id=1, name="Pine", description="Pineapple", ledger_system="Algorand", ledger_asset_id=11,
+            quantity_precision=0, total_supply=1000, status=Asset.StatusChoices.ACTIVE,
+        )
+        cls.quote_asset = Asset.objects.create(
+            asset_id=2, name="USD", description="Dollar", ledger_system="Algorand", ledger_asset_id=12,
+            quantity_precision=2, total_supply=1000000, status=Asset.StatusChoices.ACTIVE,
+        )
+        cls.instrument = Instrument.objects.create(
+            instrument_id_broker=1, instrument_id_exchange=1, symbol="PINE-USD",
+            status=Instrument.StatusChoices.ACTIVE, description="Pine", base_asset=cls.base_asset,
+            quote_asset=cls.quote_asset, quote_currency="USD", image_urls=[], calendar_ins=cls.calendar,
+            price_precision=2, quantity_precision=0, min_quantity=1, max_quantity=100,
+        )
+        cls.account = Account.objects.create(
+            account_id=1, name="Account1", status=Account.StatusChoices.PENDING, ledger_system="Algorand",
+            ledger_account_id="ledger-1", comp_id="",
+        )
+        cls.permission = Permission.objects.create(name="oms-trading:*", description="Trading")
+        cls.trader = Trader.objects.create(
+            account=cls.account, trader_id="auth0|1", name="Trader1", password="secret", email="t1@exberry.io",
+        )
+        cls.trader.permissions.add(cls.permission)
+
+
+class ReadOnlyViewsTest(MarketDataMixin, TestCase):
+    def test_get_handlers_do_not_login(self):
+        urls = [
+            reverse("asset"),
+            reverse("asset-detail", args=[self.base_asset.id]),
+            reverse("account"),
+            reverse("account-detail", args=[self.account.id]),
+            reverse("permission"),
+            reverse("trader"),
+            reverse("trader-detail", args=[self.trader.id]),
+            reverse("calendar"),
+            reverse("calendar-detail", args=[self.calendar.id]),
+            reverse("instruments"),
+            reverse("instrument", args=[self.instrument.id]),
+        ]
+        with mock.patch.object(Auth, "login") as login:
+            for url in urls:
+                with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    token_queries = [q["sql"] for q in queries if TOKEN_TABLE.search(q["sql"])]
+                    self.assertEqual(token_queries, [])
+        login.assert_not_called()
+
+
+class TokenCacheTest(TestCase):
+    def setUp(self):
+        Auth.token_cache.clear()
+        self.addCleanup(Auth.token_cache.clear)
+
+    def test_token_served_from_memory(self):
+        Token.objects.create(token_type=Token.TokenTypeChoices.ADMIN, token="stored", expires_in=3600)
+        with self.assertNumQueries(1):
+            self.assertEqual(Auth().login(), "stored")
+        with self.assertNumQueries(0):
+            self.assertEqual(Auth().login(), "stored")
+
+    def test_expired_token_is_refreshed(self):
+        Token.objects.create(token_type=Token.TokenTypeChoices.ADMIN, token="expired", expires_in=0)
+        with mock.patch.object(Auth, "refresh_token", return_value=("fresh", time.time() + 3600)) as refresh_token:
+            self.assertEqual(Auth().login(), "fresh")
+            self.assertEqual(Auth().login(), "fresh")
+        refresh_token.assert_called_once_with()
+
+    def test_background_refresh_before_expiry(self):
+        token_cache = TokenCache(refresh_margin=60)
+        auth = mock.Mock()
+        auth.load_token.return_value = ("old", time.time() + 30)
+        auth.refresh_token.return_value = ("new", time.time() + 3600)
+
+        self.assertEqual(token_cache.get(auth), "old")
+        # Inside the refresh margin: still served, and renewed by a background thread
+        self.assertEqual(token_cache.get(auth), "old")
+        # Released by the background thread once the new token is in place
+        self.assertTrue(token_cache._refresh_lock.acquire(timeout=5))
+        token_cache._refresh_lock.release()
+        self.assertEqual(token_cache.get(auth), "new")
+        auth.refresh_token.assert_called_once_with(wait=False)
+        auth.load_token.assert_called_once_with()
+
+    def test_password_decrypted_once(self):
+        with mock.patch.object(NebulaCredentials, "_password", None), \
+                mock.patch.object(NebulaCredentials, "get_password", return_value="secret") as get_password:
+            self.assertEqual(Auth().password, "secret")
+            self.assertEqual(Auth().password, "secret")
+        get_password.assert_called_once()
+
+
+class RefreshTokenTest(TestCase):
+    def setUp(self):
+        password = mock.patch.object(NebulaCredentials, "password", return_value="secret")
+        nebula = mock.patch.object(Auth, "_Auth__call_nebula_api", return_value={"token": "new", "expiresIn": 3600})
+        password.start()
+        self.nebula = nebula.start()
+        self.addCleanup(password.stop)
+        self.addCleanup(nebula.stop)
+
+    def test_waiting_caller_reuses_new_token(self):
+        token, expires_at = Auth().refresh_token()
+        # What a worker blocked on the row lock finds once the first one committed
+        self.assertEqual(Auth().refresh_token(), (token, mock.ANY))
+        self.assertEqual(token, "new")
+        self.assertGreater(expires_at, time.time() + 3500)
+        self.nebula.assert_called_once()
+        self.assertEqual(Token.objects.get(token_type=Token.TokenTypeChoices.ADMIN).token, "new")
+
+    def test_proactive_refresh_skips_locked_row(self):
+        # The row locked by another worker is skipped, as select_for_update(skip_locked=True) does
+        with mock.patch.object(connection.features, "has_select_for_update_skip_locked", True), \
+                mock.patch.object(Token.objects, "select_for_update", return_value=Token.objects.none()) as select:
+            self.assertIsNone(Auth().refresh_token(wait=False))
+        select.assert_called_once_with(skip_locked=True)
+        self.nebula.assert_not_called()
+
+
+class NebulaStub(BaseHTTPRequestHandler):
+    """
+    Local HTTP/1.1 server answering every GET with an empty JSON list, on connections kept alive
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTest(TestCase):
+    def setUp(self):
+        HttpClient.reset()
+        self.addCleanup(HttpClient.reset)
+
+    def test_pooled_session_reuses_connections(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), NebulaStub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host = f"http://127.0.0.1:{server.server_port}"
+
+        self.assertIs(HttpClient().retry_http(), HttpClient().retry_http())
+        with override_settings(NEBULA_URL=f"{host}/"):
+            for _ in range(3):
+                self.assertEqual(NebulaService("token").get_permission(), [])
+        self.assertEqual(HttpClient.pool_stats()[host], {"connections": 1, "requests": 3, "reused": 2})
+        self.assertEqual(REGISTRY.get_sample_value("nebula_http_pool_reused_requests", {"host": host}), 2)
+
+    def test_forked_worker_builds_its_own_session(self):
+        parent_session = HttpClient().retry_http()
+        pid = os.fork()
+        if pid == 0:
+            # Child process: report through the exit code, never return into the test runner
+            try:
+                fresh = HttpClient._session is None and HttpClient().retry_http() is not parent_session
+                os._exit(0 if fresh else 1)
+            except BaseException:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIs(HttpClient().retry_http(), parent_session)
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        clock = mock.patch("authentium_market.services.circuit_breaker.time.monotonic", side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.breaker = CircuitBreaker("orders", failure_threshold=2, reset_timeout=30, half_open_calls=1)
+
+    def test_transitions(self):
+        breaker = self.breaker
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+        breaker.record_response(503)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(NebulaUnavailableException):
+            breaker.before_call()
+
+        self.now += 30
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.before_call()
+        # One probe at a time
+        with self.assertRaises(NebulaUnavailableException):
+            breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        self.now += 30
+        breaker.before_call()
+        breaker.record_response(400)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+
+    def test_lost_probe_does_not_hold_circuit(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.now += 30
+        self.breaker.before_call()
+        self.now += 30
+        self.breaker.before_call()
+
+
+@override_settings(NEBULA_URL="http://nebula.test/")
+class NebulaTransportTest(TestCase):
+    def setUp(self):
+        HttpClient.reset()
+        self.addCleanup(HttpClient.reset)
+        CircuitBreaker.reset_all()
+        self.addCleanup(CircuitBreaker.reset_all)
+
+    def test_enclosing_deadline_is_kept(self):
+        with request_deadline(1) as outer:
+            with request_deadline(10) as inner:
+                self.assertEqual(inner, outer)
+                self.assertLessEqual(remaining_time(), 1)
+        self.assertIsNone(remaining_time())
+
+    def test_attempts_and_backoff_capped(self):
+        adapter = TimeoutHTTPAdapter(timeout=60)
+        with mock.patch.object(HTTPAdapter, "send") as send, request_deadline(2):
+            adapter.send(requests.Request("GET", "http://nebula.local/").prepare())
+            self.assertLessEqual(send.call_args.kwargs["timeout"], 2)
+            history = tuple(RequestHistory("GET", "/", ConnectTimeoutError(), None, None) for _ in range(4))
+            # 80 seconds of backoff without the deadline
+            self.assertLessEqual(NebulaRetry(total=5, backoff_factor=10, history=history).get_backoff_time(), 2)
+        with request_deadline(0), self.assertRaises(MaxRetryError):
+            NebulaRetry(total=5).increment(method="GET", url="/", error=ConnectTimeoutError())
+
+    def test_gateway_error_is_unavailable(self):
+        session = mock.Mock()
+        session.request.return_value = nebula_response(
+            503, b"<html><body>503 Service Temporarily Unavailable</body></html>"
+        )
+        with mock.patch.object(HttpClient, "retry_http", return_value=session), \
+                self.assertRaises(NebulaUnavailableException):
+            NebulaService("token").place_order(1, "Limit", "Buy", "PINE-USD", 2, 10.0, "GTC")
+
+        def gateway_error(request):
+            return httpx.Response(502, text="<html>Bad Gateway</html>")
+
+        with mock.patch.object(
+                AsyncHttpClient, "retry_http",
+                lambda client: httpx.AsyncClient(transport=httpx.MockTransport(gateway_error))), \
+                self.assertRaises(NebulaUnavailableException):
+            asyncio.run(AsyncNebulaService("token").place_order(1, "Limit", "Buy", "PINE-USD", 2, 10.0, "GTC"))
+
+
+def nebula_response(status_code, content):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    return response
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        HttpClient.reset()
+        self.addCleanup(HttpClient.reset)
+        CircuitBreaker.reset_all()
+        self.addCleanup(CircuitBreaker.reset_all)
+
+    def test_scrape(self):
+        session = mock.Mock()
+        session.request.side_effect = [
+            nebula_response(200, b"[]"),
+            nebula_response(500, b'{"code": 105, "message": "Insufficient balance"}'),
+        ]
+        with mock.patch.object(HttpClient, "retry_http", return_value=session):
+            # Labelled after the NebulaService method even when called through a wrapper
+            functools.partial(NebulaService("token").get_permission)()
+            with self.assertRaises(APIException):
+                NebulaService("token").place_order(1, "Limit", "Buy", "PINE-USD", 2, 10.0, "GTC")
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode("utf-8")
+        self.assertRegex(body, r'nebula_request_duration_seconds_count\{method="get_permission"\} [1-9]')
+        self.assertRegex(body, r'nebula_errors_total\{code="105",method="place_order"\} [1-9]')
+        self.assertRegex(body, r'nebula_requests_in_flight\{method="place_order"\} 0')
+
+
+class JsonCodecTest(TestCase):
+    def setUp(self):
+        json_codec.get_codec.cache_clear()
+        self.addCleanup(json_codec.get_codec.cache_clear)
+
+    def test_backends_render_the_same(self):
+        payload = {
+            "price": Decimal("10.15"),
+            "created_at": datetime.datetime(2022, 1, 3, 8, 0, 0, 123456, tzinfo=datetime.timezone.utc),
+            "day": datetime.date(2022, 1, 3),
+            "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+            "row": ReturnDict({"id": 1, "name": "Pine"}, serializer=None),
+            "by_pk": {1: "Pine", 2: "USD"},
+            "values": [1, 2.5, None, True, "Ananas é"],
+        }
+        expected = {
+            "price": "10.15",
+            "created_at": "2022-01-03T08:00:00.123Z",
+            "day": "2022-01-03",
+            "id": "12345678-1234-5678-1234-567812345678",
+            "row": {"id": 1, "name": "Pine"},
+            "by_pk": {"1": "Pine", "2": "USD"},
+            "values": [1, 2.5, None, True, "Ananas é"],
+        }
+        for backend in ("json", "orjson"):
+            with self.subTest(backend=backend), override_settings(JSON_CODEC=backend):
+                json_codec.get_codec.cache_clear()
+                self.assertEqual(json_codec.get_codec().name, backend)
+                data = json_codec.dumps(payload)
+                self.assertIsInstance(data, bytes)
+                self.assertEqual(json.loads(data), expected)
+                self.assertEqual(json_codec.loads(data), expected)
+
+
+class PaginationTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        for index in range(2, 6):
+            Calendar.objects.create(
+                name=f"Calendar{index}", calendar_id=str(index), time_zone="+00:00", market_open="08:00",
+                market_close="16:30", trading_days=["Monday"], holidays=[],
+            )
+
+    def page(self, **params):
+        response = self.client.get(reverse("calendar"), {"per_page": 2, **params})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        return [calendar["name"] for calendar in body["data"]], body["pagination"]
+
+    def test_walk_pages(self):
+        names, pagination = self.page()
+        self.assertEqual(names, ["Calendar1", "Calendar2"])
+        self.assertIsNone(pagination["prev"])
+        self.assertNotIn("total", pagination)
+
+        names, pagination = self.page(cursor=pagination["next"])
+        self.assertEqual(names, ["Calendar3", "Calendar4"])
+        middle = pagination
+
+        names, pagination = self.page(cursor=pagination["next"], count="true")
+        self.assertEqual(names, ["Calendar5"])
+        self.assertEqual((pagination["next"], pagination["total"]), (None, 5))
+
+        names, pagination = self.page(cursor=pagination["prev"])
+        self.assertEqual(names, ["Calendar3", "Calendar4"])
+        self.assertEqual(pagination["next"], middle["next"])
+
+        names, pagination = self.page(cursor=pagination["prev"])
+        self.assertEqual(names, ["Calendar1", "Calendar2"])
+        self.assertIsNone(pagination["prev"])
+
+    def test_deep_page_is_one_query(self):
+        _, pagination = self.page()
+        # And the ETag aggregate
+        with self.assertNumQueries(2):
+            self.page(cursor=pagination["next"])
+
+    def test_invalid_parameters(self):
+        for params in ({"cursor": "not-a-cursor"}, {"per_page": 1000}):
+            with self.subTest(**params):
+                response = self.client.get(reverse("calendar"), params)
+                self.assertEqual(response.status_code, 400)
+
+
+class ListEndpointsTest(MarketDataMixin, TestCase):
+    """
+    The list endpoints run the same number of queries whatever the page size, so a serializer field reading a
+    relation that is not in its query plan fails here instead of adding one query per row.
+    Their values() fast path must render what the serializers render.
+    """
+    # ETag aggregate and page, plus one per many-to-many relation
+    BUDGETS = {"asset": 2, "account": 3, "trader": 3, "calendar": 2, "instruments": 2}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for index in range(2, 6):
+            account = Account.objects.create(
+                account_id=index, name=f"Account{index}", status=Account.StatusChoices.PENDING,
+                ledger_system="Algorand", ledger_account_id=f"ledger-{index}", comp_id="",
+            )
+            account.assets.add(cls.base_asset, cls.quote_asset)
+            trader = Trader.objects.create(
+                account=account, trader_id=f"auth0|{index}", name=f"Trader{index}", password=f"secret{index}",
+                email=f"t{index}@exberry.io",
+            )
+            trader.permissions.add(cls.permission)
+
+    def assertQueryBudget(self, name, budget):
+        for per_page in (1, 5):
+            with self.subTest(name=name, per_page=per_page), self.assertNumQueries(budget):
+                response = self.client.get(reverse(name), {"per_page": per_page})
+                self.assertEqual(response.status_code, 200)
+
+    def test_list_endpoints(self):
+        for name, budget in self.BUDGETS.items():
+            self.assertQueryBudget(name, budget)
+
+    def test_fast_path_matches_serializers(self):
+        for serializer_class in (
+                AssetSerializer, AccountSerializer, TraderSerializer, CalendarViewSerializer, InstrumentSerializer):
+            with self.subTest(serializer=serializer_class.__name__):
+                names = list(serializer_class.values_plan())
+                rows = serializer_class.values(names).order_by("pk")
+                expected = serializer_class(serializer_class.query_set().order_by("pk"), many=True).data
+                self.assertEqual(serializer_class.represent(list(rows), names), json.loads(json.dumps(expected)))
+
+    def test_sparse_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("account"), {"fields": "id,name", "per_page": 2})
+        self.assertEqual(response.json()["data"], [
+            {"id": self.account.id, "name": "Account1"}, {"id": self.account.id + 1, "name": "Account2"},
+        ])
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn("ledger_account_id", queries[1]["sql"])
+
+        response = self.client.get(reverse("account"), {"fields": "id,secret"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTest(MarketDataMixin, TestCase):
+    def assertNotModified(self, url, **headers):
+        with self.assertNumQueries(1):
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail(self):
+        url = reverse("asset-detail", args=[self.base_asset.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertNotModified(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+
+        self.base_asset.description = "Pineapples"
+        self.base_asset.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_list(self):
+        url = reverse("calendar")
+        etag = self.client.get(url)["ETag"]
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)
+        # Another page or other fields are another representation
+        self.assertEqual(self.client.get(url, {"fields": "id"}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        Calendar.objects.create(
+            name="Calendar2", calendar_id="2", time_zone="+00:00", market_open="08:00", market_close="16:30",
+            trading_days=["Monday"], holidays=[],
+        )
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_many_to_many_change(self):
+        url = reverse("trader")
+        etag = self.client.get(url)["ETag"]
+        self.trader.permissions.add(Permission.objects.create(name="oms-admin:*", description="Admin"))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ReferenceCacheTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def lookups(self, result):
+        return REGISTRY.get_sample_value("reference_cache_lookups_total", {"model": "Asset", "result": result}) or 0
+
+    def test_read_through(self):
+        misses, hits = self.lookups("miss"), self.lookups("hit")
+        self.assertEqual(asset_cache.get(self.base_asset.id).name, "Pine")
+        with self.assertNumQueries(0):
+            self.assertEqual(asset_cache.get(self.base_asset.id).name, "Pine")
+            self.assertEqual(asset_cache.get_by(1).name, "Pine")
+        self.assertEqual((self.lookups("miss") - misses, self.lookups("hit") - hits), (1, 2))
+        with self.assertRaises(Asset.DoesNotExist):
+            asset_cache.get_by(99)
+
+    def test_save_invalidates(self):
+        permission_cache.get_by("oms-trading:*")
+        self.permission.name = "oms-trading:read"
+        self.permission.save()
+        self.assertEqual(permission_cache.get(self.permission.id).name, "oms-trading:read")
+        with self.assertRaises(Permission.DoesNotExist):
+            permission_cache.get_by("oms-trading:*")
+
+    def test_instrument_descriptor(self):
+        self.assertEqual(instrument_cache.get_by("PINE-USD").instrument_id_broker, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(instrument_cache.get(self.instrument.id).quote_precision, 2)
+        # Saving an asset of the instrument reaches its descriptor
+        self.quote_asset.quantity_precision = 3
+        self.quote_asset.save()
+        self.assertEqual(instrument_cache.get(self.instrument.id).quote_precision, 3)
+        self.assertEqual(instrument_cache.get_by("PINE-USD").quote_precision, 3)
+
+    def test_waits_for_concurrent_load(self):
+        key = f"reference:authentium_market.asset:pk:{self.base_asset.id}"
+        cache.add(f"{key}:loading", True)
+
+        def other_worker_stores(seconds):
+            cache.set(key, self.base_asset)
+
+        with mock.patch("authentium_market.services.reference_cache.time.sleep", side_effect=other_worker_stores), \
+                self.assertNumQueries(0):
+            self.assertEqual(asset_cache.get(self.base_asset.id).name, "Pine")
+
+
+class PlaceOrderTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        calendar_index.invalidate()
+        cache.clear()
+        self.base_balance = Balance.objects.create(account=self.account, asset=self.base_asset, free=10, total=10)
+        # 1000 USD in cents, the units of an asset with quantity_precision 2
+        self.quote_balance = Balance.objects.create(
+            account=self.account, asset=self.quote_asset, free=100000, total=100000
+        )
+        login = mock.patch.object(Auth, "login", return_value="token")
+        place_order = mock.patch.object(
+            NebulaService, "place_order", return_value={"orderId": 7, "status": "Pending"}
+        )
+        login.start()
+        self.place_order = place_order.start()
+        self.addCleanup(login.stop)
+        self.addCleanup(place_order.stop)
+
+    def order(self, query="", **kwargs):
+        data = {
+            "account": self.account.id, "instrument": self.instrument.id, "order_type": "Limit", "side": "Buy",
+            "quantity": 2, "price": 10, "time_in_force": "GTC",
+        }
+        data.update(kwargs)
+        return self.client.post(reverse("place-order") + query, data, content_type="application/json")
+
+    def test_place_order_query_count(self):
+        calendar_index.market(self.instrument.id)
+        # Account with balances, balance update, order insert
+        with self.assertNumQueries(3):
+            response = self.order()
+        self.assertEqual(response.status_code, 200)
+        self.place_order.assert_called_once()
+        self.assertEqual(self.place_order.call_args.args[3], "PINE-USD")
+        self.assertTrue(Order.objects.filter(order_id=7, account=self.account).exists())
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (98000, 2000))
+
+    def test_fixed_point_amounts(self):
+        response = self.order(quantity=3, price="10.15")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.place_order.call_args.args[5], 10.15)
+        self.assertEqual(Order.objects.get(order_id=7).price, 1015)
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (96955, 3045))
+
+    def test_insufficient_balance_reserves_nothing(self):
+        response = self.order(side="Sell", quantity=11)
+        self.assertEqual(response.status_code, 400)
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (10, 0))
+        self.place_order.assert_not_called()
+
+    def test_rejected_order_releases_balance(self):
+        self.place_order.side_effect = APIException("Market is closed")
+        response = self.order(side="Sell", quantity=4)
+        self.assertEqual(response.status_code, 400)
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (10, 0))
+        self.assertFalse(Order.objects.exists())
+
+    def test_unreachable_nebula_keeps_reservation(self):
+        self.place_order.side_effect = NebulaUnavailableException("Nebula is unavailable")
+        response = self.order(side="Sell", quantity=4)
+        self.assertEqual(response.status_code, 202)
+        order = Order.objects.get(pk=response.json()["data"]["id"])
+        key = self.place_order.call_args.kwargs["idempotency_key"]
+        self.assertEqual((order.status, order.order_id, order.idempotency_key), ("Pending", None, key))
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (6, 4))
+
+        # Resubmitted with the key of the first attempt, Nebula answers with the order it already has
+        self.place_order.side_effect = None
+        OrderQueue.process(order.pk)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.order_id), ("Pending", 7))
+        self.assertEqual(self.place_order.call_args.kwargs["idempotency_key"], key)
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (6, 4))
+
+    def test_open_circuit_releases_reservation(self):
+        self.place_order.side_effect = NebulaNotSentException()
+        response = self.order(side="Sell", quantity=4)
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Order.objects.exists())
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (10, 0))
+
+    def test_queued_order(self):
+        with mock.patch.object(OrderQueue, "submit") as submit, self.captureOnCommitCallbacks(execute=True):
+            response = self.order("?async=true")
+        self.assertEqual(response.status_code, 202)
+        order = Order.objects.get(pk=response.json()["data"]["id"])
+        self.assertEqual((order.status, order.order_id), ("Pending", None))
+        submit.assert_called_once_with(order.pk)
+        self.place_order.assert_not_called()
+
+        OrderQueue.process(order.pk)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.order_id), ("Pending", 7))
+        self.assertEqual(self.place_order.call_args.kwargs["idempotency_key"], f"order-{order.pk}")
+
+    def test_rejected_queued_order_releases_balance(self):
+        self.place_order.side_effect = APIException("Market is closed")
+        with mock.patch.object(OrderQueue, "submit"):
+            response = self.order("?async=true", side="Sell", quantity=4)
+        order_pk = response.json()["data"]["id"]
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (6, 4))
+
+        OrderQueue.process(order_pk)
+        self.assertEqual(Order.objects.get(pk=order_pk).status, "Rejected")
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (10, 0))
+
+    def test_unreachable_nebula_leaves_queued_order_pending(self):
+        self.place_order.side_effect = NebulaUnavailableException()
+        with mock.patch.object(OrderQueue, "submit"):
+            response = self.order("?async=true", side="Sell", quantity=4)
+        order_pk = response.json()["data"]["id"]
+
+        OrderQueue.process(order_pk)
+        self.assertEqual(Order.objects.get(pk=order_pk).status, "Pending")
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (6, 4))
+
+    def test_resubmit_pending_orders(self):
+        self.place_order.side_effect = NebulaUnavailableException()
+        response = self.order(side="Sell", quantity=4)
+        order = Order.objects.get(pk=response.json()["data"]["id"])
+        self.place_order.side_effect = None
+        out = io.StringIO()
+        call_command("resubmit_pending_orders", "--older-than", "0", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Resubmitted 1 orders")
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.order_id), ("Pending", 7))
+
+    def test_instrument_constraints_checked_locally(self):
+        calendar_index.market(self.instrument.id)
+        cases = [
+            ({"quantity": 101}, "Quantity 101 is above the maximum 100.0"),
+            ({"quantity": 0}, "Quantity 0 is below the minimum 1.0"),
+            ({"price": 10.125}, "Price 10.125 has more than 2 decimal places"),
+        ]
+        for kwargs, detail in cases:
+            with self.subTest(**kwargs), self.assertNumQueries(0):
+                response = self.order(**kwargs)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["errors"]["detail"], detail)
+        self.place_order.assert_not_called()
+
+    def test_unknown_instrument(self):
+        response = self.order(instrument=self.instrument.id + 100)
+        self.assertEqual(response.status_code, 400)
+        self.place_order.assert_not_called()
+
+    def test_instrument_save_invalidates_descriptor(self):
+        self.assertEqual(instrument_cache.get(self.instrument.id).symbol, "PINE-USD")
+        self.instrument.symbol = "PINE-EUR"
+        self.instrument.save()
+        self.assertEqual(instrument_cache.get(self.instrument.id).symbol, "PINE-EUR")
+
+    def test_closed_market_rejects_order(self):
+        self.calendar.trading_days = []
+        self.calendar.save()
+        response = self.order()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"]["detail"], "Market of PINE-USD is closed")
+        self.place_order.assert_not_called()
+        self.quote_balance.refresh_from_db()
+        self.assertEqual(self.quote_balance.locked, 0)
+
+
+class IdempotencyTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.balance = Balance.objects.create(account=self.account, asset=self.quote_asset)
+        login = mock.patch.object(Auth, "login", return_value="token")
+        send_asset = mock.patch.object(NebulaService, "send_asset", return_value={})
+        login.start()
+        self.send_asset = send_asset.start()
+        self.addCleanup(login.stop)
+        self.addCleanup(send_asset.stop)
+
+    def deposit(self, total=5, key="deposit-1"):
+        return self.client.post(
+            reverse("deposit"), {"account": self.account.id, "asset": self.quote_asset.id, "total": total},
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_duplicates_collapse(self):
+        first, second = self.deposit(), self.deposit()
+        self.assertEqual((first.status_code, first.content), (second.status_code, second.content))
+        self.send_asset.assert_called_once()
+        self.assertEqual(self.send_asset.call_args.kwargs["idempotency_key"], "deposit-1")
+        self.balance.refresh_from_db()
+        self.assertEqual(self.balance.free, 500)
+
+    def test_key_reused_with_other_body(self):
+        self.assertEqual(self.deposit().status_code, 200)
+        self.assertEqual(self.deposit(total=6).status_code, 422)
+        self.assertEqual(self.deposit(key="deposit-2", total=6).status_code, 200)
+        self.assertEqual(self.send_asset.call_count, 2)
+
+    def test_duplicate_in_flight(self):
+        duplicates = []
+
+        def send_asset(*args, **kwargs):
+            duplicates.append(self.deposit())
+            return {}
+
+        self.send_asset.side_effect = send_asset
+        self.assertEqual(self.deposit().status_code, 200)
+        self.assertEqual(duplicates[0].status_code, 409)
+        self.send_asset.assert_called_once()
+
+
+@override_settings(NEBULA_URL="http://nebula.test/")
+class AsyncNebulaTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        calendar_index.invalidate()
+        cache.clear()
+        CircuitBreaker.reset_all()
+        self.addCleanup(CircuitBreaker.reset_all)
+        self.quote_balance = Balance.objects.create(
+            account=self.account, asset=self.quote_asset, free=100000, total=100000
+        )
+        Balance.objects.create(account=self.account, asset=self.base_asset)
+        self.requests = []
+        self.answers = {"broker/accounts/1/orders": (200, {"orderId": 7, "status": "Pending"})}
+        login = mock.patch.object(Auth, "login", return_value="token")
+        # A client per call, an AsyncClient belongs to the event loop it was created in
+        nebula = mock.patch.object(
+            AsyncHttpClient, "retry_http",
+            lambda client: httpx.AsyncClient(transport=httpx.MockTransport(self.answer)),
+        )
+        login.start()
+        nebula.start()
+        self.addCleanup(login.stop)
+        self.addCleanup(nebula.stop)
+
+    def answer(self, request):
+        self.requests.append(request)
+        status_code, body = self.answers[request.url.path.lstrip("/")]
+        if isinstance(body, Exception):
+            raise body
+        return httpx.Response(status_code, json=body)
+
+    def test_place_order(self):
+        result = asyncio.run(AsyncNebulaService("token").place_order(
+            1, "Limit", "Buy", "PINE-USD", 2, 10.0, "GTC", idempotency_key="key-1"
+        ))
+        self.assertEqual(result, {"orderId": 7, "status": "Pending"})
+        request = self.requests[0]
+        self.assertEqual((request.method, request.headers["Idempotency-Key"]), ("POST", "key-1"))
+        self.assertEqual(request.headers["Authorization"], "Bearer token")
+        self.assertEqual(json.loads(request.content)["instrument"], "PINE-USD")
+
+    def test_chained_call(self):
+        self.answers.update({
+            "broker/instruments": (200, {"id": 3, "quoteAsset": "USD"}),
+            "instruments": (200, {"id": 4}),
+        })
+        result = asyncio.run(AsyncNebulaService("token").create_instrument_broker({"symbol": "PINE-USD"}))
+        self.assertEqual(result, ({"id": 3, "quoteAsset": "USD"}, {"id": 4}))
+        self.assertEqual([request.url.path for request in self.requests], ["/broker/instruments", "/instruments"])
+
+    def test_unreachable(self):
+        self.answers["broker/accounts/1/orders"] = (None, httpx.ConnectError("Connection refused"))
+        with self.assertRaises(NebulaUnavailableException):
+            asyncio.run(AsyncNebulaService("token").place_order(1, "Limit", "Buy", "PINE-USD", 2, 10.0, "GTC"))
+
+    def test_place_order_view(self):
+        data = {
+            "account": self.account.id, "instrument": self.instrument.id, "order_type": "Limit", "side": "Buy",
+            "quantity": 2, "price": 10, "time_in_force": "GTC",
+        }
+        response = self.client.post(reverse("async-place-order"), data, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Order.objects.filter(order_id=7, account=self.account).exists())
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (98000, 2000))
+
+    def test_place_order_view_unavailable(self):
+        self.answers["broker/accounts/1/orders"] = (503, {"message": "Service Unavailable"})
+        data = {
+            "account": self.account.id, "instrument": self.instrument.id, "order_type": "Limit", "side": "Buy",
+            "quantity": 2, "price": 10, "time_in_force": "GTC",
+        }
+        response = self.client.post(reverse("async-place-order"), data, content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        order = Order.objects.get(pk=response.json()["data"]["id"])
+        self.assertEqual(order.idempotency_key, self.requests[0].headers["Idempotency-Key"])
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (98000, 2000))
+
+    def test_place_order_view_circuit_open(self):
+        breaker = CircuitBreaker.for_family("orders")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        data = {
+            "account": self.account.id, "instrument": self.instrument.id, "order_type": "Limit", "side": "Buy",
+            "quantity": 2, "price": 10, "time_in_force": "GTC",
+        }
+        response = self.client.post(reverse("async-place-order"), data, content_type="application/json")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.requests, [])
+        self.assertFalse(Order.objects.exists())
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (100000, 0))
+
+    def test_place_order_view_rejected(self):
+        self.answers["broker/accounts/1/orders"] = (400, {"code": 0, "message": "Price out of band"})
+        data = {
+            "account": self.account.id, "instrument": self.instrument.id, "order_type": "Limit", "side": "Buy",
+            "quantity": 2, "price": 10, "time_in_force": "GTC",
+        }
+        response = self.client.post(reverse("async-place-order"), data, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"]["detail"], "Price out of band")
+        self.assertFalse(Order.objects.exists())
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (100000, 0))
+
+    def test_malformed_json(self):
+        response = self.client.post(reverse("async-place-order"), b'{"account": ', content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()["errors"]["detail"].startswith("JSON parse error"))
+        self.assertEqual(self.requests, [])
+
+
+class CalendarIndexTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        calendar_index.invalidate()
+        cache.clear()
+        Calendar.objects.filter(pk=self.calendar.pk).update(
+            time_zone="+07:00",
+            market_open="09:00",
+            market_close="17:00",
+            trading_days=["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"],
+            holidays=[{"date": "2022-01-03", "name": "New Year"}, {"date": "2022-01-04", "closeTime": "12:00"}],
+        )
+
+    def market(self, at):
+        return self.client.get(reverse("instrument-market", args=[self.instrument.id]), {"at": at}).json()["data"]
+
+    def test_sessions(self):
+        cases = [
+            # Saturday, the first session is on Tuesday as Monday is a holiday
+            ("2022-01-01T12:00:00+07:00", {"is_open": False, "closes_at": None, "next_open": "2022-01-04T02:00:00Z"}),
+            # Early close of the Tuesday holiday
+            ("2022-01-04T11:00:00+07:00", {"is_open": True, "closes_at": "2022-01-04T05:00:00Z", "next_open": None}),
+            ("2022-01-04T13:00:00+07:00", {"is_open": False, "closes_at": None, "next_open": "2022-01-05T02:00:00Z"}),
+            ("2022-01-05T09:00:00+07:00", {"is_open": True, "closes_at": "2022-01-05T10:00:00Z", "next_open": None}),
+        ]
+        for at, expected in cases:
+            with self.subTest(at=at):
+                self.assertEqual(self.market(at), expected)
+
+    def test_calendar_save_invalidates_index(self):
+        self.assertFalse(self.market("2022-01-03T10:00:00+07:00")["is_open"])
+        self.calendar.refresh_from_db()
+        self.calendar.holidays = []
+        self.calendar.save()
+        self.assertTrue(self.market("2022-01-03T10:00:00+07:00")["is_open"])
+
+    def test_lookups_do_not_query(self):
+        ts = datetime.datetime(2022, 1, 5, 3, tzinfo=datetime.timezone.utc).timestamp()
+        calendar_index.market(self.instrument.id, ts)
+        with self.assertNumQueries(0):
+            self.assertTrue(calendar_index.is_open(self.instrument.id, ts + 3600))
+            self.assertEqual(calendar_index.next_open(self.instrument.id, ts + 8 * 3600), ts + 23 * 3600)
+
+
+class PlaceOrderBatchTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        calendar_index.invalidate()
+        cache.clear()
+        self.base_balance = Balance.objects.create(account=self.account, asset=self.base_asset, free=10, total=10)
+        self.quote_balance = Balance.objects.create(
+            account=self.account, asset=self.quote_asset, free=100000, total=100000
+        )
+        login = mock.patch.object(Auth, "login", return_value="token")
+        login.start()
+        self.addCleanup(login.stop)
+
+    def order(self, **kwargs):
+        data = {
+            "account": self.account.id, "instrument": self.instrument.id, "order_type": "Limit", "side": "Buy",
+            "quantity": 2, "price": 10, "time_in_force": "GTC",
+        }
+        data.update(kwargs)
+        return data
+
+    def test_partial_failures(self):
+        def place_order(account_id, order_type, side, instrument, quantity, price, time_in_force, **kwargs):
+            if quantity == 3:
+                raise APIException("Market is closed")
+            return {"orderId": 100 + quantity, "status": "Pending"}
+
+        basket = [self.order(), self.order(side="Sell", quantity=50), self.order(side="Sell", quantity=3)]
+        with mock.patch.object(NebulaService, "place_order", side_effect=place_order) as nebula:
+            response = self.client.post(reverse("place-order-batch"), basket, content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["data"]
+        self.assertEqual(results[0], {"index": 0, "order_id": 102, "status": "Pending"})
+        self.assertEqual(results[1], {"index": 1, "error": "The balance asset is not enough"})
+        self.assertEqual(results[2], {"index": 2, "error": "Market is closed"})
+        self.assertEqual(nebula.call_count, 2)
+        self.assertEqual(list(Order.objects.values_list("order_id", flat=True)), [102])
+        self.base_balance.refresh_from_db()
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (10, 0))
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (98000, 2000))
+
+    def test_unknown_outcomes_keep_reservation(self):
+        def place_order(account_id, order_type, side, instrument, quantity, price, time_in_force, **kwargs):
+            if quantity == 3:
+                raise NebulaUnavailableException()
+            if quantity == 4:
+                raise KeyError("orderId")
+            return {"orderId": 100 + quantity, "status": "Pending"}
+
+        basket = [self.order(), self.order(side="Sell", quantity=3), self.order(side="Sell", quantity=4)]
+        with mock.patch.object(NebulaService, "place_order", side_effect=place_order):
+            response = self.client.post(reverse("place-order-batch"), basket, content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["data"]
+        self.assertEqual(results[0], {"index": 0, "order_id": 102, "status": "Pending"})
+        pending = Order.objects.filter(order_id__isnull=True).order_by("quantity")
+        self.assertEqual([(order.quantity, order.status) for order in pending], [(3, "Pending"), (4, "Pending")])
+        self.assertTrue(all(order.idempotency_key for order in pending))
+        self.assertEqual(results[1], {"index": 1, "id": pending[0].pk, "status": "Pending"})
+        self.assertEqual(results[2], {"index": 2, "id": pending[1].pk, "status": "Pending"})
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (3, 7))
+
+    def test_unsent_order_released(self):
+        basket = [self.order(side="Sell", quantity=3)]
+        with mock.patch.object(NebulaService, "place_order", side_effect=NebulaNotSentException()):
+            response = self.client.post(reverse("place-order-batch"), basket, content_type="application/json")
+        self.assertEqual(response.json()["data"], [{"index": 0, "error": NebulaNotSentException.detail}])
+        self.assertFalse(Order.objects.exists())
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked), (10, 0))
+
+    def test_invalid_order_rejects_basket(self):
+        with mock.patch.object(NebulaService, "place_order") as nebula:
+            response = self.client.post(
+                reverse("place-order-batch"), [self.order(), self.order(side="Hold")], content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 400)
+        nebula.assert_not_called()
+
+
+class ExecutionsTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        calendar_index.invalidate()
+        cache.clear()
+        self.base_balance = Balance.objects.create(
+            account=self.account, asset=self.base_asset, free=6, locked=4, total=10
+        )
+        self.quote_balance = Balance.objects.create(
+            account=self.account, asset=self.quote_asset, free=98000, locked=2000, total=100000
+        )
+        for order_id, side, quantity in ((1, "Buy", 2), (2, "Sell", 4)):
+            Order.objects.create(
+                order_id=order_id, account=self.account, order_type="Limit", side=side, instrument=self.instrument,
+                quantity=quantity, price=1000, time_in_force="GTC", status="Pending",
+            )
+
+    def test_apply_batch(self):
+        apply_executions([
+            Execution(execution_id=10, order_id=1, status="Executed", quantity=2, price=9, remaining=0),
+            Execution(execution_id=11, order_id=2, status="PartiallyFilled", quantity=1, price=11, remaining=3),
+            Execution(execution_id=12, order_id=2, status="Cancelled", quantity=0, price=0, remaining=3),
+        ])
+        self.assertEqual(
+            dict(Order.objects.values_list("order_id", "status")), {1: "Executed", 2: "Cancelled"}
+        )
+        self.base_balance.refresh_from_db()
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.locked, self.base_balance.total), (11, 0, 11))
+        self.assertEqual(
+            (self.quote_balance.free, self.quote_balance.locked, self.quote_balance.total), (99300, 0, 99300)
+        )
+
+    def test_fills_unlock_what_was_locked(self):
+        Instrument.objects.filter(pk=self.instrument.pk).update(price_precision=3)
+        cache.clear()
+        # 3 at 1.005 locked 3.015 rounded up, 302 cents
+        Order.objects.create(
+            order_id=3, account=self.account, order_type="Limit", side="Buy", instrument=self.instrument,
+            quantity=3, price=1005, time_in_force="GTC", status="Pending",
+        )
+        Balance.objects.filter(pk=self.quote_balance.pk).update(free=99698, locked=302, total=100000)
+        apply_executions([
+            Execution(execution_id=20 + filled, order_id=3, status="Executed" if filled == 3 else "PartiallyFilled",
+                      quantity=1, price=1.005, remaining=3 - filled)
+            for filled in (1, 2, 3)
+        ])
+        self.quote_balance.refresh_from_db()
+        self.assertEqual(
+            (self.quote_balance.free, self.quote_balance.locked, self.quote_balance.total), (99700, 0, 99700)
+        )
+
+    def test_replayed_executions_applied_once(self):
+        executions = [
+            Execution(execution_id=10, order_id=1, status="PartiallyFilled", quantity=1, price=10, remaining=1),
+            Execution(execution_id=10, order_id=1, status="PartiallyFilled", quantity=1, price=10, remaining=1),
+        ]
+        apply_executions(executions)
+        apply_executions(executions[:1])
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.free, self.base_balance.total), (7, 11))
+        self.assertEqual(AppliedExecution.objects.count(), 1)
+
+    def test_execution_before_its_order(self):
+        execution = Execution(execution_id=30, order_id=9, status="Executed", quantity=1, price=10, remaining=0)
+        self.assertEqual(apply_executions([execution]), (0, [execution]))
+        self.assertFalse(AppliedExecution.objects.exists())
+
+        # The placement is saved after Nebula filled it
+        Order.objects.create(
+            order_id=9, account=self.account, order_type="Limit", side="Sell", instrument=self.instrument,
+            quantity=1, price=1000, time_in_force="GTC", status="Pending",
+        )
+        self.assertEqual(apply_executions([execution]), (1, []))
+        self.assertEqual(Order.objects.get(order_id=9).status, "Executed")
+        self.base_balance.refresh_from_db()
+        self.assertEqual((self.base_balance.locked, self.base_balance.total), (3, 9))
+
+    def test_consumer_keeps_execution_until_order_exists(self):
+        consumer = ExecutionConsumer(window=0.01, batch_size=10)
+        consumer.on_event({"q": SUBSCRIBE_EXECUTIONS, "d": {
+            "trackingNumber": 30, "orderId": 9, "orderStatus": "Executed", "executedQuantity": 1,
+            "executedPrice": 10,
+        }})
+        batch = consumer.collect()
+        self.assertTrue(consumer.apply(batch))
+        Order.objects.create(
+            order_id=9, account=self.account, order_type="Limit", side="Sell", instrument=self.instrument,
+            quantity=1, price=1000, time_in_force="GTC", status="Pending",
+        )
+        self.assertEqual(consumer.collect(), batch)
+        self.assertTrue(consumer.apply(batch))
+        self.assertEqual(Order.objects.get(order_id=9).status, "Executed")
+        self.assertEqual(consumer.collect(), [])
+
+    def test_failed_batch_retried(self):
+        consumer = ExecutionConsumer(window=0.01, batch_size=10)
+        execution = Execution(execution_id=10, order_id=1, status="Executed", quantity=2, price=10, remaining=0)
+        with mock.patch("authentium_market.services.executions.apply_executions", side_effect=OSError), \
+                mock.patch("authentium_market.services.executions.connection"):
+            self.assertFalse(consumer.apply([execution]))
+        # Not seen yet: the report resent after a reconnection is kept
+        consumer.on_event({"q": SUBSCRIBE_EXECUTIONS, "d": {
+            "trackingNumber": 10, "orderId": 1, "orderStatus": "Executed", "executedQuantity": 2,
+            "executedPrice": 10,
+        }})
+        self.assertEqual(consumer.collect(), [execution])
+        self.assertTrue(consumer.apply([execution]))
+        consumer.on_event({"q": SUBSCRIBE_EXECUTIONS, "d": {"trackingNumber": 10, "orderId": 1}})
+        self.assertEqual(consumer.collect(), [])
+        self.assertEqual(Order.objects.get(order_id=1).status, "Executed")
+
+
+class UpdateInstrumentTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.order = Order.objects.create(
+            order_id=1, account=self.account, order_type="Limit", side="Buy", instrument=self.instrument,
+            quantity=1, price=1050, time_in_force="GTC", status="Pending",
+        )
+        patches = [
+            mock.patch.object(Auth, "login", return_value="token"),
+            mock.patch.object(NebulaService, "update_instrument_broker", return_value={}),
+            mock.patch.object(NebulaService, "update_instrument_exchange", side_effect=self.exchange),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    @staticmethod
+    def exchange(instrument_id, data, data_broker):
+        return {
+            "symbol": data["symbol"], "quoteCurrency": "USD", "pricePrecision": data["price_precision"],
+            "quantityPrecision": data["quantity_precision"], "minQuantity": data["min_quantity"],
+            "maxQuantity": data["max_quantity"], "status": data["status"], "description": data["description"],
+        }
+
+    def update(self, price_precision):
+        data = {
+            "symbol": "PINE-USD", "status": "Active", "description": "Pine", "calendar_ins": self.calendar.id,
+            "price_precision": price_precision, "quantity_precision": 0, "min_quantity": 1, "max_quantity": 100,
+        }
+        return self.client.put(reverse("instrument", args=[self.instrument.id]), data, content_type="application/json")
+
+    def test_more_decimal_places_rescale_prices(self):
+        response = self.update(4)
+        self.assertEqual(response.status_code, 204)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.price, 105000)
+        self.assertEqual(instrument_cache.get(self.instrument.id).price_precision, 4)
+
+    def test_update_changes_etag(self):
+        Instrument.objects.filter(pk=self.instrument.pk).update(
+            updated_at=datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+        )
+        url = reverse("instrument", args=[self.instrument.id])
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.update(2).status_code, 204)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_fewer_decimal_places(self):
+        response = self.update(0)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["errors"]["detail"], "Orders of PINE-USD have prices with more than 0 decimal places"
+        )
+        self.assertEqual(Instrument.objects.get(pk=self.instrument.pk).price_precision, 2)
+
+        response = self.update(1)
+        self.assertEqual(response.status_code, 204)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.price, 105)
+
+
+class CancelOrdersTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        for order_id, side, status in ((1, "Buy", "Pending"), (2, "Sell", "Pending"), (3, "Buy", "Executed"),
+                                       (4, "Buy", "PartiallyFilled")):
+            Order.objects.create(
+                order_id=order_id, account=self.account, order_type="Limit", side=side, instrument=self.instrument,
+                quantity=1, price=1000, time_in_force="GTC", status=status,
+            )
+        login = mock.patch.object(Auth, "login", return_value="token")
+        login.start()
+        self.addCleanup(login.stop)
+
+    def test_cancel_open_orders_of_side(self):
+        def cancel(account_id, order_id, instrument, **kwargs):
+            if order_id == 4:
+                raise APIException("Order not found")
+            return {}
+
+        with mock.patch.object(NebulaService, "cancel_place_order", side_effect=cancel) as nebula, \
+                self.assertNumQueries(2):
+            response = self.client.post(
+                reverse("place-order-cancel"), {"account": self.account.id, "side": "Buy"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"], {
+            "canceled": [1],
+            "dequeued": [],
+            "failed": [{"id": Order.objects.get(order_id=4).pk, "order_id": 4, "error": "Order not found"}],
+        })
+        self.assertCountEqual(
+            [call.args for call in nebula.call_args_list], [(1, 1, "PINE-USD"), (1, 4, "PINE-USD")]
+        )
+        self.assertEqual(
+            dict(Order.objects.values_list("order_id", "status")),
+            {1: "Canceled", 2: "Pending", 3: "Executed", 4: "PartiallyFilled"},
+        )
+
+    def test_queued_orders_canceled_locally(self):
+        base_balance = Balance.objects.create(account=self.account, asset=self.base_asset, free=5, locked=5, total=10)
+        queued, unconfirmed = [
+            Order.objects.create(
+                account=self.account, order_type="Limit", side="Sell", instrument=self.instrument, quantity=quantity,
+                price=1000, time_in_force="GTC", status="Pending", idempotency_key=key,
+            )
+            for quantity, key in ((3, None), (2, "key-1"))
+        ]
+        with mock.patch.object(NebulaService, "cancel_place_order", return_value={}) as nebula:
+            response = self.client.post(
+                reverse("place-order-cancel"), {"account": self.account.id, "side": "Sell"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"], {
+            "canceled": [2],
+            "dequeued": [queued.pk],
+            "failed": [{
+                "id": unconfirmed.pk, "order_id": None,
+                "error": "The order is waiting for Nebula to confirm it, retry later",
+            }],
+        })
+        nebula.assert_called_once()
+        self.assertEqual(Order.objects.get(pk=queued.pk).status, "Canceled")
+        self.assertEqual(Order.objects.get(pk=unconfirmed.pk).status, "Pending")
+        base_balance.refresh_from_db()
+        self.assertEqual((base_balance.free, base_balance.locked), (8, 2))
+
+        # The worker finds it canceled and does not send it
+        with mock.patch.object(NebulaService, "place_order") as place_order:
+            OrderQueue.process(queued.pk)
+        place_order.assert_not_called()
+
+    def test_unexpected_error_fails_one_order(self):
+        def cancel(account_id, order_id, instrument, **kwargs):
+            if order_id == 4:
+                raise ValueError("Expecting value")
+            return {}
+
+        with mock.patch.object(NebulaService, "cancel_place_order", side_effect=cancel):
+            response = self.client.post(
+                reverse("place-order-cancel"), {"account": self.account.id, "side": "Buy"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"], {
+            "canceled": [1],
+            "dequeued": [],
+            "failed": [
+                {"id": Order.objects.get(order_id=4).pk, "order_id": 4, "error": "Unable to process the request"}
+            ],
+        })
+        self.assertEqual(Order.objects.get(order_id=4).status, "PartiallyFilled")
+
+
+class FakeOmsSocket:
+    """
+    In-memory broker.oms connection: opens the session and answers placeOrder unless hold is set.
+    Like websocket-client, a pong counts as traffic for the read timeout.
+    """
+
+    def __init__(self, hold=False):
+        self.hold = hold
+        self.sent = []
+        self.pings = 0
+        self.timeout = None
+        self.inbox = queue.Queue()
+        self.ponged = False
+
+    def send(self, payload):
+        message = json.loads(payload)
+        self.sent.append(message)
+        if message["q"] == CREATE_SESSION:
+            self.answer(message["sid"], {"sessionId": "session-1"})
+        elif message["q"] == PLACE_ORDER and not self.hold:
+            self.answer(message["sid"], {"orderId": 100 + message["sid"], "status": "Pending"})
+
+    def answer(self, sid, data):
+        self.inbox.put(json.dumps({"sid": sid, "d": data}))
+
+    def recv(self):
+        while True:
+            try:
+                message = self.inbox.get(timeout=self.timeout)
+            except queue.Empty:
+                if self.ponged:
+                    self.ponged = False
+                    continue
+                raise WebSocketTimeoutException("timed out")
+            if message is None:
+                raise WebSocketConnectionClosedException("closed")
+            return message
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def ping(self):
+        self.pings += 1
+        self.ponged = True
+
+    def close(self):
+        self.inbox.put(None)
+
+    def requests(self, q):
+        return [message for message in self.sent if message["q"] == q]
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.01)
+
+
+class OmsSessionTest(TestCase):
+    def setUp(self):
+        self.hold = False
+        self.sockets = []
+        create_connection = mock.patch(
+            "authentium_market.services.websocket.create_connection", side_effect=self.connect
+        )
+        create_connection.start()
+        self.addCleanup(create_connection.stop)
+
+    def connect(self, url, timeout=None):
+        socket = FakeOmsSocket(hold=self.hold)
+        self.sockets.append(socket)
+        return socket
+
+    def session(self, **kwargs):
+        kwargs.setdefault("heartbeat_interval", 10)
+        kwargs.setdefault("request_timeout", 2)
+        session = OmsSession("ws://nebula.local/", lambda: "token", backoff_max=1, **kwargs)
+        self.addCleanup(session.close)
+        return session
+
+    def test_responses_matched_by_sid(self):
+        self.hold = True
+        session = self.session()
+        results = {}
+        threads = [
+            threading.Thread(target=lambda q=quantity: results.__setitem__(q, session.place_order(
+                1, "Limit", "Buy", "PINE-USD", q, 10.0, "GTC"
+            )))
+            for quantity in (1, 2)
+        ]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: len(self.sockets) == 1 and len(self.sockets[0].requests(PLACE_ORDER)) == 2)
+        socket = self.sockets[0]
+        # Answered in the reverse order, each caller still gets its own order
+        for message in reversed(socket.requests(PLACE_ORDER)):
+            socket.answer(message["sid"], {"orderId": message["d"]["quantity"] * 10, "status": "Pending"})
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(results, {1: {"orderId": 10, "status": "Pending"}, 2: {"orderId": 20, "status": "Pending"}})
+        self.assertEqual(len(self.sockets), 1)
+
+    def test_error_response(self):
+        self.hold = True
+        session = self.session()
+
+        def reject():
+            wait_for(lambda: self.sockets and self.sockets[0].requests(PLACE_ORDER))
+            message = self.sockets[0].requests(PLACE_ORDER)[0]
+            self.sockets[0].answer(message["sid"], {"errorCode": 1, "errorMessage": "Bad"})
+
+        thread = threading.Thread(target=reject)
+        thread.start()
+        with self.assertRaises(APIException) as raised:
+            session.place_order(1, "Limit", "Buy", "PINE-USD", 1, 10.0, "GTC")
+        thread.join()
+        self.assertEqual(raised.exception.detail, "Bad")
+
+    def test_request_timeout(self):
+        self.hold = True
+        session = self.session(request_timeout=0.1)
+        with self.assertRaises(NebulaUnavailableException):
+            session.place_order(1, "Limit", "Buy", "PINE-USD", 1, 10.0, "GTC")
+        # A late answer is dropped instead of reaching another request
+        self.sockets[0].answer(2, {"orderId": 1})
+        self.assertEqual(session._pending, {})
+
+    def test_heartbeat_keeps_connection(self):
+        session = self.session(heartbeat_interval=0.05)
+        wait_for(lambda: session.connected and self.sockets[0].pings >= 3)
+        self.assertAlmostEqual(self.sockets[0].timeout, 0.15)
+        self.assertEqual(len(self.sockets), 1)
+
+    @mock.patch("authentium_market.services.websocket.random.uniform", return_value=0)
+    def test_reconnect_resubscribes(self, uniform):
+        events = []
+        session = self.session()
+        session.on_event = events.append
+        wait_for(lambda: session.connected)
+        session.subscribe("v1/broker.oms/executionReports", {"accountId": 1})
+        self.sockets[0].close()
+
+        wait_for(lambda: len(self.sockets) == 2 and session.connected)
+        socket = self.sockets[1]
+        self.assertEqual(
+            [message["q"] for message in socket.sent], [CREATE_SESSION, "v1/broker.oms/executionReports"]
+        )
+        socket.inbox.put(json.dumps({"q": "v1/broker.oms/executionReports", "d": {"orderId": 7}}))
+        wait_for(lambda: events)
+        self.assertEqual(events[0]["d"], {"orderId": 7})
+        self.assertEqual(session.place_order(1, "Limit", "Buy", "PINE-USD", 1, 10.0, "GTC")["status"], "Pending")
+
+
+@override_settings(ORDER_ENTRY="websocket")
+class WebSocketOrderEntryTest(MarketDataMixin, TestCase):
+    def setUp(self):
+        calendar_index.invalidate()
+        cache.clear()
+        self.quote_balance = Balance.objects.create(
+            account=self.account, asset=self.quote_asset, free=100000, total=100000
+        )
+        Balance.objects.create(account=self.account, asset=self.base_asset)
+        self.socket = FakeOmsSocket()
+        patches = [
+            mock.patch("authentium_market.services.websocket.create_connection", return_value=self.socket),
+            mock.patch.object(Auth, "login", return_value="token"),
+            mock.patch.object(Auth, "trader_token", return_value="trader-token"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(OmsSessionManager.close_all)
+        self.data = {
+            "account": self.account.id, "instrument": self.instrument.id, "order_type": "Limit", "side": "Buy",
+            "quantity": 2, "price": 10, "time_in_force": "GTC",
+        }
+
+    def test_place_order_over_session(self):
+        with mock.patch.object(NebulaService, "place_order") as rest:
+            response = self.client.post(reverse("place-order"), self.data, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        rest.assert_not_called()
+        self.assertEqual(self.socket.sent[0]["d"], {"token": "trader-token"})
+        request = self.socket.requests(PLACE_ORDER)[0]
+        self.assertEqual((request["d"]["accountId"], request["d"]["instrument"]), (1, "PINE-USD"))
+        self.assertTrue(Order.objects.filter(order_id=100 + request["sid"], account=self.account).exists())
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (98000, 2000))
+
+    @override_settings(OMS_REQUEST_TIMEOUT=0.1)
+    def test_unanswered_order_not_resubmitted(self):
+        self.socket.hold = True
+        response = self.client.post(reverse("place-order"), self.data, content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        order = Order.objects.get(pk=response.json()["data"]["id"])
+        self.assertEqual((order.status, order.order_id, order.idempotency_key), ("Unconfirmed", None, None))
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (98000, 2000))
+
+        with mock.patch.object(NebulaService, "place_order") as rest:
+            call_command("resubmit_pending_orders", "--older-than", "0", stdout=io.StringIO())
+            OrderQueue.process(order.pk)
+        rest.assert_not_called()
+        self.assertEqual(len(self.socket.requests(PLACE_ORDER)), 1)
+
+    @override_settings(OMS_REQUEST_TIMEOUT=0.1)
+    def test_disconnected_session_releases_reservation(self):
+        with mock.patch("authentium_market.services.websocket.create_connection", side_effect=OSError("refused")):
+            response = self.client.post(reverse("place-order"), self.data, content_type="application/json")
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Order.objects.exists())
+        self.quote_balance.refresh_from_db()
+        self.assertEqual((self.quote_balance.free, self.quote_balance.locked), (100000, 0))
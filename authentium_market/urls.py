@@ -1,10 +1,12 @@
 from django.urls import path
 
-from authentium_market import views
+from authentium_market import views, async_views
 
 urlpatterns = [
 
     path('place_order', views.PlaceOrderView.as_view(), name='place-order'),
+    path('place_order/batch', views.PlaceOrderBatchView.as_view(), name='place-order-batch'),
+    path('place_order/cancel', views.CancelOrdersView.as_view(), name='place-order-cancel'),
     path('trade_fee', views.TraderFeeView.as_view(), name='trade-fee'),
     path('opt_in', views.OptInView.as_view(), name='opt-in'),
     path('deposit', views.DepositView.as_view(), name='deposit'),
@@ -21,6 +23,13 @@ urlpatterns = [
     path('calendars', views.CalendarsView.as_view(), name="calendar"),
 
     path('instruments/<int:pk>', views.InstrumentsView.as_view(), name="instrument"),
-    path('instruments', views.InstrumentView.as_view(), name="instruments")
+    path('instruments/<int:pk>/market', views.InstrumentMarketView.as_view(), name="instrument-market"),
+    path('instruments', views.InstrumentView.as_view(), name="instruments"),
+
+    # Async variants of the Nebula-bound endpoints, meant to be served under ASGI
+    path('async/place_order', async_views.place_order, name='async-place-order'),
+    path('async/trade_fee', async_views.trade_fee, name='async-trade-fee'),
+    path('async/opt_in', async_views.opt_in, name='async-opt-in'),
+    path('async/deposit', async_views.deposit, name='async-deposit'),
 
 ]
@@ -1,6 +1,15 @@
+import functools
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_aware, make_aware, now
 from drf_yasg.utils import swagger_auto_schema
 from .form.place_order_form import PlaceOrderSerializer, TradingFeeSerializer, CancelPlaceOrderSerializer, \
-    OptInSerializer
+    OptInSerializer, CancelOrdersSerializer
 from .form.instrument_form import InstrumentSerializer, UpdateInstrumentSerializer
 from .form.asset import AssetSerializer, AssetCreateSerializer, AssetUpdateSerializer
 from .form.calendar import CalendarSerializer, CalendarViewSerializer
@@ -17,26 +26,43 @@ from .form.trader_form import (
 )
 from .form import BaseSerializer
 
-from .models import Order, TradingFee, Balance, Instrument
-from django.db.models import Q
-from .constants import Side
+from .models import TradingFee, Balance, Instrument, Order
+from django.utils.functional import cached_property
 from rest_framework.generics import get_object_or_404
-from authentium_market.conf.exceptions import APIException
+from authentium_market.conf.conditional import conditional_detail, conditional_list
+from authentium_market.conf.exceptions import APIException, NebulaNotSentException, NebulaUnavailableException
 from authentium_market.conf.handlers import json_response
+from authentium_market.conf.pagination import paginate
+from authentium_market.services import orders
 from authentium_market.services.auth import Auth
-from django.core.paginator import Paginator, InvalidPage
-from rest_framework.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from authentium_market.services.calendars import calendar_index
+from authentium_market.services.idempotency import IdempotentRequest
+from authentium_market.services.instruments import instrument_cache
+from authentium_market.services.order_queue import OrderQueue, queue_requested
+from authentium_market.services.reference_cache import (
+    asset_cache,
+    calendar_cache,
+    permission_cache,
+)
+from rest_framework.status import HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_204_NO_CONTENT
 from rest_framework.views import APIView
 from authentium_market.services.nebula_service import NebulaService
 from authentium_market.models import Asset, Calendar, Account, Permission, Trader
-from authentium_market.common.constants import DATA_PER_PAGE_DEFAULT, PAGE_DEFAULT
 
 
-class AssetView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
+class NebulaAPIView(APIView):
+    """
+    Base view giving handlers access to Nebula.
+    The NebulaService is created, and the admin token resolved, only the first time a handler uses it,
+    so handlers that only read the Authentium database never log in.
+    """
+
+    @cached_property
+    def nebula_service(self):
+        return NebulaService(Auth().login())
+
 
+class AssetView(NebulaAPIView):
     @swagger_auto_schema(request_body=AssetUpdateSerializer)
     def patch(self, request, pk, *args, **kwargs):
         """
@@ -58,21 +84,18 @@ class AssetView(APIView):
         return json_response(status_code=HTTP_204_NO_CONTENT)
 
     # get an asset with id
+    @conditional_detail(Asset)
     def get(self, request, pk):
         """
         Get information of an asset in Authentium using id
         """
-        asset = get_object_or_404(Asset, id=pk)
+        asset = get_object_or_404(AssetSerializer.query_set(), id=pk)
         asset_response = AssetSerializer(asset)
         return json_response(data=asset_response.data)
 
 
 # include create an asset and get all assets
-class AssetsView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class AssetsView(NebulaAPIView):
     @swagger_auto_schema(request_body=AssetCreateSerializer)
     def post(self, request, *args, **kwargs):
         """
@@ -110,31 +133,24 @@ class AssetsView(APIView):
         return json_response(status_code=HTTP_201_CREATED)
 
     @swagger_auto_schema(query_serializer=BaseSerializer())
+    @conditional_list(Asset)
     def get(self, request):
         """
             Get all assets data
             Parameter:
-            - "page": page number
+            - "cursor": "next" or "prev" cursor of the previous response, first page without it
             - "per_page": data per page
+            - "count": true to get the total
+            - "fields": comma separated fields to return, e.g. "id,name", all of them without it
         """
-        page = request.data.get("page", PAGE_DEFAULT)
-        per_page = request.data.get("per_page", DATA_PER_PAGE_DEFAULT)
-        assets = Asset.objects.all().order_by('id')
-        try:
-            paginator_asset = Paginator(assets, per_page)
-            assets = paginator_asset.get_page(page)
-        except InvalidPage as e:
-            raise APIException(e)
-        response = AssetSerializer(assets, many=True).data
+        fields = AssetSerializer.field_names(request)
+        assets = paginate(request, AssetSerializer.values(fields))
+        response = AssetSerializer.represent(assets, fields)
         return json_response(data=response, pagination=assets)
 
 
 # Accounts API
-class AccountsView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class AccountsView(NebulaAPIView):
     @swagger_auto_schema(request_body=RequestAccountSerializer)
     def post(self, request):
         """
@@ -165,41 +181,33 @@ class AccountsView(APIView):
         return json_response(status_code=HTTP_201_CREATED)
 
     @swagger_auto_schema(query_serializer=BaseSerializer())
+    @conditional_list(Account)
     def get(self, request):
         """
         Get all account data
         Parameter:
-        - "page": page number
+        - "cursor": "next" or "prev" cursor of the previous response, first page without it
         - "per_page": data per page
+        - "count": true to get the total
+        - "fields": comma separated fields to return, e.g. "id,name", all of them without it
         """
-        page = request.data.get("page", PAGE_DEFAULT)
-        per_page = request.data.get("per_page", DATA_PER_PAGE_DEFAULT)
-
-        accounts = Account.objects.all()
+        fields = AccountSerializer.field_names(request)
+        accounts = paginate(request, AccountSerializer.values(fields))
 
-        try:
-            paginator_account = Paginator(accounts, per_page)
-            accounts = paginator_account.get_page(page)
-        except InvalidPage as e:
-            raise APIException(e)
-
-        response = AccountSerializer(accounts, many=True).data
+        response = AccountSerializer.represent(accounts, fields)
 
         return json_response(data=response, pagination=accounts)
 
 
 # Account API
-class AccountView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class AccountView(NebulaAPIView):
+    @conditional_detail(Account)
     def get(self, request, pk):
         """
         Get account from Authentium database using "id"
         """
         # Get account using id
-        account = get_object_or_404(Account, id=pk)
+        account = get_object_or_404(AccountSerializer.query_set(), id=pk)
         return json_response(data=AccountSerializer(account).data)
 
     @swagger_auto_schema(request_body=RequestAccountSerializer)
@@ -226,11 +234,7 @@ class AccountView(APIView):
 
 
 # Permission API
-class PermissionView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class PermissionView(NebulaAPIView):
     @swagger_auto_schema(query_serializer=RequestPermissionSerializer())
     def get(self, request):
         """
@@ -257,11 +261,7 @@ class PermissionView(APIView):
         return json_response(data=response)
 
 
-class TradersView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class TradersView(NebulaAPIView):
     @swagger_auto_schema(request_body=CreateTraderSerializer)
     def post(self, request):
         """
@@ -305,7 +305,7 @@ class TradersView(APIView):
         # Add permissions to trader
         try:
             for p in trader_data["permissions"]:
-                permission = permission_data.get(name=p)
+                permission = permission_cache.get_by(p)
                 trader.permissions.add(permission)
         except Permission.DoesNotExist as e:
             raise APIException(detail="Permission not found") from e
@@ -313,39 +313,31 @@ class TradersView(APIView):
         return json_response(status_code=HTTP_201_CREATED)
 
     @swagger_auto_schema(query_serializer=BaseSerializer())
+    @conditional_list(Trader)
     def get(self, request):
         """
         Get all trader data
         Parameter:
-        - "page": page number
-        - "data_per_page": data per page
+        - "cursor": "next" or "prev" cursor of the previous response, first page without it
+        - "per_page": data per page
+        - "count": true to get the total
+        - "fields": comma separated fields to return, e.g. "id,name", all of them without it
         """
-        page = request.data.get("page", PAGE_DEFAULT)
-        per_page = request.data.get("per_page", DATA_PER_PAGE_DEFAULT)
-
-        trader_response = Trader.objects.all()
+        fields = TraderSerializer.field_names(request)
+        trader_list = paginate(request, TraderSerializer.values(fields))
 
-        try:
-            paginator_trader = Paginator(trader_response, per_page)
-            trader_list = paginator_trader.get_page(page)
-        except InvalidPage as e:
-            raise APIException(e)
-
-        response = TraderSerializer(trader_list, many=True).data
+        response = TraderSerializer.represent(trader_list, fields)
         return json_response(data=response, pagination=trader_list)
 
 
-class TraderView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class TraderView(NebulaAPIView):
+    @conditional_detail(Trader)
     def get(self, request, pk):
         """
         Get trader from Authentium database using "id"
         """
         # Get trader using id (id in Authentium database, not Exberry id)
-        trader = get_object_or_404(Trader, id=pk)
+        trader = get_object_or_404(TraderSerializer.query_set(), id=pk)
         return json_response(data=TraderSerializer(trader).data)
 
     @swagger_auto_schema(request_body=UpdateTraderSerializer)
@@ -387,11 +379,7 @@ class TraderView(APIView):
         return json_response(status_code=HTTP_204_NO_CONTENT)
 
 
-class CalendarView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class CalendarView(NebulaAPIView):
     # update an existing calendar
     @swagger_auto_schema(request_body=CalendarSerializer)
     def put(self, request, pk, *args, **kwargs):
@@ -436,19 +424,16 @@ class CalendarView(APIView):
         return json_response(status_code=HTTP_204_NO_CONTENT)
 
     # get a calendar with id
+    @conditional_detail(Calendar)
     def get(self, request, pk):
         """
         Get information of a calendar in Authentium using id
         """
-        calendar = get_object_or_404(Calendar, id=pk)
+        calendar = get_object_or_404(CalendarViewSerializer.query_set(), id=pk)
         return json_response(data=CalendarViewSerializer(calendar).data)
 
 
-class CalendarsView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class CalendarsView(NebulaAPIView):
     @swagger_auto_schema(request_body=CalendarSerializer)
     def post(self, request, *args, **kwargs):
         """
@@ -494,30 +479,23 @@ class CalendarsView(APIView):
         return json_response(data=f'Calendar {calendar_data["name"]} create successful')
 
     @swagger_auto_schema(query_serializer=BaseSerializer())
+    @conditional_list(Calendar)
     def get(self, request):
         """
         Get all calendars data
         Parameter:
-        - "page": page number
-        - "data_per_page": data per page
+        - "cursor": "next" or "prev" cursor of the previous response, first page without it
+        - "per_page": data per page
+        - "count": true to get the total
+        - "fields": comma separated fields to return, e.g. "id,name", all of them without it
         """
-        page = request.GET.get("page", PAGE_DEFAULT)
-        per_page = request.GET.get("per_page", DATA_PER_PAGE_DEFAULT)
-        calendar_response = Calendar.objects.all().order_by("id")
-        try:
-            paginator_calendar = Paginator(calendar_response, per_page)
-            calendars = paginator_calendar.get_page(page)
-        except InvalidPage as e:
-            raise APIException(e)
-        response = CalendarViewSerializer(calendars, many=True).data
+        fields = CalendarViewSerializer.field_names(request)
+        calendars = paginate(request, CalendarViewSerializer.values(fields))
+        response = CalendarViewSerializer.represent(calendars, fields)
         return json_response(data=response, pagination=calendars)
 
 
-class InstrumentView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class InstrumentView(NebulaAPIView):
     @swagger_auto_schema(request_body=InstrumentSerializer)
     def post(self, request, *args, **kwargs):
         form = InstrumentSerializer(data=request.data)
@@ -525,9 +503,9 @@ class InstrumentView(APIView):
             raise APIException(params=form.errors)
         data = form.data
         data.update({
-            "base_asset": Asset.objects.get(pk=form.data.get("base_asset")).asset_id,
-            "quote_asset": Asset.objects.get(pk=form.data.get("quote_asset")).asset_id,
-            "calendar_ins": Calendar.objects.get(pk=form.data.get("calendar_ins")).calendar_id,
+            "base_asset": asset_cache.get(form.data.get("base_asset")).asset_id,
+            "quote_asset": asset_cache.get(form.data.get("quote_asset")).asset_id,
+            "calendar_ins": calendar_cache.get(form.data.get("calendar_ins")).calendar_id,
         })
         data_broker, data_exchange = self.nebula_service.create_instrument_broker(data)
         Instrument(
@@ -551,36 +529,39 @@ class InstrumentView(APIView):
 
         return json_response(status_code=HTTP_201_CREATED)
 
+    @swagger_auto_schema(query_serializer=BaseSerializer())
+    @conditional_list(Instrument)
     def get(self, request):
+        """
+        Get all instruments data
+        Parameter:
+        - "cursor": "next" or "prev" cursor of the previous response, first page without it
+        - "per_page": data per page
+        - "count": true to get the total
+        - "fields": comma separated fields to return, e.g. "id,name", all of them without it
+        """
+        fields = InstrumentSerializer.field_names(request)
+        instruments = paginate(request, InstrumentSerializer.values(fields))
 
-        page = request.GET.get("page", 1)
-        per_page = request.GET.get("per_page", DATA_PER_PAGE_DEFAULT)
-        instrument_response = Instrument.objects.all().order_by("id")
-
-        try:
-            paginator_instrument = Paginator(instrument_response, per_page)
-            instruments = paginator_instrument.get_page(page)
-        except InvalidPage as e:
-            raise APIException(e)
-
-        response = InstrumentSerializer(instruments, many=True).data
+        response = InstrumentSerializer.represent(instruments, fields)
         return json_response(data=response, pagination=instruments)
 
 
-class InstrumentsView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class InstrumentsView(NebulaAPIView):
     @swagger_auto_schema(request_body=UpdateInstrumentSerializer)
     def put(self, request, pk):
+        """
+        Update an instrument in Nebula and Authentium. A new price_precision rescales the prices of its orders,
+        lowering it is refused while an order has a finer price.
+        """
         form = UpdateInstrumentSerializer(data=request.data)
         if not form.is_valid():
             raise APIException(params=form.errors)
 
         instrument = get_object_or_404(Instrument, pk=pk)
+        orders.check_price_precision(instrument, form.data.get("price_precision"))
         data = form.data
-        data.update({"calendar_ins": Calendar.objects.get(pk=form.data.get("calendar_ins")).calendar_id})
+        data.update({"calendar_ins": calendar_cache.get(form.data.get("calendar_ins")).calendar_id})
 
         data_broker = self.nebula_service.update_instrument_broker(instrument.instrument_id_broker, data)
         data_exchange = self.nebula_service.update_instrument_exchange(
@@ -588,118 +569,123 @@ class InstrumentsView(APIView):
             data,
             data_broker
         )
-        Instrument.objects.filter(id=pk).update(
-            symbol=data_exchange["symbol"],
-            quote_currency=data_exchange['quoteCurrency'],
-            calendar_ins_id=form.data.get("calendar_ins"),
-            price_precision=int(data_exchange['pricePrecision']),
-            quantity_precision=int(data_exchange["quantityPrecision"]),
-            min_quantity=float(data_exchange["minQuantity"]),
-            max_quantity=float(data_exchange["maxQuantity"]),
-            status=data_exchange['status'],
-            description=data_exchange['description'],
-            quote_asset_id=Asset.objects.get(name=data_exchange['quoteCurrency']).id
-        )
+        price_precision = int(data_exchange['pricePrecision'])
+        with transaction.atomic():
+            # Order.price is in ticks of the instrument
+            orders.rescale_prices(instrument, price_precision)
+            Instrument.objects.filter(id=pk).update(
+                symbol=data_exchange["symbol"],
+                quote_currency=data_exchange['quoteCurrency'],
+                calendar_ins_id=form.data.get("calendar_ins"),
+                price_precision=price_precision,
+                quantity_precision=int(data_exchange["quantityPrecision"]),
+                min_quantity=float(data_exchange["minQuantity"]),
+                max_quantity=float(data_exchange["maxQuantity"]),
+                status=data_exchange['status'],
+                description=data_exchange['description'],
+                quote_asset_id=Asset.objects.get(name=data_exchange['quoteCurrency']).id,
+                # update() skips auto_now, Last-Modified and the ETags of the instrument come from it
+                updated_at=now(),
+            )
+        # update() sends no post_save signal
+        instrument_cache.invalidate(instrument)
         return json_response(status_code=HTTP_204_NO_CONTENT)
 
+    @conditional_detail(Instrument)
     def get(self, request, pk):
         """
         Get information of a instrument in Authentium using id
         """
-        instrument = get_object_or_404(Instrument, id=pk)
+        instrument = get_object_or_404(InstrumentSerializer.query_set(), id=pk)
         return json_response(data=InstrumentSerializer(instrument).data)
 
 
-class PlaceOrderView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
+class InstrumentMarketView(APIView):
+    def get(self, request, pk):
+        """
+        Whether the market of an instrument is open, from its compiled trading calendar.
+        ?at=<ISO 8601 datetime> asks about another moment than now.
+        Example response:
+            {
+                "is_open": false,
+                "closes_at": null,
+                "next_open": "2022-01-03T08:00:00+00:00"
+            }
+        """
+        ts = None
+        if request.GET.get("at"):
+            at = parse_datetime(request.GET["at"])
+            if at is None:
+                raise APIException(params={"at": ["Enter a valid ISO 8601 datetime."]})
+            ts = (at if is_aware(at) else make_aware(at, timezone.utc)).timestamp()
+        try:
+            market = calendar_index.market(pk, ts)
+        except Instrument.DoesNotExist:
+            raise Http404
+        return json_response(data={
+            key: datetime.fromtimestamp(value, timezone.utc) if isinstance(value, float) else value
+            for key, value in market.items()
+        })
+
 
+class PlaceOrderView(NebulaAPIView):
     @swagger_auto_schema(request_body=PlaceOrderSerializer)
     def post(self, request, *args, **kwargs):
+        """
+        Place an order. Retries sent with the same "Idempotency-Key" header place it only once.
+        With ?async=true (or PLACE_ORDER_ASYNC) the order is stored as Pending and answered with 202 and its id
+        right away, a worker sends it to Nebula afterwards. An order Nebula could not be asked about is answered the
+        same way and keeps its balance reserved until resubmit_pending_orders sends it again.
+        """
+        idempotent = IdempotentRequest(request)
+        return idempotent.run(lambda: self.__place_order(request, idempotent.key))
 
+    def __place_order(self, request, idempotency_key):
         form = PlaceOrderSerializer(data=request.data)
         if not form.is_valid():
             raise APIException(params=form.errors)
 
-        account = form.data.get('account')
-        order_type = form.data.get('order_type')
-        side = form.data.get('side')
-        instrument = form.data.get('instrument')
-        quantity = form.data.get('quantity', 0)
-        price = form.data.get('price', 0)
-        time_in_force = form.data.get('time_in_force')
-
-        account = Account.objects.get(pk=account)
-        symbol_instrument = Instrument.objects.get(pk=instrument)
-        base_asset_id = Asset.objects.get(pk=symbol_instrument.base_asset_id).asset_id
-        quote_asset_id = Asset.objects.get(pk=symbol_instrument.quote_asset_id).asset_id
-
-        base_asset = symbol_instrument.base_asset_id
-        quote_asset = symbol_instrument.quote_asset_id
+        ticket = orders.load_order(form.data)
         # DONE opt in asset for buyer and currency for seller
+        for asset, asset_id in orders.missing_balances(ticket):
+            _ = self.nebula_service.opt_in_asset(ticket.account.account_id, asset_id)
+            orders.open_balance(ticket, asset)
+
+        # DONE lock asset in authentium
+        orders.lock_balance(ticket)
 
-        query_set = Balance.objects.filter(Q(account_id=account.id))
-        if not query_set.filter(Q(asset_id=quote_asset)):  # seller
-            _ = self.nebula_service.opt_in_asset(account.account_id, quote_asset_id)
-            Balance(account_id=account.id, asset_id=quote_asset).save()
-        elif not query_set.filter(Q(asset_id=base_asset)):  # buyer
-            _ = self.nebula_service.opt_in_asset(account.account_id, base_asset_id)
-            Balance(account_id=account.id, asset_id=base_asset).save()
-        if (query_set.get(asset_id=quote_asset).free < quantity * price and side == Side.BUY.value) or (query_set.get(
-                asset_id=base_asset).free < quantity and side == Side.SELL.value):
-            raise APIException(detail="The balance asset is not enough")
-
-            # DONE lock asset in authentiumELL
-        self.__locked_db(side,
-                         query_set,
-                         quantity,
-                         price,
-                         base_asset,
-                         quote_asset)
+        if queue_requested(request):
+            order = OrderQueue().enqueue(ticket)
+            return json_response(data={"id": order.pk, "status": order.status}, status_code=HTTP_202_ACCEPTED)
 
         # place order
-        place_order = self.nebula_service.place_order(account.account_id,
-                                                      order_type,
-                                                      side,
-                                                      symbol_instrument.symbol,
-                                                      quantity,
-                                                      price,
-                                                      time_in_force)
-        Order(
-            account_id=account.id,
-            order_id=place_order["orderId"],
-            order_type=order_type,
-            side=side,
-            instrument_id=symbol_instrument.id,
-            quantity=quantity,
-            price=price,
-            time_in_force=time_in_force,
-            status=place_order["status"]
-        ).save()
+        placement_key = orders.placement_key(idempotency_key)
+        session = orders.oms_session(ticket)
+        try:
+            place_order = orders.order_sender(self.nebula_service, ticket, placement_key, session)()
+        except NebulaNotSentException:
+            # Nebula never saw the order
+            orders.release_balance(ticket)
+            raise
+        except NebulaUnavailableException:
+            # Nebula may have taken the order, the funds stay reserved
+            order = orders.save_unknown_order(ticket, placement_key, session)
+            return json_response(data={"id": order.pk, "status": order.status}, status_code=HTTP_202_ACCEPTED)
+        except APIException:
+            orders.release_balance(ticket)
+            raise
+        orders.save_order(ticket, place_order)
         return json_response(data=f"The place order is added")
 
-    def __locked_db(self, side, query_set, quantity, price, base_asset, quote_asset):
-        locked_object = query_set
-        amount_asset = 0
-        asset_id = -1
-        if side == Side.BUY.value:  # lock asset for seller
-            amount_asset = quantity * price
-            locked_object = query_set.get(asset_id=quote_asset)
-            asset_id = quote_asset
-        if side == Side.SELL.value:  # lock currency for buyer
-            amount_asset = quantity
-            locked_object = query_set.get(asset_id=base_asset)
-            asset_id = base_asset
-        locked_amount = locked_object.locked + amount_asset
-        free_amount = locked_object.free - amount_asset
-        query_set.filter(asset_id=asset_id).update(locked=locked_amount, free=free_amount)
-
     def __locked_asset_admin(self, trader_id, asset_id, amount_asset):
         # TODO lock currency of seller get user id of seller in db and crawl
         pass
 
     def delete(self, request, *args, **kwargs):
+        idempotent = IdempotentRequest(request)
+        return idempotent.run(lambda: self.__cancel_place_order(request, idempotent.key))
+
+    def __cancel_place_order(self, request, idempotency_key):
         # TODO wait exberry process cancel place order
         # TODO PENDING.....
         form = CancelPlaceOrderSerializer(data=request.data)
@@ -708,19 +694,180 @@ class PlaceOrderView(APIView):
         account_id = form.data.get('account_id')
         order_id = form.data.get('order_id')
         instrument = form.data.get('instrument')
-        if Order.objects.get(order_id=order_id).status != 'Executed':
-            place_order = self.nebula_service.cancel_place_order(account_id, order_id, instrument)
-            Order.objects.filter(order_id=order_id).update(status='Canceled')
+        if orders.is_cancelable(order_id):
+            place_order = self.nebula_service.cancel_place_order(
+                account_id, order_id, instrument, idempotency_key=idempotency_key
+            )
+            orders.mark_canceled(order_id)
             return json_response(data='the place order is canceled')
         else:
             return json_response(data='Unsuccessful')
 
 
-class TraderFeeView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
+class PlaceOrderBatchView(NebulaAPIView):
+    @swagger_auto_schema(request_body=PlaceOrderSerializer(many=True))
+    def post(self, request, *args, **kwargs):
+        """
+        Place a basket of orders. Each order gets its own result: an order with an unknown account or instrument,
+        without enough balance or rejected by Nebula fails alone. An order Nebula could not be asked about is stored
+        as Pending with its local id and keeps its balance reserved.
+        Retries sent with the same "Idempotency-Key" header place the basket only once.
+        """
+        idempotent = IdempotentRequest(request)
+        return idempotent.run(lambda: self.__place_orders(request, idempotent.key))
+
+    def __place_orders(self, request, idempotency_key):
+        max_size = settings.PLACE_ORDER_BATCH_MAX_SIZE
+        if not isinstance(request.data, list) or not 0 < len(request.data) <= max_size:
+            raise APIException(detail=f"Expected a list of 1 to {max_size} orders")
+        form = PlaceOrderSerializer(data=request.data, many=True)
+        if not form.is_valid():
+            raise APIException(params={
+                f"{index}.{field}": messages
+                for index, errors in enumerate(form.errors)
+                for field, messages in errors.items()
+            })
+
+        tickets = orders.load_orders(form.data)
+        errors = [ticket if isinstance(ticket, APIException) else None for ticket in tickets]
+
+        for index, ticket in enumerate(tickets):
+            if errors[index] is not None:
+                continue
+            try:
+                # Balances are shared by the tickets of an account, later orders see the ones opened here
+                for asset, asset_id in orders.missing_balances(ticket):
+                    self.nebula_service.opt_in_asset(ticket.account.account_id, asset_id)
+                    orders.open_balance(ticket, asset)
+            except APIException as e:
+                errors[index] = e
+
+        pending = [index for index, error in enumerate(errors) if error is None]
+        for index, error in zip(pending, orders.lock_balances([tickets[index] for index in pending])):
+            errors[index] = error
+
+        reserved = [index for index, error in enumerate(errors) if error is None]
+        keys = {
+            index: orders.placement_key(f"{idempotency_key}:{index}" if idempotency_key else None)
+            for index in reserved
+        }
+        sessions = {index: orders.oms_session(tickets[index]) for index in reserved}
+        placed = self.__send_orders(tickets, keys, sessions)
+        # Orders Nebula may have taken keep their reservation
+        unknown = {
+            index: orders.save_unknown_order(tickets[index], keys[index], sessions[index])
+            for index in reserved if orders.outcome_unknown(placed[index])
+        }
+        for index in reserved:
+            if index in unknown:
+                continue
+            if isinstance(placed[index], APIException):
+                errors[index] = placed[index]
+            elif placed[index] is None:
+                errors[index] = APIException(detail="Unable to process the request")
+
+        orders.release_balances([tickets[index] for index in reserved if errors[index] is not None])
+        Order.objects.bulk_create([orders.new_order(tickets[index], placed[index])
+                                   for index in reserved if errors[index] is None and index not in unknown])
+
+        results = []
+        for index, error in enumerate(errors):
+            if index in unknown:
+                results.append({"index": index, "id": unknown[index].pk, "status": unknown[index].status})
+            elif error is None:
+                result = placed[index]
+                results.append({"index": index, "order_id": result["orderId"], "status": result["status"]})
+            else:
+                results.append({"index": index, "error": error.detail})
+        return json_response(data=results)
+
+    def __send_orders(self, tickets, keys, sessions):
+        """
+        Call NebulaService.place_order for the given tickets, at most PLACE_ORDER_BATCH_CONCURRENCY at a time
+        :param keys: dict of index to the idempotency key of the ticket
+        :param sessions: dict of index to the OmsSession of the ticket, see orders.oms_session
+        :return: dict of index to the Nebula result or the APIException raised
+        """
+        if not keys:
+            return {}
+        # Resolved here, the worker threads must not touch the database
+        service = self.nebula_service
+        return orders.call_concurrently({
+            index: orders.order_sender(service, tickets[index], key, sessions[index]) for index, key in keys.items()
+        }, settings.PLACE_ORDER_BATCH_CONCURRENCY)
+
+
+class CancelOrdersView(NebulaAPIView):
+    @swagger_auto_schema(request_body=CancelOrdersSerializer)
+    def post(self, request, *args, **kwargs):
+        """
+        Cancel every open order of an account, optionally only those of one instrument or side.
+        Example request:
+            {
+                "account": 1,
+                "instrument": 2,
+                "side": "Buy"
+            }
+        Balances are released when Nebula reports the cancellations (consume_executions). Queued orders Nebula has
+        not been sent are canceled here and their balance released at once, they are listed by local id in
+        "dequeued".
+        """
+        idempotent = IdempotentRequest(request)
+        return idempotent.run(lambda: self.__cancel_orders(request, idempotent.key))
+
+    def __cancel_orders(self, request, idempotency_key):
+        form = CancelOrdersSerializer(data=request.data)
+        if not form.is_valid():
+            raise APIException(params=form.errors)
+
+        open_orders = orders.open_orders(
+            form.data.get('account'), form.data.get('instrument'), form.data.get('side')
+        )
+        failed = [
+            {"id": order.pk, "order_id": None, "error": "The order is waiting for Nebula to confirm it, retry later"}
+            for order in open_orders if order.order_id is None and order.idempotency_key is not None
+        ]
+        queued = [order for order in open_orders if order.order_id is None and order.idempotency_key is None]
+        dequeued = orders.dequeue_orders(queued) if queued else []
+        # Picked up by a worker meanwhile
+        failed.extend(
+            {"id": order.pk, "order_id": None, "error": "The order is waiting for Nebula to confirm it, retry later"}
+            for order in queued if order.pk not in dequeued
+        )
+        open_orders = [order for order in open_orders if order.order_id is not None]
+        if not open_orders:
+            return json_response(data={"canceled": [], "dequeued": dequeued, "failed": failed})
+
+        # Resolved here, the worker threads must not touch the database
+        service = self.nebula_service
+        results = orders.call_concurrently({
+            order.pk: functools.partial(
+                service.cancel_place_order,
+                order.account.account_id,
+                order.order_id,
+                order.instrument.symbol,
+                idempotency_key=f"{idempotency_key}:{order.order_id}" if idempotency_key else None,
+            )
+            for order in open_orders
+        }, settings.CANCEL_ORDERS_CONCURRENCY)
+
+        canceled = []
+        for order in open_orders:
+            result = results[order.pk]
+            if isinstance(result, APIException) or result is None:
+                detail = result.detail if result is not None else "Unable to process the request"
+                failed.append({"id": order.pk, "order_id": order.order_id, "error": detail})
+            else:
+                canceled.append(order)
+        orders.mark_orders_canceled([order.pk for order in canceled])
+        return json_response(data={
+            "canceled": [order.order_id for order in canceled],
+            "dequeued": dequeued,
+            "failed": failed,
+        })
 
+
+class TraderFeeView(NebulaAPIView):
     @swagger_auto_schema(request_body=TradingFeeSerializer)
     def post(self, request, *args, **kwargs):
         form = TradingFeeSerializer(data=request.data)
@@ -731,7 +878,7 @@ class TraderFeeView(APIView):
         taker_fee = form.data.get("taker_fee", 0)
         maker_fee = form.data.get("maker_fee", 0)
 
-        instrument_id = Instrument.objects.get(pk=instrument).instrument_id_broker
+        instrument_id = instrument_cache.get(instrument).instrument_id_broker
 
         account_id = Account.objects.get(pk=account).account_id
         _ = self.nebula_service.set_trading_fees(account_id, instrument_id, taker_fee, maker_fee)
@@ -748,11 +895,7 @@ class TraderFeeView(APIView):
         return json_response(status_code=HTTP_201_CREATED)
 
 
-class OptInView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class OptInView(NebulaAPIView):
     @swagger_auto_schema(request_body=OptInSerializer)
     def post(self, request, *args, **kwargs):
         form = OptInSerializer(data=request.data)
@@ -761,7 +904,7 @@ class OptInView(APIView):
         account = form.data.get('account')
         asset = form.data.get('asset')
         account_id = Account.objects.get(pk=account).account_id
-        asset_id = Asset.objects.get(pk=asset).asset_id
+        asset_id = asset_cache.get(asset).asset_id
 
         self.nebula_service.opt_in_asset(account_id, asset_id)
         if not Balance.objects.filter(account_id=account, asset_id=asset):
@@ -769,25 +912,26 @@ class OptInView(APIView):
         return json_response(data="The asset is opted in.")
 
 
-class DepositView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.nebula_service = NebulaService(Auth().login())
-
+class DepositView(NebulaAPIView):
     @swagger_auto_schema(request_body=OptInSerializer)
     def post(self, request, *args, **kwargs):
+        idempotent = IdempotentRequest(request)
+        return idempotent.run(lambda: self.__deposit(request, idempotent.key))
+
+    def __deposit(self, request, idempotency_key):
         form = OptInSerializer(data=request.data)
         if not form.is_valid():
             raise APIException(params=form.errors)
         account = form.data.get('account')
         asset = form.data.get('asset')
         account_id = Account.objects.get(pk=account).account_id
-        asset_id = Asset.objects.get(pk=asset).asset_id
-        total = form.data.get('total')
-        _ = self.nebula_service.send_asset(account_id, asset_id, total)
-
-        bl = get_object_or_404(Balance, account_id=account, asset_id=asset)
-        bl.free += total
-        bl.total += total
-        bl.save()
+        asset = asset_cache.get(asset)
+        total = form.data.get('total') or 0
+        units = orders.deposit_units(asset, total)
+        get_object_or_404(Balance, account_id=account, asset_id=asset.pk)
+        _ = self.nebula_service.send_asset(account_id, asset.asset_id, float(total), idempotency_key=idempotency_key)
+
+        Balance.objects.filter(account_id=account, asset_id=asset.pk).update(
+            free=F('free') + units, total=F('total') + units
+        )
         return json_response(data=f"The asset is sent {total} asset ")
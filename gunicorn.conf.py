@@ -0,0 +1,12 @@
+"""
+Gunicorn settings picked up from the working directory
+"""
+import os
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a worker that exited from the shared Prometheus directory
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)